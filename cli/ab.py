@@ -1,27 +1,38 @@
 from __future__ import annotations
 
+import functools
+import inspect
+import json
 import sys
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, get_type_hints
 
 import typer
 import yaml
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from sandbox.logger import EventLogger
-from sandbox.models import RepoSpec, SandboxConfig, TaskSpec
+from sandbox.backend import make_client
+from sandbox.batch import BatchRunner, instance_id, instance_specs, load_instances
+from sandbox.keep import HANDLE_NAME, load_handle, remove_expired, save_handle
+from sandbox.logger import EventLogger, FsyncPolicy
+from sandbox.models import Backend, FetchStrategy, InstanceResult, RepoSpec, SandboxConfig, TaskSpec
+from sandbox.git_cache import GitMirrorCache, mirror_root
+from sandbox.plan_trials import PlanValidator
 from sandbox.report import RunRecorder
-from sandbox.session import SessionRunner
+from sandbox.runtime_plan import RepoParser, plan_instance, synthesize
+from sandbox.session import RERUN_STAGES, SessionRunner
+from sandbox.wheelhouse import added_wheels, failed_requirements, prefetch as prefetch_wheels, suite_requirements
 
 
 app = typer.Typer(add_completion=False, help="ab sandbox CLI")
 
+WHEELHOUSE_VOLUME = "agentbench-wheelhouse"
+
 
 def load_instance(cfg_path: Path) -> dict:
-    data = yaml.safe_load(cfg_path.read_text())
-    instances = data.get("instances") or []
+    instances = load_instances(cfg_path)
     if not instances:
         raise typer.Exit(code=1, message="No instances defined in config.")
     return instances[0]
@@ -35,40 +46,154 @@ def build_run_dir(artifacts_root: Path, repo_url: str) -> Path:
     return run_dir
 
 
+def package_cache_volumes(enabled: bool) -> dict:
+    if not enabled:
+        return {}
+    return {"pip_cache_volume": "agentbench-pip-cache", "uv_cache_volume": "agentbench-uv-cache"}
+
+
+def wheelhouse_volume(enabled: bool) -> dict:
+    return {"wheelhouse_volume": WHEELHOUSE_VOLUME} if enabled else {}
+
+
+class SandboxOptions:
+    """CLI options shared by `ab` and `ab batch`, declared once.
+
+    ``sandbox_options`` adds these to a command's signature and hands their
+    values to it as one SandboxOptions.
+    """
+
+    git_mirror: bool = typer.Option(False, "--git-mirror/--no-git-mirror", help="Clone from a host-side bare mirror cache.")
+    cache_dir: str = typer.Option("~/.cache/agentbench", help="Host cache root (git mirrors, ...).")
+    fetch_strategy: Optional[FetchStrategy] = typer.Option(
+        None, help="Override the instance fetch strategy (full, shallow, partial)."
+    )
+    package_cache: bool = typer.Option(
+        True, "--package-cache/--no-package-cache", help="Mount shared pip/uv cache volumes into containers."
+    )
+    wheelhouse: bool = typer.Option(
+        False, "--wheelhouse/--no-wheelhouse", help="Mount the shared wheelhouse volume (fill it with `ab prefetch`)."
+    )
+    network: str = typer.Option("bridge", help="Container network mode; 'none' installs from the wheelhouse only.")
+    snapshots: bool = typer.Option(
+        False, "--snapshots/--no-snapshots", help="Reuse post-setup container snapshots across runs."
+    )
+    snapshot_budget_gb: float = typer.Option(50.0, help="Disk budget for setup snapshots (LRU eviction).")
+    command_channel: bool = typer.Option(
+        False, "--command-channel/--no-command-channel", help="Run commands over one persistent exec per container."
+    )
+    single_pass_deps: bool = typer.Option(
+        False,
+        "--single-pass-deps/--no-single-pass-deps",
+        help="Install compat pins and leading pip installs in one resolver run against a constraints file.",
+    )
+    batch_setup: bool = typer.Option(
+        False, "--batch-setup/--no-batch-setup", help="Run all setup commands in one shell, split back per command."
+    )
+    env_lock: bool = typer.Option(
+        False, "--env-lock/--no-env-lock", help="Replay a saved `pip freeze` with `uv pip sync` instead of re-running setup."
+    )
+    two_phase: bool = typer.Option(
+        False, "--two-phase/--no-two-phase", help="Set up in one container, test in a fresh one on shared volumes."
+    )
+    test_network: str = typer.Option("none", help="Network mode of the test container in --two-phase runs.")
+    sharded_tests: bool = typer.Option(
+        False,
+        "--sharded-tests/--no-sharded-tests",
+        help="Run FAIL_TO_PASS/PASS_TO_PASS as parallel pytest shards with per-test JUnit results.",
+    )
+    test_shards: Optional[int] = typer.Option(None, help="Pytest shards for --sharded-tests (default: container CPUs).")
+    keep_container: bool = typer.Option(
+        False, "--keep-container/--no-keep-container", help="Leave containers running for `ab rerun`."
+    )
+    keep_ttl_hours: float = typer.Option(24.0, help="Hours before `ab gc` removes a kept container.")
+    backend: Backend = typer.Option(Backend.cli, help="Docker backend: the CLI or the Engine API socket.")
+    docker_socket: str = typer.Option("/var/run/docker.sock", help="Engine API socket for --backend engine.")
+    log_fsync: FsyncPolicy = typer.Option(FsyncPolicy.none, help="fsync event logs: none, per batch, or per event.")
+    artifact_compression: str = typer.Option("none", help="Compress stored command output: none, gzip or zstd.")
+    dedup_artifacts: bool = typer.Option(
+        True, "--dedup-artifacts/--no-dedup-artifacts", help="Store identical outputs once under <artifacts-dir>/blobs."
+    )
+
+    def __init__(self, **values: Any):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def sandbox_config(self, **extra: Any) -> SandboxConfig:
+        return SandboxConfig(
+            **{name: getattr(self, name) for name in CONFIG_OPTIONS},
+            **package_cache_volumes(self.package_cache),
+            **wheelhouse_volume(self.wheelhouse),
+            **extra,
+        )
+
+
+# SandboxOptions that are SandboxConfig fields of the same name.
+CONFIG_OPTIONS = [name for name in get_type_hints(SandboxOptions) if name in SandboxConfig.model_fields]
+
+
+def sandbox_options(command: Callable[..., None]) -> Callable[..., None]:
+    """Give ``command`` (which takes ``options: SandboxOptions``) every SandboxOptions option."""
+    hints = get_type_hints(SandboxOptions)
+    shared = [
+        inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=vars(SandboxOptions)[name], annotation=hint)
+        for name, hint in hints.items()
+    ]
+    own = [p for p in inspect.signature(command, eval_str=True).parameters.values() if p.name != "options"]
+
+    @functools.wraps(command)
+    def wrapper(**kwargs: Any) -> None:
+        options = SandboxOptions(**{name: kwargs.pop(name) for name in hints})
+        command(options=options, **kwargs)
+
+    wrapper.__signature__ = inspect.Signature(own + shared)  # type: ignore[attr-defined]
+    return wrapper
+
+
 @app.callback(invoke_without_command=True)
+@sandbox_options
 def main(
-    config: Path = typer.Option(..., "--config", help="Path to instance YAML (one instance)."),
+    ctx: typer.Context,
+    config: Optional[Path] = typer.Option(None, "--config", help="Path to instance YAML (one instance)."),
     artifacts_dir: Optional[Path] = typer.Option(Path("artifacts"), help="Root artifacts directory"),
+    follow: bool = typer.Option(False, "--follow", help="Stream command output to the terminal as it arrives."),
+    *,
+    options: SandboxOptions,
 ) -> None:
     """Validate a task config by running clone/checkout/setup/test inside the sandbox."""
+    if ctx.invoked_subcommand is not None:
+        return
+    if config is None:
+        typer.secho("Missing option '--config'.", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=2)
     if not config.is_file():
         raise typer.Exit(code=1, message=f"Config not found: {config}")
 
     inst = load_instance(config)
     run_dir = build_run_dir(artifacts_dir, inst["repo_url"])
     events_path = run_dir / "events.log"
-    logger = EventLogger(events_path, name="ab", echo=True)
+    logger = EventLogger(events_path, name="ab", echo=True, fsync=options.log_fsync)
 
-    sandbox_cfg = SandboxConfig()
-    repo = RepoSpec(
-        repo_url=inst["repo_url"],
-        commit=inst["commit"],
-        apply_compat=True,
-        setuptools_cap=inst.get("setuptools_cap"),
-        pytest_cap=inst.get("pytest_cap"),
-    )
-    task = TaskSpec(
-        setup_commands=inst.get("setup_commands", []),
-        test_command=inst["test_command"],
-        expected_fail=inst.get("expected_fail", True),
-        env=inst.get("env", {}),
-    )
-    test_patch = inst.get("test_patch", "")
+    sandbox_cfg = options.sandbox_config(**({"image": inst["image"]} if inst.get("image") else {}))
+    repo, task, test_patch = instance_specs(inst, fetch_strategy=options.fetch_strategy)
 
-    runner = SessionRunner(sandbox_cfg, logger=logger)
-    with RunRecorder(run_dir) as recorder:
+    def tail(stream: str, chunk: str) -> None:
+        typer.echo(chunk, nl=False, err=stream == "stderr")
+
+    blob_dir = artifacts_dir / "blobs" if options.dedup_artifacts else None
+    with RunRecorder(run_dir, compression=options.artifact_compression, blob_dir=blob_dir) as recorder:
+        runner = SessionRunner(
+            sandbox_cfg,
+            logger=logger,
+            output_dir=run_dir / "output",
+            on_output=tail if follow else None,
+            on_stage=recorder.record_stage,
+        )
         report = runner.run(repo, task, test_patch=test_patch)
         report_path = recorder.save(report, events_path=events_path)
+        logger.close()
+        if save_handle(run_dir, report, test_patch, options.keep_ttl_hours):
+            typer.echo(f"Container {report.container} kept; rerun stages with: ab rerun {run_dir}")
         if report.success:
             typer.secho(f"SUCCESS: see {report_path}", fg=typer.colors.GREEN)
         else:
@@ -76,5 +201,223 @@ def main(
             raise typer.Exit(code=1)
 
 
+@app.command()
+@sandbox_options
+def batch(
+    config: Path = typer.Option(..., "--config", help="Path to instance YAML (all instances are run)."),
+    artifacts_dir: Path = typer.Option(Path("artifacts"), help="Root artifacts directory"),
+    workers: int = typer.Option(8, "--workers", "-j", min=1, help="Number of instances to run concurrently."),
+    only: Optional[List[str]] = typer.Option(None, "--instance", help="Only run these instance ids (repeatable)."),
+    pool_max_uses: int = typer.Option(
+        0, min=0, help="Keep a warm container pool; recycle each container after this many runs (0 disables)."
+    ),
+    *,
+    options: SandboxOptions,
+) -> None:
+    """Validate every instance in a config concurrently and write a batch summary."""
+    if not config.is_file():
+        typer.secho(f"Config not found: {config}", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+    instances = load_instances(config)
+    if only:
+        instances = [inst for inst in instances if instance_id(inst) in set(only)]
+    if not instances:
+        typer.secho("No instances to run.", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+
+    def progress(res: InstanceResult) -> None:
+        status = "PASS" if res.success else "FAIL"
+        color = typer.colors.GREEN if res.success else typer.colors.RED
+        detail = "" if res.success else f" ({res.failed_stage or 'error'}: {res.error})"
+        typer.secho(f"[{status}] {res.instance_id} {res.duration_sec:.1f}s{detail}", fg=color)
+
+    runner = BatchRunner(
+        options.sandbox_config(),
+        artifacts_dir,
+        workers=workers,
+        on_result=progress,
+        fetch_strategy=options.fetch_strategy,
+        pool_max_uses=pool_max_uses or None,
+        log_fsync=options.log_fsync,
+        artifact_compression=options.artifact_compression,
+        dedup_artifacts=options.dedup_artifacts,
+    )
+    typer.echo(f"Running {len(instances)} instance(s) with {runner.workers} worker(s) -> {runner.batch_dir}")
+    report = runner.run(instances, config_path=config)
+    summary_path = runner.save(report)
+    typer.echo(f"{report.passed} passed, {report.failed} failed; summary: {summary_path}")
+    if report.failed:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def rerun(
+    run_dir: Path = typer.Argument(..., help="Run directory of a --keep-container run."),
+    from_stage: str = typer.Option("test", help=f"First stage to run again: {', '.join(RERUN_STAGES)}."),
+    config: Optional[Path] = typer.Option(
+        None, "--config", help="Re-read repo/setup/test settings from this instance YAML instead of the report."
+    ),
+    test_command: Optional[str] = typer.Option(None, help="Override the test command."),
+    follow: bool = typer.Option(False, "--follow", help="Stream command output to the terminal as it arrives."),
+) -> None:
+    """Re-run stages in a kept container and append them to the run's report."""
+    if from_stage not in RERUN_STAGES:
+        typer.secho(f"Unknown stage {from_stage!r}; expected one of {', '.join(RERUN_STAGES)}.", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=2)
+    if not (run_dir / HANDLE_NAME).is_file():
+        typer.secho(f"No kept container or volumes recorded in {run_dir}.", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+    handle = load_handle(run_dir)
+    recorder = RunRecorder(run_dir)
+    report = recorder.resume()
+    sandbox_cfg = SandboxConfig.model_validate(report.sandbox)
+    if config is not None:
+        repo, task, test_patch = instance_specs(load_instance(config))
+    else:
+        repo, task, test_patch = RepoSpec.model_validate(report.repo), TaskSpec.model_validate(report.task), handle.test_patch
+    if test_command:
+        task = task.model_copy(update={"test_command": test_command})
+    report.task = task.model_dump()
+    events_path = recorder.events_path or run_dir / "events.log"
+    logger = EventLogger(events_path, name="ab", echo=True)
+
+    def tail(stream: str, chunk: str) -> None:
+        typer.echo(chunk, nl=False, err=stream == "stderr")
+
+    runner = SessionRunner(
+        sandbox_cfg,
+        logger=logger,
+        output_dir=run_dir / "output",
+        on_output=tail if follow else None,
+        on_stage=recorder.record_stage,
+    )
+    report = runner.rerun(report, repo, task, handle.container or None, from_stage=from_stage, test_patch=test_patch)
+    report_path = recorder.save(report, events_path=events_path)
+    logger.close()
+    if report.success:
+        typer.secho(f"SUCCESS: see {report_path}", fg=typer.colors.GREEN)
+    else:
+        typer.secho(f"FAILURE: see {report_path}", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def gc(
+    backend: Backend = typer.Option(Backend.cli, help="Docker backend: the CLI or the Engine API socket."),
+    docker_socket: str = typer.Option("/var/run/docker.sock", help="Engine API socket for --backend engine."),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only list what would be removed."),
+) -> None:
+    """Remove kept containers whose TTL has passed, then two-phase volumes no container uses any more."""
+    client = make_client(SandboxConfig(backend=backend, docker_socket=docker_socket))
+    removed = remove_expired(client, dry_run=dry_run)
+    for name in removed:
+        typer.echo(f"{'would remove' if dry_run else 'removed'} {name}")
+    typer.echo(f"{len(removed)} expired kept container(s) / orphaned volume(s)")
+
+
+@app.command()
+def plan(
+    repo_url: str = typer.Option(..., "--repo-url", help="Repository to plan for."),
+    commit: str = typer.Option(..., "--commit", help="Commit to plan for."),
+    test_command: str = typer.Option("python -m pytest -q", help="Test command the plan should run."),
+    expected_fail: bool = typer.Option(
+        True, "--expected-fail/--expected-pass", help="Whether the test command should fail once set up."
+    ),
+    test_patch: Optional[Path] = typer.Option(None, help="Patch to apply before testing."),
+    instance: Optional[str] = typer.Option(None, "--instance-id", help="Instance id for the emitted config."),
+    out: Path = typer.Option(Path("plan.yaml"), help="Instance config to write (plan outcome goes next to it as JSON)."),
+    parse_only: bool = typer.Option(False, "--parse-only", help="Only parse and synthesize; do not run trials."),
+    parallel: int = typer.Option(3, min=1, help="Candidate fixes to try at once per round."),
+    max_rounds: int = typer.Option(3, min=0, help="Rounds of fixes after the first trial."),
+    checkpoint_min_sec: float = typer.Option(20.0, help="Commit a checkpoint after setup commands at least this slow."),
+    image: str = typer.Option("runner-core", help="Base image; other Pythons use <image>:py<version>."),
+    cache_dir: str = typer.Option("~/.cache/agentbench", help="Host cache root (git mirrors, parse cache, ...)."),
+    package_cache: bool = typer.Option(
+        True, "--package-cache/--no-package-cache", help="Mount shared pip/uv cache volumes into containers."
+    ),
+    backend: Backend = typer.Option(Backend.cli, help="Docker backend: the CLI or the Engine API socket."),
+    docker_socket: str = typer.Option("/var/run/docker.sock", help="Engine API socket for --backend engine."),
+) -> None:
+    """Synthesize a runtime plan (setup + test commands) for a repo commit and validate it in containers."""
+    sandbox_cfg = SandboxConfig(
+        image=image,
+        git_mirror=True,
+        cache_dir=cache_dir,
+        backend=backend,
+        docker_socket=docker_socket,
+        **package_cache_volumes(package_cache),
+    )
+    logger = EventLogger(out.with_suffix(".events.log"), name="ab", echo=False)
+    mirrors = GitMirrorCache(mirror_root(cache_dir), logger=logger)
+    facts, res = RepoParser(mirrors, Path(cache_dir).expanduser() / "plans", logger=logger).facts(repo_url, commit)
+    if facts is None:
+        logger.close()
+        typer.secho(f"Static parse failed: {res.stderr.strip()}", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+    runtime_plan = synthesize(facts, image, test_command)
+    patch_text = test_patch.read_text() if test_patch else ""
+    success = None
+    if not parse_only:
+        validator = PlanValidator(
+            sandbox_cfg, logger=logger, parallel=parallel, max_rounds=max_rounds, checkpoint_min_sec=checkpoint_min_sec
+        )
+        repo = RepoSpec(repo_url=repo_url, commit=commit)
+        outcome = validator.validate(repo, runtime_plan, facts, test_patch=patch_text, expected_fail=expected_fail)
+        runtime_plan, success = outcome.plan, outcome.success
+        out.with_suffix(".outcome.json").write_text(json.dumps(outcome.model_dump(mode="json"), indent=2))
+        for trial in outcome.trials:
+            typer.echo(f"round {trial.round} [{', '.join(trial.fixes) or 'base'}] {trial.outcome} ({trial.duration_sec:.0f}s)")
+    logger.close()
+    inst = plan_instance(runtime_plan, instance or f"{Path(repo_url).stem}-{commit[:8]}", expected_fail, patch_text)
+    out.write_text(yaml.safe_dump({"instances": [inst]}, sort_keys=False))
+    if success is False:
+        typer.secho(f"No working plan found; best attempt written to {out}", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+    typer.secho(f"Plan written to {out}", fg=typer.colors.GREEN)
+
+
+@app.command()
+def prefetch(
+    config: Path = typer.Option(..., "--config", help="Suite YAML whose setup requirements to prefetch."),
+    only: Optional[List[str]] = typer.Option(None, "--instance", help="Only these instance ids (repeatable)."),
+    image: str = typer.Option("runner-core", help="Image for instances that do not name their own."),
+    workers: int = typer.Option(4, "--workers", "-j", min=1, help="Concurrent pip runs per image."),
+    package_cache: bool = typer.Option(
+        True, "--package-cache/--no-package-cache", help="Mount shared pip/uv cache volumes into containers."
+    ),
+    backend: Backend = typer.Option(Backend.cli, help="Docker backend: the CLI or the Engine API socket."),
+    docker_socket: str = typer.Option("/var/run/docker.sock", help="Engine API socket for --backend engine."),
+) -> None:
+    """Build wheels for every requirement a suite's setup commands name into the shared wheelhouse."""
+    if not config.is_file():
+        typer.secho(f"Config not found: {config}", fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+    instances = [inst for inst in load_instances(config) if not only or instance_id(inst) in set(only)]
+    # Wheels are specific to the interpreter, so each image gets its own pass.
+    by_image: Dict[str, list] = {}
+    for inst in instances:
+        by_image.setdefault(inst.get("image") or image, []).append(instance_specs(inst)[:2])
+    failed: List[str] = []
+    for img, specs in by_image.items():
+        sandbox_cfg = SandboxConfig(
+            image=img,
+            backend=backend,
+            docker_socket=docker_socket,
+            **package_cache_volumes(package_cache),
+            **wheelhouse_volume(True),
+        )
+        requirements = suite_requirements(specs)
+        typer.echo(f"{img}: {len(requirements)} requirement(s) from {len(specs)} instance(s)")
+        results = prefetch_wheels(make_client(sandbox_cfg), sandbox_cfg, requirements, workers=workers)
+        if results and results[0].exit_code != 0:
+            typer.secho(f"{img}: container start failed: {results[0].stderr.strip()}", fg=typer.colors.RED, err=True)
+            raise typer.Exit(code=1)
+        failed += failed_requirements(results)
+        typer.echo(f"{img}: added {added_wheels(results)} wheel(s) to {WHEELHOUSE_VOLUME}")
+    if failed:
+        typer.secho(f"Could not build: {', '.join(failed)}", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+
+
 if __name__ == "__main__":
     app()
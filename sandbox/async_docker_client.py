@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import shlex
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sandbox.capture import BoundedBuffer, OutputCallback, SpillDir, strip_timing
+from sandbox.docker_client import exec_args, rm_args, run_args
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult
+
+
+async def _pump(stream: Optional[asyncio.StreamReader], buf: BoundedBuffer) -> None:
+    if stream is None:
+        return
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return
+        buf.feed(chunk)
+
+
+class AsyncDockerClient:
+    """The container lifecycle subset of DockerClient, as coroutines on ``asyncio.create_subprocess_exec``.
+
+    Commands get the same docker CLI arguments and output capture as
+    DockerClient's. There is no command channel: it is thread-based, so
+    every command is its own ``docker exec``. A timeout or cancellation
+    kills the docker CLI process and reaps it before the coroutine
+    finishes; cancellation is then re-raised.
+    """
+
+    def __init__(
+        self,
+        timeout_sec: int = 120,
+        logger: Optional[EventLogger] = None,
+        spill_dir: Optional[Path] = None,
+        buffer_bytes: int = 64 * 1024,
+        on_output: Optional[OutputCallback] = None,
+    ):
+        self.timeout_sec = timeout_sec
+        self.logger = logger
+        self.buffer_bytes = buffer_bytes
+        self.on_output = on_output
+        self.spill = SpillDir(spill_dir)
+
+    async def _run(
+        self,
+        args: List[str],
+        timeout: Optional[int] = None,
+        env: Optional[Dict[str, str]] = None,
+        cwd: Optional[str] = None,
+        display: Optional[str] = None,
+    ) -> CommandResult:
+        command = display or " ".join(shlex.quote(a) for a in args)
+        start = time.time()
+        exit_code: Optional[int] = None
+        timed_out = False
+        out_path, err_path = self.spill.paths()
+        out = BoundedBuffer("stdout", self.buffer_bytes, self.buffer_bytes, out_path, self.on_output)
+        err = BoundedBuffer("stderr", self.buffer_bytes, self.buffer_bytes, err_path, self.on_output)
+        proc: Optional[asyncio.subprocess.Process] = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env, cwd=cwd
+            )
+            try:
+                async with asyncio.timeout(timeout or self.timeout_sec):
+                    await asyncio.gather(_pump(proc.stdout, out), _pump(proc.stderr, err))
+                    exit_code = await proc.wait()
+            except TimeoutError:
+                timed_out = True
+            res = CommandResult(
+                command=command,
+                cwd=cwd,
+                env=env or {},
+                exit_code=exit_code,
+                stdout=out.text(),
+                stderr=err.text(),
+                stdout_path=str(out_path) if out_path else None,
+                stderr_path=str(err_path) if err_path else None,
+                stdout_bytes=out.total_bytes,
+                stderr_bytes=err.total_bytes,
+                duration_sec=time.time() - start,
+                timed_out=timed_out,
+            )
+            return strip_timing(res)
+        finally:
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+                # Shielded so a second cancellation cannot leave a zombie behind.
+                await asyncio.shield(proc.wait())
+            out.close()
+            err.close()
+            if self.logger:
+                self.logger.info(
+                    "docker command finished",
+                    stage="docker",
+                    data={"command": command, "exit_code": exit_code, "timed_out": timed_out},
+                )
+
+    async def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        workdir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        network: Optional[str] = None,
+        detach: bool = True,
+        cmd: Optional[List[str]] = None,
+        volumes: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> CommandResult:
+        return await self._run(run_args(image, name, workdir, env, network, detach, cmd, volumes, labels))
+
+    async def exec(
+        self,
+        container: str,
+        command: List[str],
+        workdir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[int] = None,
+    ) -> CommandResult:
+        args, display = exec_args(container, command, workdir, env)
+        return await self._run(args, timeout=timeout, display=display)
+
+    async def cp(self, src: str, dest: str) -> CommandResult:
+        return await self._run(["docker", "cp", src, dest])
+
+    async def stop(self, container: str) -> CommandResult:
+        return await self._run(["docker", "stop", container])
+
+    async def rm(self, container: str, force: bool = True) -> CommandResult:
+        return await self._run(rm_args(container, force))
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sandbox.async_docker_client import AsyncDockerClient
+from sandbox.caches import cache_mounts
+from sandbox.capture import OutputCallback
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult, RepoSpec, RunReport, SandboxConfig, StageResult, TaskSpec
+from sandbox.session import SessionRunner, merge_env
+from sandbox.stages import Copy, Request, Shell, drive_async
+
+
+class AsyncSessionRunner:
+    """``SessionRunner.run`` as a coroutine, so one event loop can drive many sandboxes.
+
+    The stages are SessionRunner's own steps (``build_steps``, ``test_steps``),
+    driven here with AsyncDockerClient; their blocking host-side work (git
+    mirror sync, env locks, snapshot bookkeeping) runs in worker threads.
+    The warm pool and the command channel are thread-based and not used
+    here, and neither are two-phase runs.
+
+    If the task is cancelled, the in-flight docker command is killed and the
+    container is removed before the cancellation propagates.
+    """
+
+    def __init__(
+        self,
+        config: SandboxConfig,
+        client: Optional[AsyncDockerClient] = None,
+        logger: Optional[EventLogger] = None,
+        output_dir: Optional[Path] = None,
+        on_output: Optional[OutputCallback] = None,
+        on_stage: Optional[Callable[[RunReport, StageResult], None]] = None,
+    ):
+        if config.two_phase:
+            raise ValueError("two_phase runs are only supported by SessionRunner")
+        self.config = config
+        self.logger = logger
+        self.client = client or AsyncDockerClient(
+            timeout_sec=config.tool_timeout_sec,
+            logger=logger,
+            spill_dir=output_dir,
+            buffer_bytes=config.output_buffer_bytes,
+            on_output=on_output,
+        )
+        self.host = SessionRunner(config, logger=logger, on_stage=on_stage)
+
+    async def _perform(self, request: Request) -> Any:
+        if isinstance(request, Shell):
+            env = self.config.env if request.env is None else request.env
+            return await self.client.exec(request.container, ["bash", "-lc", request.command], env=env, timeout=request.timeout)
+        if isinstance(request, Copy):
+            return await self.client.cp(request.src, request.dest)
+        return await asyncio.to_thread(request.fn, *request.args)
+
+    async def _start(self, container: str, image: str, volumes: List[str], env: Dict[str, str]) -> CommandResult:
+        try:
+            return await self.client.run_container(
+                image=image,
+                name=container,
+                workdir=self.config.workdir,
+                env=env,
+                network=self.config.network,
+                detach=True,
+                volumes=volumes,
+                labels=self.host.container_labels(),
+            )
+        except asyncio.CancelledError:
+            # A cancelled `docker run` may still have created the container.
+            await asyncio.shield(self.client.rm(container, force=True))
+            raise
+
+    async def run(self, repo: RepoSpec, task: TaskSpec, test_patch: str = "") -> RunReport:
+        report = RunReport(
+            sandbox=self.config.model_dump(),
+            repo=repo.model_dump(),
+            task=task.model_dump(),
+            stages=[],
+            started_at=datetime.now().astimezone(),
+            success=False,
+        )
+        container = self.config.container_name or f"sandbox-{uuid.uuid4().hex[:8]}"
+        started = False
+
+        volumes, cache_env = cache_mounts(self.config)
+        clone_source = await asyncio.to_thread(self.host.sync_mirror, report, repo)
+        key, restore_image = (None, None)
+        if self.host.snapshots:
+            key, restore_image = await asyncio.to_thread(self.host.snapshot_lookup, report, repo, task)
+
+        try:
+            image = restore_image or self.config.image
+            start_res = await self._start(container, image, volumes, merge_env(cache_env, self.config.env))
+            started = self.host.start_stage(report, start_res, image)
+            if not started:
+                return self.host.finish(report)
+            steps = self.host.build_steps(report, container, repo, task, test_patch, clone_source, key, restore_image)
+            if await drive_async(steps, self._perform):
+                await drive_async(self.host.test_steps(report, container, task), self._perform)
+            return self.host.finish(report)
+        finally:
+            if cache_env:
+                self.host.record_cache_stats(report)
+            if started and self.config.keep_container:
+                report.container = container
+            elif started:
+                # Shielded so cleanup finishes even when the run itself was cancelled.
+                await asyncio.shield(self.client.rm(container, force=True))
+
+    async def run_many(
+        self, jobs: Iterable[Tuple[RepoSpec, TaskSpec, str]], concurrency: int = 32
+    ) -> List[RunReport]:
+        """Run (repo, task, test_patch) jobs with at most ``concurrency`` sandboxes alive at once."""
+        if self.config.container_name:
+            raise ValueError("run_many needs config.container_name unset so each sandbox gets its own name")
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(repo: RepoSpec, task: TaskSpec, test_patch: str) -> RunReport:
+            async with sem:
+                return await self.run(repo, task, test_patch)
+
+        return list(await asyncio.gather(*(one(*job) for job in jobs)))
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Tuple
+
+from sandbox.capture import OutputCallback
+from sandbox.channel import CommandChannel
+from sandbox.docker_client import DockerClient
+from sandbox.engine_client import EngineClient
+from sandbox.logger import EventLogger
+from sandbox.models import Backend, CommandResult, SandboxConfig
+
+
+class DockerBackend(Protocol):
+    """What SessionRunner, ContainerPool and SnapshotStore need from a docker client.
+
+    DockerClient (the CLI) and EngineClient (the Engine API socket) both
+    implement it and return the same CommandResults.
+    """
+
+    timeout_sec: int
+
+    def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        workdir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        network: Optional[str] = None,
+        detach: bool = True,
+        cmd: Optional[List[str]] = None,
+        volumes: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> CommandResult: ...
+
+    def exec(
+        self,
+        container: str,
+        command: List[str],
+        workdir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[int] = None,
+    ) -> CommandResult: ...
+
+    def open_channel(self, container: str, workdir: str = "/workspace") -> Tuple[CommandChannel, CommandResult]: ...
+
+    def cp(self, src: str, dest: str) -> CommandResult: ...
+
+    def commit(self, container: str, tag: str, labels: Optional[Dict[str, str]] = None) -> CommandResult: ...
+
+    def inspect_image(self, image: str, fmt: str = "{{.Id}}") -> CommandResult: ...
+
+    def containers(self, label: str) -> CommandResult: ...
+
+    def rmi(self, image: str) -> CommandResult: ...
+
+    def create_volume(self, name: str, labels: Optional[Dict[str, str]] = None) -> CommandResult: ...
+
+    def volumes(self, label: str) -> CommandResult: ...
+
+    def volume_users(self, name: str) -> CommandResult: ...
+
+    def rm_volume(self, name: str) -> CommandResult: ...
+
+    def stop(self, container: str) -> CommandResult: ...
+
+    def rm(self, container: str, force: bool = True) -> CommandResult: ...
+
+
+def make_client(
+    config: SandboxConfig,
+    logger: Optional[EventLogger] = None,
+    spill_dir: Optional[Path] = None,
+    on_output: Optional[OutputCallback] = None,
+) -> DockerBackend:
+    if config.backend == Backend.engine:
+        return EngineClient(
+            timeout_sec=config.tool_timeout_sec,
+            logger=logger,
+            spill_dir=spill_dir,
+            buffer_bytes=config.output_buffer_bytes,
+            on_output=on_output,
+            socket_path=config.docker_socket,
+        )
+    return DockerClient(
+        timeout_sec=config.tool_timeout_sec,
+        logger=logger,
+        spill_dir=spill_dir,
+        buffer_bytes=config.output_buffer_bytes,
+        on_output=on_output,
+    )
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import json
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+import yaml
+
+from sandbox.backend import make_client
+from sandbox.keep import save_handle
+from sandbox.logger import EventLogger, FsyncPolicy
+from sandbox.metrics import stage_metrics, stage_percentiles, write_batch_metrics
+from sandbox.models import (
+    BatchReport,
+    FetchStrategy,
+    InstanceResult,
+    RepoSpec,
+    SandboxConfig,
+    StageStatus,
+    TaskSpec,
+)
+from sandbox.pool import ContainerPool
+from sandbox.report import RunRecorder
+from sandbox.session import SessionRunner
+
+
+def load_instances(cfg_path: Path) -> List[dict]:
+    data = yaml.safe_load(cfg_path.read_text()) or {}
+    return list(data.get("instances") or [])
+
+
+def instance_id(inst: dict) -> str:
+    if inst.get("id"):
+        return str(inst["id"])
+    return f"{Path(inst['repo_url']).stem}-{str(inst['commit'])[:8]}"
+
+
+def test_ids(value: Any) -> List[str]:
+    # SWE-bench exports store the id lists either as YAML lists or as JSON strings.
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            value = [value]
+    return [str(v).strip() for v in value or [] if str(v).strip()]
+
+
+def instance_specs(inst: dict, fetch_strategy: Optional[FetchStrategy] = None) -> Tuple[RepoSpec, TaskSpec, str]:
+    repo = RepoSpec(
+        repo_url=inst["repo_url"],
+        commit=inst["commit"],
+        environment_setup_commit=inst.get("environment_setup_commit"),
+        fetch_strategy=fetch_strategy or inst.get("fetch_strategy") or FetchStrategy.full,
+        apply_compat=True,
+        setuptools_cap=inst.get("setuptools_cap"),
+        pytest_cap=inst.get("pytest_cap"),
+    )
+    task = TaskSpec(
+        setup_commands=inst.get("setup_commands", []),
+        test_command=inst["test_command"],
+        expected_fail=inst.get("expected_fail", True),
+        env=inst.get("env", {}),
+        fail_to_pass=test_ids(inst.get("FAIL_TO_PASS")),
+        pass_to_pass=test_ids(inst.get("PASS_TO_PASS")),
+    )
+    return repo, task, inst.get("test_patch", "") or ""
+
+
+def safe_name(value: str) -> str:
+    # Docker names and directory names share the same conservative charset.
+    return re.sub(r"[^a-zA-Z0-9_.-]", "-", value).strip("-.") or "instance"
+
+
+def run_dir_names(ids: List[str]) -> List[str]:
+    """A distinct run directory name per id, in order.
+
+    Repeated ids (two instances of one repo and commit) and ids that only
+    differ in characters ``safe_name`` replaces (``a/b`` and ``a-b``) would
+    share a directory; the later ones get ``-2``, ``-3``, ... suffixes.
+    """
+    names: List[str] = []
+    taken: Set[str] = set()
+    for inst_id in ids:
+        base = name = safe_name(inst_id)
+        n = 1
+        while name.lower() in taken:
+            n += 1
+            name = f"{base}-{n}"
+        # Lower-cased: on a case-insensitive filesystem Foo and foo are one directory.
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+
+class BatchRunner:
+    """Run every instance of a config through SessionRunner with a bounded worker pool."""
+
+    def __init__(
+        self,
+        config: SandboxConfig,
+        artifacts_dir: Path,
+        workers: int = 8,
+        logger: Optional[EventLogger] = None,
+        on_result: Optional[Callable[[InstanceResult], None]] = None,
+        fetch_strategy: Optional[FetchStrategy] = None,
+        pool_max_uses: Optional[int] = None,
+        log_fsync: FsyncPolicy = FsyncPolicy.none,
+        artifact_compression: Optional[str] = None,
+        dedup_artifacts: bool = True,
+    ):
+        self.config = config
+        self.log_fsync = log_fsync
+        self.artifact_compression = artifact_compression
+        # Shared by every batch under the same artifacts root, so identical logs are stored once.
+        self.blob_dir = artifacts_dir / "blobs" if dedup_artifacts else None
+        self.fetch_strategy = fetch_strategy
+        self.workers = max(1, workers)
+        self.on_result = on_result
+        self.batch_dir = artifacts_dir / f"batch-{datetime.now().isoformat().replace(':', '-')}"
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logger or EventLogger(
+            self.batch_dir / "batch_events.log", name="ab-batch", echo=False, fsync=log_fsync
+        )
+        self.pool: Optional[ContainerPool] = None
+        # Two-phase runs mount per-run volumes, which a pre-started container cannot take;
+        # kept containers leave the batch, so they cannot go back to a pool either.
+        if pool_max_uses and not config.two_phase and not config.keep_container:
+            self.pool = ContainerPool(
+                make_client(config, logger=self.logger),
+                config,
+                size=self.workers,
+                max_uses=pool_max_uses,
+                logger=self.logger,
+            )
+
+    def run_instance(self, inst: dict, run_name: Optional[str] = None) -> InstanceResult:
+        """Run one instance in ``<batch_dir>/<run_name>`` (by default its id made path-safe)."""
+        inst_id = instance_id(inst)
+        start = time.time()
+        run_dir = self.batch_dir / (run_name or safe_name(inst_id))
+        run_dir.mkdir(parents=True, exist_ok=True)
+        result = InstanceResult(instance_id=inst_id, run_dir=str(run_dir))
+        events_path = run_dir / "events.log"
+        logger = EventLogger(events_path, name=f"ab:{inst_id}", echo=False, fsync=self.log_fsync)
+        try:
+            repo, task, test_patch = instance_specs(inst, fetch_strategy=self.fetch_strategy)
+            sandbox_cfg = self.config.model_copy(
+                update={"container_name": f"sandbox-{safe_name(inst_id)}-{uuid.uuid4().hex[:6]}", "image": inst.get("image") or self.config.image}
+            )
+            with RunRecorder(run_dir, compression=self.artifact_compression, blob_dir=self.blob_dir) as recorder:
+                runner = SessionRunner(
+                    sandbox_cfg,
+                    logger=logger,
+                    # Pooled containers run the batch image; an instance with its own image cold-starts.
+                    pool=self.pool if sandbox_cfg.image == self.config.image else None,
+                    output_dir=run_dir / "output",
+                    on_stage=recorder.record_stage,
+                )
+                report = runner.run(repo, task, test_patch=test_patch)
+                result.report_path = str(recorder.save(report, events_path=events_path))
+            save_handle(run_dir, report, test_patch, self.config.keep_ttl_hours)
+            result.success = report.success
+            result.stage_metrics = stage_metrics(report)
+            failed = next((s for s in report.stages if s.status == StageStatus.failed), None)
+            if failed is not None:
+                result.failed_stage = failed.name
+                result.error = failed.error
+        except Exception as exc:  # keep the batch going; the summary records the failure
+            result.error = f"{type(exc).__name__}: {exc}"
+        finally:
+            logger.close()
+        result.duration_sec = time.time() - start
+        return result
+
+    def run(self, instances: List[dict], config_path: Optional[Path] = None) -> BatchReport:
+        batch = BatchReport(
+            config=str(config_path) if config_path else None,
+            workers=self.workers,
+            started_at=datetime.now().astimezone(),
+        )
+        self.logger.info("batch start", stage="batch", data={"instances": len(instances), "workers": self.workers})
+        if self.pool:
+            self.pool.resize(min(self.workers, len(instances)))
+            self.pool.prewarm()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ab-batch") as executor:
+                names = run_dir_names([instance_id(inst) for inst in instances])
+                futures = {executor.submit(self.run_instance, inst, name): inst for inst, name in zip(instances, names)}
+                for fut in as_completed(futures):
+                    res = fut.result()
+                    batch.results.append(res)
+                    if self.pool:
+                        # Shrink with the tail of the batch so idle containers are not left running.
+                        self.pool.resize(min(self.workers, len(instances) - len(batch.results)))
+                    self.logger.info(
+                        "instance finished",
+                        stage="batch",
+                        data={"instance_id": res.instance_id, "success": res.success, "failed_stage": res.failed_stage},
+                    )
+                    if self.on_result:
+                        self.on_result(res)
+        finally:
+            if self.pool:
+                self.pool.close()
+        order = {instance_id(inst): i for i, inst in enumerate(instances)}
+        batch.results.sort(key=lambda r: order.get(r.instance_id, len(order)))
+        batch.completed_at = datetime.now().astimezone()
+        batch.stage_percentiles = stage_percentiles(r.stage_metrics for r in batch.results)
+        self.logger.info("batch finished", stage="batch", data={"passed": batch.passed, "failed": batch.failed})
+        self.logger.flush()
+        return batch
+
+    def save(self, batch: BatchReport, name: str = "batch_summary.json") -> Path:
+        data = batch.model_dump(mode="json")
+        data["passed"] = batch.passed
+        data["failed"] = batch.failed
+        out_path = self.batch_dir / name
+        out_path.write_text(json.dumps(data, indent=2))
+        write_batch_metrics(self.batch_dir, batch.stage_percentiles)
+        return out_path
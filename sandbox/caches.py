@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sandbox.git_cache import CONTAINER_MIRROR_ROOT, mirror_root
+from sandbox.models import SandboxConfig, StageResult
+
+# In-container cache locations; the runner image creates them owned by the agent user
+# so fresh named volumes inherit that ownership.
+PIP_CACHE_DIR = "/cache/pip"
+UV_CACHE_DIR = "/cache/uv"
+WHEELHOUSE_DIR = "/cache/wheelhouse"
+
+# pip: "Using cached foo-1.0.whl" is an HTTP-cache hit, "Downloading foo-1.0.whl" a miss.
+# uv: " Downloading numpy (15.7MiB)" is also a miss; uv prints nothing for hits.
+_HIT_RE = re.compile(r"\s*Using cached ")
+_MISS_RE = re.compile(r"\s*Downloading ")
+_BUILD_RE = re.compile(r"\s*Building wheel for ")
+_WHEEL_HIT_RE = re.compile(r"\s*Processing \S+/wheels/")
+_WHEELHOUSE_HIT_RE = re.compile(rf"\s*Processing {WHEELHOUSE_DIR}/")
+
+CACHE_STAGES = ("compat_setuptools", "compat_pytest", "setup", "lock_replay")
+
+
+def cache_mounts(config: SandboxConfig) -> Tuple[List[str], Dict[str, str]]:
+    """Volume specs and env vars for the configured host and package caches.
+
+    Both pip and uv tolerate concurrent writers on a shared cache (atomic
+    renames / file locks), so one named volume can back every container.
+    The git mirror root is mounted read-only when mirrors are enabled. A
+    wheelhouse volume is offered to pip and uv as find-links; with
+    ``network=none`` it is the only source they may use.
+    """
+    volumes: List[str] = []
+    env: Dict[str, str] = {}
+    if config.pip_cache_volume:
+        volumes.append(f"{config.pip_cache_volume}:{PIP_CACHE_DIR}")
+        env["PIP_CACHE_DIR"] = PIP_CACHE_DIR
+    if config.uv_cache_volume:
+        volumes.append(f"{config.uv_cache_volume}:{UV_CACHE_DIR}")
+        env["UV_CACHE_DIR"] = UV_CACHE_DIR
+    if config.wheelhouse_volume:
+        volumes.append(f"{config.wheelhouse_volume}:{WHEELHOUSE_DIR}")
+        env["PIP_FIND_LINKS"] = WHEELHOUSE_DIR
+        env["UV_FIND_LINKS"] = WHEELHOUSE_DIR
+        if config.network == "none":
+            # No index is reachable: fail fast on a missing wheel instead of retrying PyPI.
+            env["PIP_NO_INDEX"] = "1"
+            env["UV_OFFLINE"] = "1"
+    if config.git_mirror:
+        volumes.append(f"{mirror_root(config.cache_dir)}:{CONTAINER_MIRROR_ROOT}:ro")
+    return volumes, env
+
+
+def _lines(text: str, spilled: Optional[str]) -> Iterator[str]:
+    # In-memory output may be trimmed to head and tail; the spill file has all of it.
+    if spilled and Path(spilled).is_file():
+        with open(spilled, errors="replace") as fh:
+            yield from fh
+    else:
+        yield from text.splitlines()
+
+
+def cache_stats(stages: Iterable[StageResult]) -> Dict[str, int]:
+    """Count package cache hits and misses in install output."""
+    stats = {"hits": 0, "misses": 0, "wheel_builds": 0, "wheel_hits": 0, "wheelhouse_hits": 0}
+    for stage in stages:
+        if stage.name not in CACHE_STAGES:
+            continue
+        for cmd in stage.commands:
+            for source in ((cmd.stdout, cmd.stdout_path), (cmd.stderr, cmd.stderr_path)):
+                for line in _lines(*source):
+                    stats["hits"] += bool(_HIT_RE.match(line))
+                    stats["misses"] += bool(_MISS_RE.match(line))
+                    stats["wheel_builds"] += bool(_BUILD_RE.match(line))
+                    stats["wheel_hits"] += bool(_WHEEL_HIT_RE.match(line))
+                    stats["wheelhouse_hits"] += bool(_WHEELHOUSE_HIT_RE.match(line))
+    return stats
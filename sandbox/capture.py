@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import itertools
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+from typing import IO, Callable, List, Optional, Tuple
+
+from sandbox.models import CommandResult
+
+# Live-tail callback: (stream name, decoded chunk).
+OutputCallback = Callable[[str, str], None]
+
+# `bash -c` wrapper that times the command inside the container and appends
+# "\n@@AB-TIME:<start>:<end>@@\n" to stderr; strip_timing() removes it again.
+_TIMER = 's=$EPOCHREALTIME; "$@"; rc=$?; printf \'\\n@@AB-TIME:%s:%s@@\\n\' "$s" "$EPOCHREALTIME" >&2; exit $rc'
+_TIMING_RE = re.compile(r"\n@@AB-TIME:([\d.,]*):([\d.,]*)@@\n$")
+
+
+def timed_command(command: List[str]) -> List[str]:
+    """Wrap a bash command so its in-container run time comes back on stderr."""
+    if not command or command[0] != "bash":
+        return command
+    return ["bash", "-c", _TIMER, "ab-timer", *command]
+
+
+def strip_timing(res: CommandResult) -> CommandResult:
+    """Move the timer line from the end of stderr (and its spill file) into ``in_container_sec``."""
+    match = _TIMING_RE.search(res.stderr)
+    if not match:
+        return res
+    size = len(match.group(0).encode("utf-8"))
+    res.stderr = res.stderr[: match.start()]
+    if res.stderr_bytes is not None:
+        res.stderr_bytes -= size
+    if res.stderr_path and Path(res.stderr_path).is_file():
+        os.truncate(res.stderr_path, max(Path(res.stderr_path).stat().st_size - size, 0))
+    try:
+        start, end = (float(v.replace(",", ".")) for v in match.groups())
+        res.in_container_sec = max(end - start, 0.0)
+    except ValueError:
+        pass  # bash without $EPOCHREALTIME (< 5.0)
+    return res
+
+
+class SpillDir:
+    """Hands out unique stdout/stderr file pairs under ``root`` (nothing when root is None)."""
+
+    def __init__(self, root: Optional[Path]):
+        self.root = root
+        self._seq = itertools.count()
+        if root is not None:
+            root.mkdir(parents=True, exist_ok=True)
+
+    def paths(self) -> Tuple[Optional[Path], Optional[Path]]:
+        if self.root is None:
+            return None, None
+        stem = f"{next(self._seq):04d}-{uuid.uuid4().hex[:6]}"
+        return self.root / f"{stem}.stdout", self.root / f"{stem}.stderr"
+
+
+class BoundedBuffer:
+    """Keeps a bounded head and tail of a byte stream, spilling all of it to a file.
+
+    Memory stays at ``head_bytes + tail_bytes`` however much is fed; the full
+    stream is recoverable from ``spill_path`` when one is given.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        head_bytes: int = 64 * 1024,
+        tail_bytes: int = 64 * 1024,
+        spill_path: Optional[Path] = None,
+        on_output: Optional[OutputCallback] = None,
+    ):
+        self.name = name
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.spill_path = spill_path
+        self.on_output = on_output
+        self.total_bytes = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._spill = spill_path.open("wb") if spill_path else None
+
+    def feed(self, chunk: bytes) -> None:
+        self.total_bytes += len(chunk)
+        if self._spill:
+            self._spill.write(chunk)
+        if self.on_output:
+            self.on_output(self.name, chunk.decode("utf-8", errors="replace"))
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk and self.tail_bytes:
+            self._tail += chunk
+            if len(self._tail) > self.tail_bytes:
+                del self._tail[: len(self._tail) - self.tail_bytes]
+
+    def close(self) -> None:
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self._head) + len(self._tail)
+
+    def text(self) -> str:
+        head = self._head.decode("utf-8", errors="replace")
+        tail = self._tail.decode("utf-8", errors="replace")
+        if not self.truncated:
+            return head + tail
+        elided = self.total_bytes - len(self._head) - len(self._tail)
+        return f"{head}\n... [{elided} bytes elided] ...\n{tail}"
+
+
+class StreamCapture(BoundedBuffer):
+    """Drains a blocking pipe into a BoundedBuffer on a background thread."""
+
+    def __init__(
+        self,
+        pipe: IO[bytes],
+        name: str,
+        head_bytes: int = 64 * 1024,
+        tail_bytes: int = 64 * 1024,
+        spill_path: Optional[Path] = None,
+        on_output: Optional[OutputCallback] = None,
+    ):
+        super().__init__(name, head_bytes, tail_bytes, spill_path, on_output)
+        self.pipe = pipe
+        self._thread = threading.Thread(target=self._drain, name=f"capture-{name}", daemon=True)
+        self._thread.start()
+
+    def _drain(self) -> None:
+        try:
+            while True:
+                chunk = self.pipe.read1(65536) if hasattr(self.pipe, "read1") else self.pipe.read(65536)
+                if not chunk:
+                    break
+                self.feed(chunk)
+        finally:
+            self.close()
+            self.pipe.close()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        self._thread.join(timeout)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import select
+import struct
+import subprocess
+import threading
+import time
+from typing import Dict, Optional
+
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult
+
+# Frames in both directions are a 4-byte big-endian length followed by a UTF-8
+# JSON object. The server keeps the shell's cwd and exported env between
+# requests, starting from the environment of a login shell so commands see the
+# same PATH as ``docker exec ... bash -lc``.
+CHANNEL_SERVER = r'''
+import json, os, signal, struct, subprocess, sys, tempfile, time
+
+inp = sys.stdin.buffer
+out = sys.stdout.buffer
+
+def read_frame():
+    head = inp.read(4)
+    if len(head) < 4:
+        return None
+    (size,) = struct.unpack(">I", head)
+    return json.loads(inp.read(size).decode("utf-8"))
+
+def write_frame(obj):
+    data = json.dumps(obj).encode("utf-8")
+    out.write(struct.pack(">I", len(data)) + data)
+    out.flush()
+
+def parse_env(raw):
+    env = {}
+    for item in raw.split(b"\0"):
+        if b"=" in item:
+            k, v = item.split(b"=", 1)
+            env[k.decode("utf-8", "replace")] = v.decode("utf-8", "replace")
+    return env
+
+def bounded(path, limit):
+    # Head and tail only, read back from the output file, so a noisy command
+    # floods neither this process nor the host side.
+    size = os.path.getsize(path)
+    with open(path, "rb") as fh:
+        if not limit or size <= 2 * limit:
+            return fh.read().decode("utf-8", "replace"), size
+        head = fh.read(limit)
+        fh.seek(size - limit)
+        tail = fh.read(limit)
+    return "%s\n... [%d bytes elided] ...\n%s" % (
+        head.decode("utf-8", "replace"), size - 2 * limit, tail.decode("utf-8", "replace")), size
+
+state_dir = tempfile.mkdtemp(prefix="ab-channel-")
+env = parse_env(subprocess.run(["bash", "-lc", "env -0"], stdout=subprocess.PIPE).stdout)
+env.pop("_", None)
+cwd = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
+trap = (
+    'trap \'__ab_rc=$?; pwd > "$AB_STATE/cwd"; env -0 > "$AB_STATE/env"; exit $__ab_rc\' EXIT\n'
+)
+write_frame({"ready": True, "pid": os.getpid()})
+
+while True:
+    req = read_frame()
+    if req is None or req.get("op") == "close":
+        break
+    overrides = req.get("env") or {}
+    run_env = dict(env)
+    run_env.update(overrides)
+    run_env["AB_STATE"] = state_dir
+    for name in ("cwd", "env"):
+        try:
+            os.unlink(os.path.join(state_dir, name))
+        except OSError:
+            pass
+    start = time.time()
+    timed_out = False
+    out_path, err_path = os.path.join(state_dir, "stdout"), os.path.join(state_dir, "stderr")
+    with open(out_path, "wb") as out_fh, open(err_path, "wb") as err_fh:
+        proc = subprocess.Popen(
+            ["bash", "-c", trap + req["cmd"]],
+            cwd=cwd if os.path.isdir(cwd) else "/",
+            env=run_env,
+            stdin=subprocess.DEVNULL,
+            stdout=out_fh,
+            stderr=err_fh,
+            start_new_session=True,
+        )
+        try:
+            proc.wait(timeout=req.get("timeout"))
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+    duration = time.time() - start
+    stdout, stdout_bytes = bounded(out_path, req.get("limit"))
+    stderr, stderr_bytes = bounded(err_path, req.get("limit"))
+    try:
+        with open(os.path.join(state_dir, "cwd")) as fh:
+            cwd = fh.read().strip() or cwd
+        with open(os.path.join(state_dir, "env"), "rb") as fh:
+            new_env = parse_env(fh.read())
+        for key in ("AB_STATE", "_", "SHLVL", "__ab_rc"):
+            new_env.pop(key, None)
+        for key, value in overrides.items():
+            # Per-command overrides do not stick unless the command changed them.
+            if new_env.get(key) == value:
+                if key in env:
+                    new_env[key] = env[key]
+                else:
+                    new_env.pop(key, None)
+        env = new_env
+    except OSError:
+        pass
+    write_frame({
+        "exit_code": None if timed_out else proc.returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "stdout_bytes": stdout_bytes,
+        "stderr_bytes": stderr_bytes,
+        "duration_sec": duration,
+        "timed_out": timed_out,
+        "cwd": cwd,
+    })
+'''
+
+
+class ChannelError(RuntimeError):
+    pass
+
+
+class CommandChannel:
+    """Long-lived helper process inside a container, driven over stdin/stdout.
+
+    One ``docker exec -i`` carries every command, so there is no per-command
+    CLI startup or login shell. ``cd`` and ``export`` persist between commands.
+    Output comes back as head and tail only, with no host spill file, so
+    callers that parse the full output must use a plain exec instead.
+    """
+
+    def __init__(
+        self,
+        container: str,
+        workdir: str = "/workspace",
+        timeout_sec: int = 120,
+        logger: Optional[EventLogger] = None,
+        buffer_bytes: int = 64 * 1024,
+    ):
+        self.container = container
+        self.workdir = workdir
+        self.timeout_sec = timeout_sec
+        self.buffer_bytes = buffer_bytes
+        self.logger = logger
+        self.proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _write(self, obj: dict) -> None:
+        assert self.proc is not None and self.proc.stdin is not None
+        data = json.dumps(obj).encode("utf-8")
+        self.proc.stdin.write(struct.pack(">I", len(data)) + data)
+        self.proc.stdin.flush()
+
+    def _read_exact(self, size: int, deadline: float) -> bytes:
+        assert self.proc is not None and self.proc.stdout is not None
+        fd = self.proc.stdout.fileno()
+        buf = bytearray()
+        while len(buf) < size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ChannelError("timed out waiting for channel response")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = self.proc.stdout.read1(size - len(buf))
+            if not chunk:
+                raise ChannelError("channel closed")
+            buf += chunk
+        return bytes(buf)
+
+    def _read(self, deadline: float) -> dict:
+        (size,) = struct.unpack(">I", self._read_exact(4, deadline))
+        return json.loads(self._read_exact(size, deadline).decode("utf-8"))
+
+    def open(self) -> CommandResult:
+        start = time.time()
+        args = ["docker", "exec", "-i", self.container, "python3", "-u", "-c", CHANNEL_SERVER, self.workdir]
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            hello = self._read(time.time() + self.timeout_sec)
+            ok = bool(hello.get("ready"))
+        except (ChannelError, ValueError, struct.error) as exc:
+            self.close()
+            ok, hello = False, {"error": str(exc)}
+        if self.logger:
+            self.logger.info("channel open", stage="channel", data={"container": self.container, "ok": ok})
+        return CommandResult(
+            command=f"channel open {self.container}",
+            cwd=self.workdir,
+            exit_code=0 if ok else 1,
+            stdout=json.dumps(hello),
+            duration_sec=time.time() - start,
+        )
+
+    def run(self, command: str, env: Optional[Dict[str, str]] = None, timeout: Optional[int] = None) -> CommandResult:
+        timeout = timeout or self.timeout_sec
+        start = time.time()
+        with self._lock:
+            if not self.alive:
+                raise ChannelError("channel is not open")
+            self._write({"op": "run", "cmd": command, "env": env or {}, "timeout": timeout, "limit": self.buffer_bytes})
+            try:
+                # The server enforces the timeout; allow it time to kill and report back.
+                resp = self._read(time.time() + timeout + 30)
+            except ChannelError:
+                self.close()
+                raise
+        if self.logger:
+            self.logger.info(
+                "channel command finished",
+                stage="channel",
+                data={"command": command, "exit_code": resp.get("exit_code"), "timed_out": resp.get("timed_out")},
+            )
+        return CommandResult(
+            command=command,
+            cwd=resp.get("cwd"),
+            env=env or {},
+            exit_code=resp.get("exit_code"),
+            stdout=resp.get("stdout", ""),
+            stderr=resp.get("stderr", ""),
+            stdout_bytes=resp.get("stdout_bytes"),
+            stderr_bytes=resp.get("stderr_bytes"),
+            duration_sec=time.time() - start,
+            in_container_sec=resp.get("duration_sec"),
+            timed_out=bool(resp.get("timed_out")),
+        )
+
+    def close(self) -> None:
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            if proc.poll() is None and proc.stdin is not None:
+                data = json.dumps({"op": "close"}).encode("utf-8")
+                proc.stdin.write(struct.pack(">I", len(data)) + data)
+                proc.stdin.close()
+            proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
@@ -1,35 +1,100 @@
 from __future__ import annotations
 
-from typing import Optional
+import hashlib
+import json
+import os
+import re
+import shlex
+from pathlib import Path
+from typing import List, Optional, Tuple
 
-from sandbox.docker_client import DockerClient
+from sandbox.backend import DockerBackend
+from sandbox.git_cache import GitMirrorCache, normalize_url
 from sandbox.logger import EventLogger
-from sandbox.scripts.snippets import COLLECTIONS_REWRITE
+from sandbox.models import CommandResult
+from sandbox.scripts.snippets import COLLECTIONS_PATTERN, COLLECTIONS_REPLACEMENTS, COLLECTIONS_REWRITE
 
 
-def apply_collections_rewrite(client: DockerClient, container: str, workdir: str = "/workspace/repo", logger: Optional[EventLogger] = None) -> int:
-    script = COLLECTIONS_REWRITE.format(workdir=workdir)
-    res = client.exec(container, ["bash", "-lc", script])
+def collections_rewrite_command(workdir: str = "/workspace/repo") -> str:
+    return COLLECTIONS_REWRITE.format(workdir=workdir, pattern=COLLECTIONS_PATTERN, repl=COLLECTIONS_REPLACEMENTS)
+
+
+def rewritten_files(stdout: str) -> List[str]:
+    """Files reported by the collections rewrite as changed."""
+    return [line[len("rewrote "):] for line in stdout.splitlines() if line.startswith("rewrote ")]
+
+
+def patch_needs_rewrite(patch: str) -> bool:
+    """True when lines added by ``patch`` contain something the rewrite would change."""
+    pattern = re.compile(COLLECTIONS_PATTERN)
+    return any(line.startswith("+") and pattern.search(line) for line in patch.splitlines())
+
+
+class CompatPrecheck:
+    """Decides on the host whether the collections rewrite has anything to do.
+
+    Runs ``git grep`` for the rewrite pattern over the commit in the host
+    mirror, before any container exists, and caches the matching files as
+    ``<root>/<key>.json`` per (repo, commit, pattern). A commit's tree never
+    changes, so entries never go stale.
+    """
+
+    def __init__(self, mirrors: GitMirrorCache, root: Path, logger: Optional[EventLogger] = None):
+        self.mirrors = mirrors
+        self.root = root.expanduser()
+        self.logger = logger
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(self, repo_url: str, commit: str) -> str:
+        blob = json.dumps([normalize_url(repo_url), commit, COLLECTIONS_PATTERN])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+    def candidates(self, repo_url: str, commit: str) -> Tuple[Optional[List[str]], CommandResult]:
+        """Files at ``commit`` the rewrite would touch; None when the mirror cannot tell."""
+        path = self.root / f"{self.key(repo_url, commit)}.json"
+        try:
+            files = json.loads(path.read_text())["files"]
+            return files, CommandResult(command=f"compat precheck cache {path.name}", cwd=str(self.root), exit_code=0 if files else 1, stdout="".join(f"{f}\n" for f in files))
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+        if not self.mirrors.has_commit(repo_url, commit):
+            return None, CommandResult(command=f"compat precheck {commit}", cwd=str(self.root), exit_code=2, stderr="commit not in mirror\n")
+        res = self.mirrors.grep(repo_url, commit, COLLECTIONS_PATTERN, ["*.py"])
+        if res.exit_code not in (0, 1):
+            return None, res
+        files = res.stdout.splitlines()
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"repo_url": repo_url, "commit": commit, "files": files}))
+        os.replace(tmp, path)
+        if self.logger:
+            self.logger.info("compat precheck", stage="compat_rewrite", data={"commit": commit, "files": len(files)})
+        return files, res
+
+
+def setuptools_cap_command(version_cap: str = "setuptools<69", workdir: str = "/workspace/repo") -> str:
+    return f"cd {workdir} && python -m pip install -U pip wheel {shlex.quote(version_cap)}"
+
+
+def pytest_cap_command(version: str, workdir: str = "/workspace/repo") -> str:
+    return f"cd {workdir} && python -m pip install {shlex.quote(f'pytest=={version}')}"
+
+
+def apply_collections_rewrite(client: DockerBackend, container: str, workdir: str = "/workspace/repo", logger: Optional[EventLogger] = None) -> int:
+    res = client.exec(container, ["bash", "-lc", collections_rewrite_command(workdir)])
     if logger:
-        logger.info("compat_collections", stage="compat_rewrite", data={"exit": res.exit_code})
+        logger.info("compat_collections", stage="compat_rewrite", data={"exit": res.exit_code, "changed": rewritten_files(res.stdout)})
     return res.exit_code or 0
 
 
-def apply_setuptools_cap(client: DockerClient, container: str, version_cap: str = "setuptools<69", workdir: str = "/workspace/repo", logger: Optional[EventLogger] = None) -> int:
-    res = client.exec(
-        container,
-        ["bash", "-lc", f"cd {workdir} && python -m pip install -U pip wheel {version_cap}"],
-    )
+def apply_setuptools_cap(client: DockerBackend, container: str, version_cap: str = "setuptools<69", workdir: str = "/workspace/repo", logger: Optional[EventLogger] = None) -> int:
+    res = client.exec(container, ["bash", "-lc", setuptools_cap_command(version_cap, workdir)])
     if logger:
         logger.info("compat_setuptools_cap", stage="setup", data={"exit": res.exit_code, "cap": version_cap})
     return res.exit_code or 0
 
 
-def apply_pytest_cap(client: DockerClient, container: str, version: str, workdir: str = "/workspace/repo", logger: Optional[EventLogger] = None) -> int:
-    res = client.exec(
-        container,
-        ["bash", "-lc", f"cd {workdir} && python -m pip install pytest=={version}"],
-    )
+def apply_pytest_cap(client: DockerBackend, container: str, version: str, workdir: str = "/workspace/repo", logger: Optional[EventLogger] = None) -> int:
+    res = client.exec(container, ["bash", "-lc", pytest_cap_command(version, workdir)])
     if logger:
         logger.info("compat_pytest_cap", stage="setup", data={"exit": res.exit_code, "version": version})
     return res.exit_code or 0
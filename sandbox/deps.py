@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import re
+import shlex
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sandbox.git_cache import normalize_url
+from sandbox.models import CommandResult, DependencyPin, DependencyPlan, RepoSpec, TaskSpec
+
+CONSTRAINTS_PATH = "/tmp/ab-constraints.txt"
+PROBE_CONSTRAINTS_PATH = "/tmp/ab-constraints-probe.txt"
+
+# Pins known to be needed for specific repos, keyed by lowercase "owner/name".
+REPO_PINS: Dict[str, List[str]] = {
+    "astropy/astropy": ["setuptools<58"],
+    "numpy/numpy": ["setuptools<58"],
+    "psf/requests": ["pytest==6.0.0", "py>=1.8.2"],
+}
+# Installs that only refresh the installer itself; they stay separate commands
+# so later builds (``-e .``) run with the upgraded setuptools.
+BOOTSTRAP_PROJECTS = {"pip", "setuptools", "wheel"}
+
+_PIP_PREFIXES = (
+    ["pip", "install"],
+    ["pip3", "install"],
+    ["python", "-m", "pip", "install"],
+    ["python3", "-m", "pip", "install"],
+)
+_FLAGS = {"-U", "--upgrade", "-q", "--quiet"}
+_VALUE_OPTIONS = {"-r", "--requirement", "-e", "--editable", "-c", "--constraint"}
+_NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+def project_name(requirement: str) -> str:
+    match = _NAME_RE.match(requirement.strip())
+    return re.sub(r"[-_.]+", "-", match.group(0)).lower() if match else ""
+
+
+def repo_slug(repo_url: str) -> str:
+    """Lowercase ``owner/name`` of a repo URL, scp-style remote or bare slug."""
+    path = normalize_url(repo_url).replace(":", "/")
+    return "/".join(path.lower().split("/")[-2:])
+
+
+def repo_pins(repo_url: str) -> List[str]:
+    return list(REPO_PINS.get(repo_slug(repo_url), []))
+
+
+def compat_pins(repo: RepoSpec) -> List[DependencyPin]:
+    """Explicit caps, then the repo pins for projects the caps do not already pin."""
+    pins: List[DependencyPin] = []
+    if repo.setuptools_cap:
+        pins.append(DependencyPin(requirement=repo.setuptools_cap, source="setuptools_cap"))
+    if repo.pytest_cap:
+        pins.append(DependencyPin(requirement=f"pytest=={repo.pytest_cap}", source="pytest_cap"))
+    capped = {project_name(p.requirement) for p in pins}
+    pins += [DependencyPin(requirement=r, source="repo_compat") for r in repo_pins(repo.repo_url) if project_name(r) not in capped]
+    return pins
+
+
+def parse_pip_install(command: str) -> Optional[Tuple[bool, List[str]]]:
+    """(upgrade, arguments) for a plain ``pip install``; None for anything else.
+
+    Only commands whose effect is exactly "install these requirements" are
+    accepted: no shell operators or expansions, and no pip options beyond
+    upgrade/quiet, ``-r``, ``-e`` and ``-c``.
+    """
+    if "$" in command or "`" in command:
+        return None
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return None
+    if any(t and all(c in lexer.punctuation_chars for c in t) for t in tokens):
+        return None
+    prefix = next((p for p in _PIP_PREFIXES if tokens[: len(p)] == p), None)
+    if prefix is None:
+        return None
+    upgrade = False
+    args: List[str] = []
+    rest = iter(tokens[len(prefix):])
+    for token in rest:
+        if token in _FLAGS:
+            upgrade = upgrade or token in ("-U", "--upgrade")
+        elif token in _VALUE_OPTIONS:
+            value = next(rest, None)
+            if value is None:
+                return None
+            args += [token, value]
+        elif token.startswith("-"):
+            return None
+        else:
+            args.append(token)
+    return upgrade, args
+
+
+def install_command(args: Sequence[str], upgrade: bool = False, dry_run: bool = False) -> str:
+    flags = (["-U"] if upgrade else []) + (["--dry-run"] if dry_run else [])
+    return shlex.join(["python", "-m", "pip", "install", *flags, *args])
+
+
+def constraints_command(pins: Sequence[DependencyPin], path: str = CONSTRAINTS_PATH) -> str:
+    return shlex.join(["printf", r"%s\n", *(p.requirement for p in pins)]) + f" > {shlex.quote(path)}"
+
+
+def constraint_env(env: Dict[str, str], path: str) -> Dict[str, str]:
+    """``env`` with ``path`` added to PIP_CONSTRAINT (pip splits that variable on whitespace)."""
+    existing = env.get("PIP_CONSTRAINT")
+    return {**env, "PIP_CONSTRAINT": f"{existing} {path}" if existing else path}
+
+
+def _is_bootstrap(args: List[str]) -> bool:
+    return bool(args) and all(not a.startswith("-") and project_name(a) in BOOTSTRAP_PROJECTS for a in args)
+
+
+def plan_dependencies(repo: RepoSpec, task: TaskSpec, constraints_path: str = CONSTRAINTS_PATH) -> DependencyPlan:
+    """Fold the compat pins and the leading ``pip install`` setup commands into one install.
+
+    Pins go to a constraints file that PIP_CONSTRAINT applies to every pip
+    run in setup, and are installed by the single-pass install together with
+    every plain ``pip install`` at the start of ``task.setup_commands``.
+    Installs of only pip/setuptools/wheel run first, as written, so the
+    single pass builds with the upgraded tools. The first other command,
+    including a ``-U`` install of anything else, ends the merge; it and
+    everything after it run as written, so ``-U`` never spreads to merged
+    requirements.
+    """
+    pins = compat_pins(repo)
+    setup = list(task.setup_commands or [])
+    args: List[str] = []
+    bootstrap: List[str] = []
+    merged: List[str] = []
+    consumed = 0
+    for cmd in setup:
+        parsed = parse_pip_install(cmd)
+        if parsed is None:
+            break
+        upgrade, cmd_args = parsed
+        if _is_bootstrap(cmd_args):
+            bootstrap.append(cmd)
+        elif upgrade:
+            break
+        else:
+            args += cmd_args
+            merged.append(cmd)
+        consumed += 1
+    args += [p.requirement for p in pins]
+    # Keep option pairs intact while dropping repeated requirements.
+    seen: set = set()
+    deduped: List[str] = []
+    i = 0
+    while i < len(args):
+        item = tuple(args[i : i + 2]) if args[i] in _VALUE_OPTIONS else (args[i],)
+        if item not in seen:
+            seen.add(item)
+            deduped += item
+        i += len(item)
+
+    commands: List[str] = []
+    env: Dict[str, str] = {}
+    if pins:
+        commands.append(constraints_command(pins, constraints_path))
+        env = {"PIP_CONSTRAINT": constraints_path}
+    commands += bootstrap
+    install_index: Optional[int] = None
+    if deduped:
+        install_index = len(commands)
+        commands.append(install_command(deduped))
+    commands += setup[consumed:]
+    return DependencyPlan(
+        pins=pins,
+        constraints_path=constraints_path,
+        commands=commands,
+        install_index=install_index,
+        merged=merged,
+        env=env,
+    )
+
+
+def probe_commands(plan: DependencyPlan) -> List[Tuple[DependencyPin, str]]:
+    """One ``pip install --dry-run`` per pin, without that pin; run with PIP_CONSTRAINT on the probe file."""
+    if plan.install_index is None:
+        return []
+    install = plan.commands[plan.install_index]
+    upgrade, args = parse_pip_install(install) or (False, [])
+    probes = []
+    for pin in plan.pins:
+        others = [p for p in plan.pins if p is not pin]
+        probe_args = [a for a in args if a != pin.requirement]
+        cmd = f"{constraints_command(others, PROBE_CONSTRAINTS_PATH)} && {install_command(probe_args, upgrade=upgrade, dry_run=True)}"
+        probes.append((pin, cmd))
+    return probes
+
+
+def _error_text(output: str) -> str:
+    # pip's own summary: the ERROR lines and the "conflict is caused by" block under them.
+    start = min((i for i in (output.find("ERROR:"), output.find("The conflict is caused by")) if i >= 0), default=-1)
+    return output[start:] if start >= 0 else ""
+
+
+def blame(plan: DependencyPlan, install: CommandResult, probes: Sequence[Tuple[DependencyPin, CommandResult]]) -> List[DependencyPin]:
+    """Pins that made the single-pass install fail.
+
+    A pin is blamed when resolving without it succeeds. When the probes could
+    not run (pip without ``--dry-run``), pins named in pip's error output are
+    blamed instead.
+    """
+    usable = [(pin, res) for pin, res in probes if "no such option" not in res.stderr]
+    if usable:
+        return [pin for pin, res in usable if res.exit_code == 0]
+    text = _error_text(f"{install.stdout}\n{install.stderr}").lower()
+    return [
+        pin
+        for pin in plan.pins
+        if re.search(rf"(?<![\w.-]){re.escape(project_name(pin.requirement))}(?![\w-])", text.replace("_", "-"))
+    ]
+
+
+def describe_blame(pins: Sequence[DependencyPin]) -> str:
+    return ", ".join(f"{p.requirement} ({p.source})" for p in pins)
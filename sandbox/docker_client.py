@@ -3,16 +3,94 @@ from __future__ import annotations
 import subprocess
 import shlex
 import time
-from typing import Dict, List, Optional
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
+from sandbox.capture import OutputCallback, SpillDir, StreamCapture, strip_timing, timed_command
+from sandbox.channel import CommandChannel
 from sandbox.logger import EventLogger
 from sandbox.models import CommandResult
 
 
+def _env_args(env: Optional[Dict[str, str]]) -> List[str]:
+    return [a for k, v in (env or {}).items() for a in ("-e", f"{k}={v}")]
+
+
+def _label_args(labels: Optional[Dict[str, str]]) -> List[str]:
+    return [a for k, v in (labels or {}).items() for a in ("--label", f"{k}={v}")]
+
+
+def run_args(
+    image: str,
+    name: Optional[str] = None,
+    workdir: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+    network: Optional[str] = None,
+    detach: bool = True,
+    cmd: Optional[List[str]] = None,
+    volumes: Optional[List[str]] = None,
+    labels: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    """``docker run`` arguments; shared with AsyncDockerClient."""
+    args = ["docker", "run"]
+    if detach:
+        args.append("-d")
+    if name:
+        args += ["--name", name]
+    if workdir:
+        args += ["-w", workdir]
+    args += _env_args(env)
+    if network:
+        args += ["--network", network]
+    for vol in volumes or []:
+        args += ["-v", vol]
+    args += _label_args(labels)
+    args.append(image)
+    if cmd:
+        args += cmd
+    return args
+
+
+def exec_args(
+    container: str, command: List[str], workdir: Optional[str] = None, env: Optional[Dict[str, str]] = None
+) -> Tuple[List[str], str]:
+    """``docker exec`` arguments and the command line to report for them."""
+    args = ["docker", "exec"]
+    if workdir:
+        args += ["-w", workdir]
+    args += _env_args(env)
+    args.append(container)
+    # Reported as the plain command; the timer wrapper only feeds in_container_sec.
+    display = " ".join(shlex.quote(a) for a in [*args, *command])
+    return [*args, *timed_command(command)], display
+
+
+def rm_args(container: str, force: bool = True) -> List[str]:
+    return ["docker", "rm", *(["-f"] if force else []), container]
+
+
 class DockerClient:
-    def __init__(self, timeout_sec: int = 120, logger: Optional[EventLogger] = None):
+    """Thin wrapper over the docker CLI.
+
+    Output is streamed rather than buffered: each command keeps at most
+    ``buffer_bytes`` of head and of tail in memory, and when ``spill_dir`` is set
+    the full streams are written there and referenced from the CommandResult.
+    ``on_output`` receives chunks as they arrive for live tailing.
+    """
+
+    def __init__(
+        self,
+        timeout_sec: int = 120,
+        logger: Optional[EventLogger] = None,
+        spill_dir: Optional[Path] = None,
+        buffer_bytes: int = 64 * 1024,
+        on_output: Optional[OutputCallback] = None,
+    ):
         self.timeout_sec = timeout_sec
         self.logger = logger
+        self.buffer_bytes = buffer_bytes
+        self.on_output = on_output
+        self.spill = SpillDir(spill_dir)
 
     def _run(
         self,
@@ -20,54 +98,50 @@ class DockerClient:
         timeout: Optional[int] = None,
         env: Optional[Dict[str, str]] = None,
         cwd: Optional[str] = None,
+        display: Optional[str] = None,
     ) -> CommandResult:
+        command = display or " ".join(shlex.quote(a) for a in args)
         start = time.time()
-        proc = None
+        exit_code: Optional[int] = None
+        timed_out = False
+        out_path, err_path = self.spill.paths()
         try:
-            proc = subprocess.run(
-                args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=timeout or self.timeout_sec,
-                env=env,
-                cwd=cwd,
-            )
-            duration = time.time() - start
-            return CommandResult(
-                command=" ".join(shlex.quote(a) for a in args),
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=cwd)
+            captures = [
+                StreamCapture(pipe, name, self.buffer_bytes, self.buffer_bytes, path, self.on_output)
+                for pipe, name, path in ((proc.stdout, "stdout", out_path), (proc.stderr, "stderr", err_path))
+            ]
+            try:
+                exit_code = proc.wait(timeout=timeout or self.timeout_sec)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                proc.kill()
+                proc.wait()
+            for cap in captures:
+                # Orphaned grandchildren can hold a pipe open after a kill; do not wait on them forever.
+                cap.join(5 if timed_out else None)
+            out, err = captures
+            res = CommandResult(
+                command=command,
                 cwd=cwd,
                 env=env or {},
-                exit_code=proc.returncode,
-                stdout=proc.stdout,
-                stderr=proc.stderr,
-                duration_sec=duration,
-                timed_out=False,
-            )
-        except subprocess.TimeoutExpired as exc:
-            duration = time.time() - start
-            stdout = exc.stdout if exc.stdout else ""
-            stderr = exc.stderr if exc.stderr else ""
-            return CommandResult(
-                command=" ".join(shlex.quote(a) for a in args),
-                cwd=cwd,
-                env=env or {},
-                exit_code=None,
-                stdout=stdout,
-                stderr=stderr,
-                duration_sec=duration,
-                timed_out=True,
+                exit_code=exit_code,
+                stdout=out.text(),
+                stderr=err.text(),
+                stdout_path=str(out_path) if out_path else None,
+                stderr_path=str(err_path) if err_path else None,
+                stdout_bytes=out.total_bytes,
+                stderr_bytes=err.total_bytes,
+                duration_sec=time.time() - start,
+                timed_out=timed_out,
             )
+            return strip_timing(res)
         finally:
             if self.logger:
                 self.logger.info(
                     "docker command finished",
                     stage="docker",
-                    data={
-                        "command": " ".join(shlex.quote(a) for a in args),
-                        "exit_code": proc.returncode if proc else None,
-                        "timed_out": proc is None,
-                    },
+                    data={"command": command, "exit_code": exit_code, "timed_out": timed_out},
                 )
 
     def run_container(
@@ -79,23 +153,10 @@ class DockerClient:
         network: Optional[str] = None,
         detach: bool = True,
         cmd: Optional[List[str]] = None,
+        volumes: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
     ) -> CommandResult:
-        args = ["docker", "run"]
-        if detach:
-            args.append("-d")
-        if name:
-            args += ["--name", name]
-        if workdir:
-            args += ["-w", workdir]
-        if env:
-            for k, v in env.items():
-                args += ["-e", f"{k}={v}"]
-        if network:
-            args += ["--network", network]
-        args.append(image)
-        if cmd:
-            args += cmd
-        return self._run(args)
+        return self._run(run_args(image, name, workdir, env, network, detach, cmd, volumes, labels))
 
     def exec(
         self,
@@ -105,26 +166,53 @@ class DockerClient:
         env: Optional[Dict[str, str]] = None,
         timeout: Optional[int] = None,
     ) -> CommandResult:
-        args = ["docker", "exec"]
-        if workdir:
-            args += ["-w", workdir]
-        if env:
-            for k, v in env.items():
-                args += ["-e", f"{k}={v}"]
-        args.append(container)
-        args += command
-        return self._run(args, timeout=timeout)
+        args, display = exec_args(container, command, workdir, env)
+        return self._run(args, timeout=timeout, display=display)
+
+    def open_channel(self, container: str, workdir: str = "/workspace") -> Tuple[CommandChannel, CommandResult]:
+        """Start a persistent command channel in ``container``; check ``alive`` before use."""
+        channel = CommandChannel(
+            container, workdir=workdir, timeout_sec=self.timeout_sec, logger=self.logger, buffer_bytes=self.buffer_bytes
+        )
+        return channel, channel.open()
 
     def cp(self, src: str, dest: str) -> CommandResult:
         args = ["docker", "cp", src, dest]
         return self._run(args)
 
+    def commit(self, container: str, tag: str, labels: Optional[Dict[str, str]] = None) -> CommandResult:
+        args = ["docker", "commit"]
+        for k, v in (labels or {}).items():
+            args += ["--change", f"LABEL {k}={v}"]
+        args += [container, tag]
+        return self._run(args)
+
+    def inspect_image(self, image: str, fmt: str = "{{.Id}}") -> CommandResult:
+        return self._run(["docker", "image", "inspect", "--format", fmt, image])
+
+    def containers(self, label: str) -> CommandResult:
+        """All containers carrying ``label``, one ``<name>\t<k=v,...>`` line each."""
+        return self._run(["docker", "ps", "-a", "--filter", f"label={label}", "--format", "{{.Names}}\t{{.Labels}}"])
+
+    def rmi(self, image: str) -> CommandResult:
+        return self._run(["docker", "rmi", image])
+
+    def create_volume(self, name: str, labels: Optional[Dict[str, str]] = None) -> CommandResult:
+        return self._run(["docker", "volume", "create", *_label_args(labels), name])
+
+    def volumes(self, label: str) -> CommandResult:
+        """All volumes carrying ``label``, one ``<name>\t<k=v,...>`` line each."""
+        return self._run(["docker", "volume", "ls", "--filter", f"label={label}", "--format", "{{.Name}}\t{{.Labels}}"])
+
+    def volume_users(self, name: str) -> CommandResult:
+        """Every container (running or not) that mounts volume ``name``, one name per line."""
+        return self._run(["docker", "ps", "-a", "--filter", f"volume={name}", "--format", "{{.Names}}"])
+
+    def rm_volume(self, name: str) -> CommandResult:
+        return self._run(["docker", "volume", "rm", "-f", name])
+
     def stop(self, container: str) -> CommandResult:
         return self._run(["docker", "stop", container])
 
     def rm(self, container: str, force: bool = True) -> CommandResult:
-        args = ["docker", "rm"]
-        if force:
-            args.append("-f")
-        args.append(container)
-        return self._run(args)
+        return self._run(rm_args(container, force))
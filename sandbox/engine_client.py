@@ -0,0 +1,521 @@
+from __future__ import annotations
+
+import http.client
+import io
+import json
+import os
+import re
+import shlex
+import socket
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from sandbox.capture import BoundedBuffer, OutputCallback, SpillDir, strip_timing, timed_command
+from sandbox.channel import CommandChannel
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+API_VERSION = "v1.41"
+# Every exec carries AB_EXEC=<token> in its environment; a timed-out one is killed with its whole process tree by it.
+EXEC_TOKEN_VAR = "AB_EXEC"
+_KILL_SCRIPT = (
+    'for p in /proc/[0-9]*; do tr "\\0" "\\n" 2>/dev/null < "$p/environ" | grep -qx "$1"'
+    ' && kill -KILL "${p#/proc/}" 2>/dev/null; done; true'
+)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to the engine socket, reused LIFO."""
+
+    def __init__(self, socket_path: str, size: int = 16):
+        self.socket_path = socket_path
+        self.size = size
+        self._idle: List[UnixHTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def get(self, timeout: Optional[float]) -> Tuple[UnixHTTPConnection, bool]:
+        """Returns (connection, reused)."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return UnixHTTPConnection(self.socket_path, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def put(self, conn: UnixHTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class EngineError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class EngineClient:
+    """Docker Engine API over the unix socket; same interface and results as DockerClient.
+
+    Requests share a pool of keep-alive connections instead of starting a CLI
+    process each. ``exec`` reads the multiplexed attach stream into the same
+    bounded head/tail buffers (and spill files) as DockerClient, and ``cp``
+    streams tar archives through the archive endpoint. Transport and API errors
+    come back as a non-zero CommandResult with the engine's message in stderr,
+    as the CLI would print it. ``socket_path`` can point at a stand-in server.
+    """
+
+    def __init__(
+        self,
+        timeout_sec: int = 120,
+        logger: Optional[EventLogger] = None,
+        spill_dir: Optional[Path] = None,
+        buffer_bytes: int = 64 * 1024,
+        on_output: Optional[OutputCallback] = None,
+        socket_path: str = DEFAULT_SOCKET,
+        api_version: str = API_VERSION,
+        pool_size: int = 16,
+    ):
+        self.timeout_sec = timeout_sec
+        self.logger = logger
+        self.buffer_bytes = buffer_bytes
+        self.on_output = on_output
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self.pool = ConnectionPool(socket_path, size=pool_size)
+        self.spill = SpillDir(spill_dir)
+
+    def _url(self, path: str, params: Optional[Dict[str, Any]] = None) -> str:
+        query = {k: v for k, v in (params or {}).items() if v is not None}
+        return f"/{self.api_version}{path}" + (f"?{urlencode(query)}" if query else "")
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[UnixHTTPConnection, http.client.HTTPResponse]:
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        for attempt in range(2):
+            conn, reused = self.pool.get(timeout or self.timeout_sec)
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                # The engine may have dropped an idle keep-alive connection; retry once on a fresh one.
+                if not reused or attempt or hasattr(body, "read"):
+                    raise
+        raise AssertionError("unreachable")
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, bytes]:
+        conn, resp = self._send(method, self._url(path, params), body, headers, timeout)
+        try:
+            payload = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+        if resp.status >= 400:
+            raise EngineError(resp.status, _error_message(payload))
+        return resp.status, payload
+
+    def _call(self, command: str, fn, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None) -> CommandResult:
+        """Run ``fn() -> stdout`` and wrap the outcome like a CLI invocation."""
+        start = time.time()
+        res = CommandResult(command=command, cwd=cwd, env=env or {})
+        try:
+            res.stdout = fn() or ""
+            res.exit_code = 0
+        except EngineError as exc:
+            res.exit_code = 1
+            res.stderr = f"Error response from daemon: {exc}\n"
+        except socket.timeout as exc:
+            res.stderr = f"timed out: {exc}\n"
+            res.timed_out = True
+        except (OSError, http.client.HTTPException) as exc:
+            res.exit_code = 1
+            res.stderr = f"Cannot connect to the Docker daemon at unix://{self.socket_path}: {exc}\n"
+        res.duration_sec = time.time() - start
+        self._log(command, res)
+        return res
+
+    def _log(self, command: str, res: CommandResult) -> None:
+        if self.logger:
+            self.logger.info(
+                "docker command finished",
+                stage="docker",
+                data={"command": command, "exit_code": res.exit_code, "timed_out": res.timed_out, "backend": "engine"},
+            )
+
+    def _pull(self, image: str) -> None:
+        name, _, tag = image.rpartition(":") if ":" in image.rsplit("/", 1)[-1] else (image, "", "latest")
+        self._request("POST", "/images/create", params={"fromImage": name, "tag": tag}, timeout=max(self.timeout_sec, 600))
+
+    def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        workdir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        network: Optional[str] = None,
+        detach: bool = True,
+        cmd: Optional[List[str]] = None,
+        volumes: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> CommandResult:
+        spec: Dict[str, Any] = {"Image": image, "Env": [f"{k}={v}" for k, v in (env or {}).items()], "HostConfig": {}}
+        if workdir:
+            spec["WorkingDir"] = workdir
+        if cmd:
+            spec["Cmd"] = cmd
+        if network:
+            spec["HostConfig"]["NetworkMode"] = network
+        if volumes:
+            # Binds takes both "named-volume:/path" and "/host/path:/path[:ro]", like -v.
+            spec["HostConfig"]["Binds"] = list(volumes)
+        if labels:
+            spec["Labels"] = dict(labels)
+
+        def create_and_start() -> str:
+            try:
+                _, body = self._request("POST", "/containers/create", params={"name": name}, body=spec)
+            except EngineError as exc:
+                if exc.status != 404:
+                    raise
+                self._pull(image)
+                _, body = self._request("POST", "/containers/create", params={"name": name}, body=spec)
+            cid = json.loads(body)["Id"]
+            self._request("POST", f"/containers/{cid}/start")
+            if detach:
+                return f"{cid}\n"
+            self._request("POST", f"/containers/{cid}/wait", timeout=self.timeout_sec)
+            _, logs = self._request("GET", f"/containers/{cid}/logs", params={"stdout": 1, "stderr": 1})
+            return _demux_bytes(logs)
+
+        return self._call(f"docker run {name or ''} {image}".replace("  ", " "), create_and_start)
+
+    def exec(
+        self,
+        container: str,
+        command: List[str],
+        workdir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[int] = None,
+    ) -> CommandResult:
+        label = "docker exec " + " ".join(shlex.quote(a) for a in [container, *command])
+        start = time.time()
+        token = f"{EXEC_TOKEN_VAR}={uuid.uuid4().hex}"
+        spec: Dict[str, Any] = {
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Cmd": timed_command(command),
+            "Env": [f"{k}={v}" for k, v in (env or {}).items()] + [token],
+        }
+        if workdir:
+            spec["WorkingDir"] = workdir
+        out_path, err_path = self.spill.paths()
+        out = BoundedBuffer("stdout", self.buffer_bytes, self.buffer_bytes, out_path, self.on_output)
+        err = BoundedBuffer("stderr", self.buffer_bytes, self.buffer_bytes, err_path, self.on_output)
+        res = CommandResult(command=label, cwd=workdir, env=env or {})
+        deadline = start + (timeout or self.timeout_sec)
+        try:
+            _, body = self._request("POST", f"/containers/{quote(container)}/exec", body=spec)
+            exec_id = json.loads(body)["Id"]
+            conn, resp = self._send(
+                "POST", self._url(f"/exec/{exec_id}/start"), body={"Detach": False, "Tty": False},
+                timeout=max(deadline - time.time(), 0.001),
+            )
+
+            def rearm() -> None:
+                # The socket timeout only bounds one read; re-arm it so the whole exec keeps to the deadline.
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout("exec deadline passed")
+                if conn.sock is not None:
+                    conn.sock.settimeout(remaining)
+
+            try:
+                if resp.status >= 400:
+                    raise EngineError(resp.status, _error_message(resp.read()))
+                _demux(resp, {1: out, 2: err}, rearm)
+            finally:
+                # The attach stream is hijacked; the connection cannot go back to the pool.
+                conn.close()
+            _, info = self._request("GET", f"/exec/{exec_id}/json")
+            res.exit_code = json.loads(info).get("ExitCode")
+        except EngineError as exc:
+            res.exit_code = 1
+            err.feed(f"Error response from daemon: {exc}\n".encode("utf-8"))
+        except socket.timeout:
+            res.timed_out = True
+            # Like the channel's killpg: the command must not outlive its timeout and overlap later stages.
+            self._kill_exec(container, token)
+        except (OSError, http.client.HTTPException) as exc:
+            res.exit_code = 1
+            err.feed(f"Cannot connect to the Docker daemon at unix://{self.socket_path}: {exc}\n".encode("utf-8"))
+        finally:
+            out.close()
+            err.close()
+        res.stdout, res.stderr = out.text(), err.text()
+        res.stdout_path = str(out_path) if out_path else None
+        res.stderr_path = str(err_path) if err_path else None
+        res.stdout_bytes, res.stderr_bytes = out.total_bytes, err.total_bytes
+        res.duration_sec = time.time() - start
+        strip_timing(res)
+        self._log(label, res)
+        return res
+
+    def _kill_exec(self, container: str, token: str) -> None:
+        """SIGKILL every process in ``container`` whose environment carries ``token``."""
+        spec = {"Cmd": ["sh", "-c", _KILL_SCRIPT, "ab-kill", token]}
+        try:
+            _, body = self._request("POST", f"/containers/{quote(container)}/exec", body=spec)
+            exec_id = json.loads(body)["Id"]
+            self._request("POST", f"/exec/{exec_id}/start", body={"Detach": True, "Tty": False})
+            # Wait for the kill to finish, so the next stage starts on a quiet container.
+            for _ in range(50):
+                _, info = self._request("GET", f"/exec/{exec_id}/json")
+                if not json.loads(info).get("Running"):
+                    break
+                time.sleep(0.1)
+        except (EngineError, OSError, http.client.HTTPException) as exc:
+            if self.logger:
+                self.logger.info("exec kill failed", stage="docker", data={"container": container, "error": str(exc)})
+
+    def open_channel(self, container: str, workdir: str = "/workspace") -> Tuple[CommandChannel, CommandResult]:
+        # Bidirectional attach needs a hijacked stdin; the channel keeps using `docker exec -i`.
+        channel = CommandChannel(
+            container, workdir=workdir, timeout_sec=self.timeout_sec, logger=self.logger, buffer_bytes=self.buffer_bytes
+        )
+        return channel, channel.open()
+
+    def cp(self, src: str, dest: str) -> CommandResult:
+        if os.path.exists(src):
+            container, path = dest.split(":", 1)
+            return self._call(f"docker cp {src} {dest}", lambda: self._put_archive(src, container, path))
+        container, path = src.split(":", 1)
+        return self._call(f"docker cp {src} {dest}", lambda: self._get_archive(container, path, dest))
+
+    def _put_archive(self, src: str, container: str, path: str) -> str:
+        # `docker cp file c:/dir/name` writes /dir/name; a trailing slash or dir target keeps the basename.
+        target_dir, name = (path.rstrip("/"), os.path.basename(src)) if path.endswith("/") else os.path.split(path)
+        with tempfile.TemporaryFile() as spool:
+            with tarfile.open(fileobj=spool, mode="w") as tar:
+                tar.add(src, arcname=name or os.path.basename(src))
+            size = spool.tell()
+            spool.seek(0)
+            self._request(
+                "PUT",
+                f"/containers/{quote(container)}/archive",
+                params={"path": target_dir or "/"},
+                body=spool,
+                headers={"Content-Type": "application/x-tar", "Content-Length": str(size)},
+            )
+        return ""
+
+    def _get_archive(self, container: str, path: str, dest: str) -> str:
+        conn, resp = self._send("GET", self._url(f"/containers/{quote(container)}/archive", {"path": path}))
+        try:
+            if resp.status >= 400:
+                raise EngineError(resp.status, _error_message(resp.read()))
+            dest_path = Path(dest)
+            with tarfile.open(fileobj=resp, mode="r|") as tar:
+                for member in tar:
+                    if dest_path.is_dir():
+                        tar.extract(member, dest_path, filter="data")
+                        continue
+                    # Single file to a new name, as `docker cp c:/a/b.txt out.txt` does.
+                    root, _, rest = member.name.partition("/")
+                    member.name = rest
+                    if not rest:
+                        if member.isdir():
+                            dest_path.mkdir(parents=True, exist_ok=True)
+                            continue
+                        fh = tar.extractfile(member)
+                        dest_path.write_bytes(fh.read() if fh else b"")
+                        continue
+                    tar.extract(member, dest_path, filter="data")
+        finally:
+            conn.close()
+        return ""
+
+    def commit(self, container: str, tag: str, labels: Optional[Dict[str, str]] = None) -> CommandResult:
+        repo, _, version = tag.rpartition(":") if ":" in tag.rsplit("/", 1)[-1] else (tag, "", "latest")
+
+        def do() -> str:
+            _, body = self._request(
+                "POST",
+                "/commit",
+                params={"container": container, "repo": repo, "tag": version},
+                body={"Labels": labels or {}},
+                timeout=max(self.timeout_sec, 600),
+            )
+            return json.loads(body).get("Id", "") + "\n"
+
+        return self._call(f"docker commit {container} {tag}", do)
+
+    def inspect_image(self, image: str, fmt: str = "{{.Id}}") -> CommandResult:
+        def do() -> str:
+            _, body = self._request("GET", f"/images/{quote(image, safe='')}/json")
+            info = json.loads(body)
+            # Only flat `{{.Field}}` templates are supported, which is all callers use.
+            return re.sub(r"\{\{\s*\.(\w+)\s*\}\}", lambda m: str(info.get(m.group(1), "")), fmt) + "\n"
+
+        return self._call(f"docker image inspect --format {fmt} {image}", do)
+
+    def containers(self, label: str) -> CommandResult:
+        def do() -> str:
+            _, body = self._request("GET", "/containers/json", params={"all": 1, "filters": json.dumps({"label": [label]})})
+            lines = []
+            for info in json.loads(body):
+                name = (info.get("Names") or ["/" + info["Id"][:12]])[0].lstrip("/")
+                labels = ",".join(f"{k}={v}" for k, v in sorted((info.get("Labels") or {}).items()))
+                lines.append(f"{name}\t{labels}\n")
+            return "".join(lines)
+
+        return self._call(f"docker ps -a --filter label={label}", do)
+
+    def _simple(self, command: str, method: str, path: str, **kwargs: Any) -> CommandResult:
+        def do() -> str:
+            self._request(method, path, **kwargs)
+            return ""
+
+        return self._call(command, do)
+
+    def rmi(self, image: str) -> CommandResult:
+        return self._simple(f"docker rmi {image}", "DELETE", f"/images/{quote(image, safe='')}")
+
+    def create_volume(self, name: str, labels: Optional[Dict[str, str]] = None) -> CommandResult:
+        def do() -> str:
+            _, body = self._request("POST", "/volumes/create", body={"Name": name, "Labels": labels or {}})
+            return json.loads(body).get("Name", name) + "\n"
+
+        return self._call(f"docker volume create {name}", do)
+
+    def volumes(self, label: str) -> CommandResult:
+        def do() -> str:
+            _, body = self._request("GET", "/volumes", params={"filters": json.dumps({"label": [label]})})
+            lines = []
+            for info in json.loads(body).get("Volumes") or []:
+                labels = ",".join(f"{k}={v}" for k, v in sorted((info.get("Labels") or {}).items()))
+                lines.append(f"{info['Name']}\t{labels}\n")
+            return "".join(lines)
+
+        return self._call(f"docker volume ls --filter label={label}", do)
+
+    def volume_users(self, name: str) -> CommandResult:
+        def do() -> str:
+            _, body = self._request("GET", "/containers/json", params={"all": 1, "filters": json.dumps({"volume": [name]})})
+            return "".join((info.get("Names") or ["/" + info["Id"][:12]])[0].lstrip("/") + "\n" for info in json.loads(body))
+
+        return self._call(f"docker ps -a --filter volume={name}", do)
+
+    def rm_volume(self, name: str) -> CommandResult:
+        return self._simple(f"docker volume rm -f {name}", "DELETE", f"/volumes/{quote(name, safe='')}", params={"force": 1})
+
+    def stop(self, container: str) -> CommandResult:
+        return self._simple(f"docker stop {container}", "POST", f"/containers/{quote(container)}/stop", timeout=self.timeout_sec)
+
+    def rm(self, container: str, force: bool = True) -> CommandResult:
+        return self._simple(
+            f"docker rm {'-f ' if force else ''}{container}",
+            "DELETE",
+            f"/containers/{quote(container)}",
+            params={"force": int(force)},
+        )
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def _error_message(payload: bytes) -> str:
+    try:
+        return json.loads(payload).get("message", "") or payload.decode("utf-8", "replace")
+    except ValueError:
+        return payload.decode("utf-8", "replace").strip()
+
+
+def _demux(stream: Any, sinks: Dict[int, BoundedBuffer], before_read: Optional[Callable[[], None]] = None) -> None:
+    """Split Docker's multiplexed attach stream (8-byte frame headers) into per-stream sinks.
+
+    ``before_read`` runs before every read; it may raise to end the stream (a deadline).
+    """
+    while True:
+        header = _read_exact(stream, 8, before_read)
+        if len(header) < 8:
+            return
+        kind, size = header[0], struct.unpack(">I", header[4:])[0]
+        sink = sinks.get(kind) or sinks[1]
+        while size:
+            if before_read:
+                before_read()
+            chunk = stream.read(min(size, 65536))
+            if not chunk:
+                return
+            sink.feed(chunk)
+            size -= len(chunk)
+
+
+def _read_exact(stream: Any, size: int, before_read: Optional[Callable[[], None]] = None) -> bytes:
+    buf = b""
+    while len(buf) < size:
+        if before_read:
+            before_read()
+        chunk = stream.read(size - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return buf
+
+
+def _demux_bytes(payload: bytes) -> str:
+    out = BoundedBuffer("stdout", len(payload), 0)
+    _demux(io.BytesIO(payload), {1: out, 2: out})
+    return out.text()
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult, RepoSpec, TaskSpec
+from sandbox.snapshot import snapshot_key
+
+# Where a stored lockfile is copied in the container before the replay.
+CONTAINER_LOCK_PATH = "/tmp/ab-env.lock"
+_PYTHON = '"$(command -v python)"'
+_EDITABLE = "# editable: "
+
+# The interpreter the test command will use: its own pip when it has one
+# (--all keeps pip/setuptools/wheel, so the sync does not remove them), else
+# uv's view of the same environment (a uv venv ships without pip).
+FREEZE_COMMAND = f"{{ python -m pip freeze --all 2>/dev/null || uv pip freeze --python {_PYTHON}; }}"
+
+
+def lock_key(image_id: str, repo: RepoSpec, task: TaskSpec, workdir: str, single_pass_deps: bool = False) -> str:
+    """Same inputs as a setup snapshot; keyed on the image id, so a rebuilt image (new interpreter) gets a new lock."""
+    return snapshot_key(image_id, repo, task, workdir, single_pass_deps=single_pass_deps)
+
+
+def lock_text(freeze_output: str, key: str) -> Optional[str]:
+    """Turn ``pip freeze`` output into a lockfile; None if it names no packages.
+
+    Editable installs point at the checkout (often as ``-e git+<url>@<sha>``,
+    which a sync would clone again), so they are kept as comments and the
+    replay reinstalls the working tree instead.
+    """
+    requirements: List[str] = []
+    editable: List[str] = []
+    for line in freeze_output.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith(("-e ", "--editable")):
+            editable.append(line)
+        else:
+            requirements.append(line)
+    if not requirements:
+        return None
+    header = [f"# agentbench env lock {key[:24]}"] + [f"{_EDITABLE}{line}" for line in editable]
+    return "\n".join(header + sorted(requirements, key=str.lower)) + "\n"
+
+
+def replay_command(text: str, repo_dir: str, lock_path: str = CONTAINER_LOCK_PATH) -> str:
+    """Shell command that makes the environment match the lockfile at ``lock_path`` exactly."""
+    command = f"cd {repo_dir} && uv pip sync --python {_PYTHON} {lock_path}"
+    if any(line.startswith(_EDITABLE) for line in text.splitlines()):
+        command += f" && uv pip install --python {_PYTHON} --no-deps -e ."
+    return command
+
+
+def full_stdout(res: CommandResult) -> str:
+    # In-memory output may be trimmed to head and tail; the spill file has all of it.
+    if res.stdout_path and Path(res.stdout_path).is_file():
+        return Path(res.stdout_path).read_text(errors="replace")
+    return res.stdout
+
+
+class LockStore:
+    """``pip freeze`` lockfiles on the host, one ``<root>/<key>.txt`` per setup environment.
+
+    Writes go through a temp file and a rename, so a concurrent reader sees
+    either the old lockfile or the new one.
+    """
+
+    def __init__(self, root: Path, logger: Optional[EventLogger] = None):
+        self.root = root.expanduser()
+        self.logger = logger
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key[:24]}.txt"
+
+    def load(self, key: str) -> Optional[str]:
+        try:
+            return self.path(key).read_text()
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, text: str) -> Path:
+        path = self.path(key)
+        # Two workers may finish the same setup at once; each writes its own temp file.
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp.write_text(text)
+        tmp.replace(path)
+        if self.logger:
+            packages = sum(not line.startswith("#") for line in text.splitlines())
+            self.logger.info("env lock saved", stage="lock_save", data={"path": str(path), "packages": packages})
+        return path
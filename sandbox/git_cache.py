@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult
+
+# Where the mirror root is mounted inside the container (read-only). The whole
+# root is mounted so one long-lived container can clone any mirror.
+CONTAINER_MIRROR_ROOT = "/cache/git"
+# Set on every mirror, and checked again on each use.
+MIRROR_SETTINGS = {
+    # Never repack underneath a container that is cloning from us.
+    "gc.auto": "0",
+    # Shallow (--depth 1 <sha>) and partial (--filter=blob:none) clones over file://.
+    "uploadpack.allowFilter": "true",
+    "uploadpack.allowAnySHA1InWant": "true",
+}
+
+
+def mirror_root(cache_dir: str) -> Path:
+    return Path(cache_dir).expanduser() / "git"
+
+
+def normalize_url(repo_url: str) -> str:
+    url = repo_url.strip().rstrip("/")
+    if url.endswith(".git"):
+        url = url[: -len(".git")]
+    return url
+
+
+class GitMirrorCache:
+    """Bare mirrors of remote repos on the host, keyed by repo URL.
+
+    Mirrors live at ``<root>/<hash>.git``. Updates are serialized per mirror with
+    an flock on ``<root>/<hash>.lock`` so concurrent workers (threads or
+    processes) never fetch into the same mirror at once; readers clone from the
+    mirror without taking the lock.
+    """
+
+    def __init__(self, root: Path, logger: Optional[EventLogger] = None, timeout_sec: int = 1800):
+        self.root = root.expanduser()
+        self.logger = logger
+        self.timeout_sec = timeout_sec
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(self, repo_url: str) -> str:
+        return hashlib.sha256(normalize_url(repo_url).encode("utf-8")).hexdigest()[:16]
+
+    def mirror_path(self, repo_url: str) -> Path:
+        return self.root / f"{self.key(repo_url)}.git"
+
+    def container_path(self, repo_url: str) -> str:
+        return f"{CONTAINER_MIRROR_ROOT}/{self.mirror_path(repo_url).name}"
+
+    @contextmanager
+    def _lock(self, repo_url: str) -> Iterator[None]:
+        lock_path = self.root / f"{self.key(repo_url)}.lock"
+        with lock_path.open("a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _git(self, args: List[str], cwd: Optional[Path] = None) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=self.timeout_sec,
+        )
+
+    def has_commit(self, repo_url: str, commit: str) -> bool:
+        path = self.mirror_path(repo_url)
+        if not path.is_dir():
+            return False
+        proc = self._git(["--git-dir", str(path), "cat-file", "-e", f"{commit}^{{commit}}"])
+        return proc.returncode == 0
+
+    def grep(self, repo_url: str, commit: str, pattern: str, pathspecs: Optional[List[str]] = None) -> CommandResult:
+        """``git grep -l -E`` over ``commit`` in the mirror; stdout lists matching paths.
+
+        Exit code follows git grep: 0 with matches, 1 without, anything else is an error.
+        """
+        args = ["--git-dir", str(self.mirror_path(repo_url)), "grep", "-l", "-E", "-e", pattern, commit, "--", *(pathspecs or [])]
+        start = time.time()
+        try:
+            proc = self._git(args)
+        except subprocess.TimeoutExpired as exc:
+            return CommandResult(command=shlex.join(["git", *args]), cwd=str(self.root), stderr=str(exc), duration_sec=time.time() - start, timed_out=True)
+        prefix = f"{commit}:"
+        paths = [line.removeprefix(prefix) for line in proc.stdout.splitlines() if line]
+        return CommandResult(
+            command=shlex.join(["git", *args]),
+            cwd=str(self.root),
+            exit_code=proc.returncode,
+            stdout="".join(f"{path}\n" for path in paths),
+            stderr=proc.stderr,
+            duration_sec=time.time() - start,
+        )
+
+    def _read(self, repo_url: str, args: List[str]) -> CommandResult:
+        args = ["--git-dir", str(self.mirror_path(repo_url)), *args]
+        start = time.time()
+        try:
+            proc = self._git(args)
+        except subprocess.TimeoutExpired as exc:
+            return CommandResult(command=shlex.join(["git", *args]), cwd=str(self.root), stderr=str(exc), duration_sec=time.time() - start, timed_out=True)
+        return CommandResult(
+            command=shlex.join(["git", *args]),
+            cwd=str(self.root),
+            exit_code=proc.returncode,
+            stdout=proc.stdout,
+            stderr=proc.stderr,
+            duration_sec=time.time() - start,
+        )
+
+    def ls_files(self, repo_url: str, commit: str) -> CommandResult:
+        """Every path in ``commit``'s tree, one per line."""
+        return self._read(repo_url, ["ls-tree", "-r", "--name-only", commit])
+
+    def show(self, repo_url: str, commit: str, path: str) -> CommandResult:
+        """Contents of ``path`` at ``commit``."""
+        return self._read(repo_url, ["show", f"{commit}:{path}"])
+
+    def _configure(self, path: Path) -> List[subprocess.CompletedProcess]:
+        return [self._git(["--git-dir", str(path), "config", key, value]) for key, value in MIRROR_SETTINGS.items()]
+
+    def _configured(self, path: Path) -> bool:
+        """Whether ``path`` already has ``MIRROR_SETTINGS`` (one ``git config`` call; mirrors from older versions may not)."""
+        proc = self._git(["--git-dir", str(path), "config", "--get-regexp", r"^(gc|uploadpack)\."])
+        current = dict(line.partition(" ")[::2] for line in proc.stdout.splitlines())
+        return all(current.get(key.lower()) == value for key, value in MIRROR_SETTINGS.items())
+
+    def _create(self, repo_url: str, path: Path) -> List[subprocess.CompletedProcess]:
+        # Build in a sibling temp dir and rename so readers never see a half-made mirror.
+        tmp = Path(tempfile.mkdtemp(prefix=f".{path.stem}-", dir=self.root))
+        procs = [
+            self._git(["init", "--bare", "-q", str(tmp)]),
+            self._git(["--git-dir", str(tmp), "remote", "add", "origin", repo_url]),
+            # Heads and tags only: GitHub also advertises refs/pull/*, which is large and unused.
+            self._git(["--git-dir", str(tmp), "config", "--replace-all", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"]),
+            self._git(["--git-dir", str(tmp), "config", "--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*"]),
+        ]
+        procs += self._configure(tmp)
+        procs.append(self._git(["--git-dir", str(tmp), "fetch", "-q", "--prune", "origin"]))
+        if all(p.returncode == 0 for p in procs):
+            tmp.rename(path)
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return procs
+
+    def ensure(self, repo_url: str, commit: str) -> CommandResult:
+        """Make sure the mirror exists and contains ``commit``; fetch only when it does not."""
+        path = self.mirror_path(repo_url)
+        start = time.time()
+        procs: List[subprocess.CompletedProcess] = []
+        action = "hit"
+        try:
+            with self._lock(repo_url):
+                if not path.is_dir():
+                    action = "create"
+                    procs += self._create(repo_url, path)
+                elif not self._configured(path):
+                    self._configure(path)
+                if action == "hit" and not self.has_commit(repo_url, commit):
+                    action = "fetch"
+                    procs.append(self._git(["--git-dir", str(path), "fetch", "-q", "--prune", "origin"]))
+                if path.is_dir() and not self.has_commit(repo_url, commit):
+                    # Commit not reachable from heads/tags (e.g. only from a PR ref): ask for it directly.
+                    action = f"{action}+sha"
+                    procs.append(self._git(["--git-dir", str(path), "fetch", "-q", "origin", commit]))
+                ok = self.has_commit(repo_url, commit)
+        except subprocess.TimeoutExpired as exc:
+            return CommandResult(
+                command=f"mirror {action} {repo_url}",
+                cwd=str(self.root),
+                exit_code=None,
+                stderr=str(exc),
+                duration_sec=time.time() - start,
+                timed_out=True,
+            )
+        duration = time.time() - start
+        if self.logger:
+            self.logger.info(
+                "git mirror",
+                stage="mirror",
+                data={"repo_url": repo_url, "commit": commit, "action": action, "ok": ok, "path": str(path)},
+            )
+        return CommandResult(
+            command=" ; ".join(shlex.join(p.args) for p in procs) or f"mirror {action} {repo_url}",
+            cwd=str(self.root),
+            exit_code=0 if ok else 1,
+            stdout=f"{action} {path}\n",
+            stderr="".join(p.stderr for p in procs),
+            duration_sec=duration,
+            timed_out=False,
+        )
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sandbox.backend import DockerBackend
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult, ContainerHandle, RunReport
+
+KEEP_LABEL = "agentbench.keep"
+EXPIRES_LABEL = "agentbench.expires"
+# Two-phase volumes: the run that created them, and when.
+OWNER_LABEL = "agentbench.owner"
+CREATED_LABEL = "agentbench.created"
+HANDLE_NAME = "container.json"
+# `ab gc` leaves unused two-phase volumes younger than this alone: their run may not have started a container on them yet.
+VOLUME_GRACE_SEC = 3600
+
+
+def keep_labels(ttl_hours: float) -> Dict[str, str]:
+    """Labels for a container that outlives its run; ``ab gc`` reads the expiry back from them."""
+    return {KEEP_LABEL: "1", EXPIRES_LABEL: str(int(time.time() + ttl_hours * 3600))}
+
+
+def owner_labels(owner: str) -> Dict[str, str]:
+    """Labels for a two-phase volume. It carries no expiry: a kept run's keeper container holds it instead."""
+    return {OWNER_LABEL: owner, CREATED_LABEL: str(int(time.time()))}
+
+
+def keeper_name(owner: str) -> str:
+    return f"{owner}-keep"
+
+
+def cleared_keep_labels() -> Dict[str, str]:
+    """Blank keep labels for an image committed from a kept container.
+
+    Committed images inherit the container's labels and a commit cannot
+    remove one, only override it; ``ab gc`` matches ``agentbench.keep=1``
+    only, so containers started from the image are not taken for kept ones.
+    """
+    return {KEEP_LABEL: "", EXPIRES_LABEL: ""}
+
+
+def save_handle(run_dir: Path, report: RunReport, test_patch: str, ttl_hours: float) -> Optional[Path]:
+    """Write ``<run_dir>/container.json`` when the run kept its container (or two-phase volumes)."""
+    if not report.container and not report.volumes:
+        return None
+    now = datetime.utcnow()
+    handle = ContainerHandle(
+        container=report.container or "",
+        volumes=report.volumes,
+        run_dir=str(run_dir),
+        test_patch=test_patch,
+        created_at=now,
+        expires_at=now + timedelta(hours=ttl_hours),
+    )
+    path = run_dir / HANDLE_NAME
+    path.write_text(json.dumps(handle.model_dump(mode="json"), indent=2))
+    return path
+
+
+def load_handle(run_dir: Path) -> ContainerHandle:
+    return ContainerHandle.model_validate_json((run_dir / HANDLE_NAME).read_text())
+
+
+def _labelled(res: CommandResult) -> List[Tuple[str, Dict[str, str]]]:
+    found: List[Tuple[str, Dict[str, str]]] = []
+    for line in res.stdout.splitlines():
+        name, _, label_text = line.partition("\t")
+        if name:
+            found.append((name, dict(item.partition("=")[::2] for item in label_text.split(",") if item)))
+    return found
+
+
+def _epoch(labels: Dict[str, str], label: str) -> Optional[int]:
+    try:
+        return int(labels.get(label, ""))
+    except ValueError:
+        return None
+
+
+def kept_containers(client: DockerBackend) -> Tuple[List[Tuple[str, Optional[int]]], CommandResult]:
+    """(name, expiry epoch) of every kept container; expiry is None when the label is missing or bad."""
+    res = client.containers(f"{KEEP_LABEL}=1")
+    return [(name, _epoch(labels, EXPIRES_LABEL)) for name, labels in _labelled(res)], res
+
+
+def orphaned_volumes(client: DockerBackend, now: Optional[float] = None) -> List[str]:
+    """Two-phase volumes no container (running, stopped or a keeper) uses, past ``VOLUME_GRACE_SEC``.
+
+    These are left by runs that crashed, or by kept runs whose keeper
+    container expired.
+    """
+    now = time.time() if now is None else now
+    orphaned: List[str] = []
+    for name, labels in _labelled(client.volumes(OWNER_LABEL)):
+        created = _epoch(labels, CREATED_LABEL)
+        if created is None or now - created < VOLUME_GRACE_SEC:
+            continue
+        users = client.volume_users(name)
+        if users.exit_code == 0 and not users.stdout.strip():
+            orphaned.append(name)
+    return orphaned
+
+
+def remove_expired(client: DockerBackend, logger: Optional[EventLogger] = None, dry_run: bool = False, now: Optional[float] = None) -> List[str]:
+    """Remove kept containers past their expiry, then orphaned two-phase volumes; returns the names removed (or that would be).
+
+    A kept two-phase run's volumes go once its keeper container has; with
+    ``dry_run`` they are only listed from the next gc on.
+    """
+    now = time.time() if now is None else now
+    found, _ = kept_containers(client)
+    expired = [name for name, expires in found if expires is not None and expires <= now]
+    for name in expired:
+        if not dry_run:
+            client.rm(name, force=True)
+        if logger:
+            logger.info("gc kept container", stage="gc", data={"container": name, "dry_run": dry_run})
+    orphaned = orphaned_volumes(client, now)
+    for name in orphaned:
+        if not dry_run:
+            client.rm_volume(name)
+        if logger:
+            logger.info("gc orphaned volume", stage="gc", data={"volume": name, "dry_run": dry_run})
+    return expired + orphaned
@@ -1,19 +1,124 @@
 from __future__ import annotations
 
+import atexit
+import fcntl
 import json
+import os
+import queue
 import threading
+import time
+import weakref
 from datetime import datetime
+from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+class FsyncPolicy(str, Enum):
+    none = "none"
+    batch = "batch"
+    event = "event"
+
+
+def _encode(payload: Dict[str, Any]) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, default=str).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(payload, ensure_ascii=True, default=str)
+
+
+_OPEN: "weakref.WeakSet[EventLogger]" = weakref.WeakSet()
+
+
+@atexit.register
+def _close_all() -> None:
+    for logger in list(_OPEN):
+        logger.close()
 
 
 class EventLogger:
-    def __init__(self, path: Path, name: str = "sandbox", echo: bool = True) -> None:
+    """JSON-lines event log written by a background thread.
+
+    ``emit`` only enqueues; the writer drains the queue in batches of up to
+    ``batch_size`` lines (or whatever arrived within ``flush_interval``) and
+    appends each batch with one write under an flock on an O_APPEND fd, so
+    several processes can share one log file. ``fsync`` chooses durability:
+    never, once per batch, or after every event. ``close()`` drains and stops
+    the writer; loggers still open at interpreter exit are closed then.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        name: str = "sandbox",
+        echo: bool = True,
+        fsync: FsyncPolicy = FsyncPolicy.none,
+        batch_size: int = 256,
+        flush_interval: float = 0.2,
+    ) -> None:
         self.path = path
         self.name = name
         self.echo = echo
+        self.fsync = FsyncPolicy(fsync)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
         self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._closed = False
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._thread = threading.Thread(target=self._writer, name=f"eventlog-{name}", daemon=True)
+        self._thread.start()
+        _OPEN.add(self)
+
+    def _write(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        chunks = [line + "\n" for line in lines] if self.fsync == FsyncPolicy.event else ["".join(line + "\n" for line in lines)]
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for chunk in chunks:
+                    os.write(self._fd, chunk.encode("utf-8"))
+                    if self.fsync == FsyncPolicy.event:
+                        os.fsync(self._fd)
+                if self.fsync == FsyncPolicy.batch:
+                    os.fsync(self._fd)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if self.echo:
+            print("\n".join(lines), flush=True)
+
+    def _writer(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch: List[Optional[Dict[str, Any]]] = [item]
+            # Collect whatever else arrives shortly so one write covers many events.
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and item is not None:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is None
+            lines = [_encode(p) for p in batch if p is not None]
+            try:
+                self._write(lines)
+            except OSError:
+                pass  # logging must never take a run down
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
 
     def emit(
         self,
@@ -32,12 +137,39 @@ class EventLogger:
             "context": context or {},
             "data": data or {},
         }
-        line = json.dumps(payload, ensure_ascii=True)
-        with self._lock:
-            with self.path.open("a", encoding="utf-8") as fh:
-                fh.write(line + "\n")
-        if self.echo:
-            print(line)
+        with self._state_lock:
+            if not self._closed:
+                self._queue.put(payload)
+                return
+        # Late events (e.g. from a cleanup path) are written synchronously.
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, (_encode(payload) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def flush(self) -> None:
+        """Block until every event emitted so far is written."""
+        if not self._closed:
+            self._queue.join()
+
+    def close(self) -> None:
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        os.close(self._fd)
+        _OPEN.discard(self)
+
+    def __enter__(self) -> "EventLogger":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.close()
+        return False
 
     def info(self, message: str, stage: Optional[str] = None, context: Optional[Dict[str, Any]] = None, data: Optional[Dict[str, Any]] = None) -> None:
         self.emit("info", message, stage=stage, context=context, data=data)
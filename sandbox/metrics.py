@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import os
+import tomllib
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from sandbox.models import RunReport
+
+QUANTILES = (50, 95, 99)
+# Per-stage fields; "overhead" is everything outside the container: docker
+# CLI/API round trips, container start, copies, and host steps like mirror sync.
+STAGE_FIELDS = ("wall_sec", "in_container_sec", "overhead_sec")
+
+
+@lru_cache(maxsize=1)
+def harness_version() -> str:
+    try:
+        data = tomllib.loads((Path(__file__).resolve().parents[1] / "pyproject.toml").read_text())
+        return str(data["project"]["version"])
+    except (OSError, KeyError, tomllib.TOMLDecodeError):
+        return "unknown"
+
+
+def stage_metrics(report: RunReport) -> Dict[str, Dict[str, float]]:
+    """Per stage name: wall, in-container and overhead seconds plus command count (repeated stages are summed)."""
+    stages: Dict[str, Dict[str, float]] = {}
+    for stage in report.stages:
+        totals = stages.setdefault(stage.name, {"wall_sec": 0.0, "in_container_sec": 0.0, "overhead_sec": 0.0, "commands": 0})
+        for cmd in stage.commands:
+            inside = min(cmd.in_container_sec or 0.0, cmd.duration_sec) if cmd.in_container_sec is not None else 0.0
+            totals["wall_sec"] += cmd.duration_sec
+            totals["in_container_sec"] += inside
+            totals["overhead_sec"] += cmd.duration_sec - inside
+            totals["commands"] += 1
+    return stages
+
+
+def run_metrics(report: RunReport) -> dict:
+    stages = stage_metrics(report)
+    elapsed = (report.completed_at - report.started_at).total_seconds() if report.completed_at else None
+    return {
+        "harness_version": harness_version(),
+        "success": report.success,
+        "elapsed_sec": elapsed,
+        "totals": {field: sum(s[field] for s in stages.values()) for field in (*STAGE_FIELDS, "commands")},
+        "stages": stages,
+    }
+
+
+def _labels(labels: Mapping[str, str]) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _family(name: str, kind: str, help_text: str, samples: Iterable[Tuple[Mapping[str, str], float]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(labels)} {value:.6g}" for labels, value in samples]
+    return lines
+
+
+def run_prometheus(metrics: dict, run: str) -> str:
+    base = {"run": run, "harness_version": metrics["harness_version"]}
+    stages = metrics["stages"]
+    lines: List[str] = []
+    for field, help_text in (
+        ("wall_sec", "Wall time of the stage's commands."),
+        ("in_container_sec", "Time the stage's commands ran inside the container."),
+        ("overhead_sec", "Stage time spent outside the container (docker CLI/API, container start, host steps)."),
+    ):
+        name = f"ab_stage_{field.removesuffix('_sec')}_seconds"
+        lines += _family(name, "gauge", help_text, (({**base, "stage": st}, m[field]) for st, m in stages.items()))
+    lines += _family("ab_run_success", "gauge", "1 if the run met its expectation.", [(base, float(metrics["success"]))])
+    if metrics["elapsed_sec"] is not None:
+        lines += _family("ab_run_elapsed_seconds", "gauge", "Wall time of the whole run.", [(base, metrics["elapsed_sec"])])
+    return "\n".join(lines) + "\n"
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Linear-interpolated percentile (``q`` in 0-100) of a non-empty sequence."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def stage_percentiles(per_run: Iterable[Mapping[str, Mapping[str, float]]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """stage -> field -> {"count", "p50", "p95", "p99"} across runs that have the stage."""
+    samples: Dict[str, Dict[str, List[float]]] = {}
+    for stages in per_run:
+        for stage, fields in stages.items():
+            for field in STAGE_FIELDS:
+                samples.setdefault(stage, {}).setdefault(field, []).append(fields.get(field, 0.0))
+    return {
+        stage: {
+            field: {"count": len(values), **{f"p{q}": percentile(values, q) for q in QUANTILES}}
+            for field, values in fields.items()
+        }
+        for stage, fields in samples.items()
+    }
+
+
+def batch_prometheus(percentiles: Mapping[str, Mapping[str, Mapping[str, float]]], batch: str) -> str:
+    base = {"batch": batch, "harness_version": harness_version()}
+    lines: List[str] = []
+    for field in STAGE_FIELDS:
+        name = f"ab_batch_stage_{field.removesuffix('_sec')}_seconds"
+        samples = [
+            ({**base, "stage": stage, "quantile": str(q / 100)}, fields[field][f"p{q}"])
+            for stage, fields in percentiles.items()
+            if field in fields
+            for q in QUANTILES
+        ]
+        lines += _family(name, "summary", f"Per-stage {field.removesuffix('_sec').replace('_', '-')} seconds across the batch.", samples)
+        lines += [
+            f"{name}_count{_labels({**base, 'stage': stage})} {fields[field]['count']}"
+            for stage, fields in percentiles.items()
+            if field in fields
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    # The node_exporter textfile collector may read at any moment.
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def write_run_metrics(run_dir: Path, report: RunReport) -> Tuple[Path, Path]:
+    """Write ``metrics.json`` and the Prometheus textfile ``metrics.prom`` into ``run_dir``."""
+    metrics = run_metrics(report)
+    json_path, prom_path = run_dir / "metrics.json", run_dir / "metrics.prom"
+    _write_atomic(json_path, json.dumps(metrics, indent=2))
+    _write_atomic(prom_path, run_prometheus(metrics, run_dir.name))
+    return json_path, prom_path
+
+
+def write_batch_metrics(batch_dir: Path, percentiles: Mapping[str, Mapping[str, Mapping[str, float]]]) -> Path:
+    prom_path = batch_dir / "metrics.prom"
+    _write_atomic(prom_path, batch_prometheus(percentiles, batch_dir.name))
+    return prom_path
@@ -1,12 +1,28 @@
-from .config import RepoSpec, SandboxConfig, TaskSpec
-from .results import CommandResult, RunReport, StageResult, StageStatus
+from .config import Backend, FetchStrategy, RepoSpec, SandboxConfig, TaskSpec
+from .deps import DependencyPin, DependencyPlan
+from .plan import CandidateFix, PlanOutcome, PlanTrial, RepoFacts, RuntimePlan
+from .results import BatchReport, CommandResult, ContainerHandle, InstanceResult, RunReport, StageResult, StageStatus, TestOutcome, TestStatus
 
 __all__ = [
+    "Backend",
+    "CandidateFix",
+    "DependencyPin",
+    "DependencyPlan",
+    "FetchStrategy",
+    "PlanOutcome",
+    "PlanTrial",
+    "RepoFacts",
     "RepoSpec",
+    "RuntimePlan",
     "SandboxConfig",
     "TaskSpec",
+    "BatchReport",
     "CommandResult",
+    "ContainerHandle",
+    "InstanceResult",
     "RunReport",
     "StageResult",
     "StageStatus",
+    "TestOutcome",
+    "TestStatus",
 ]
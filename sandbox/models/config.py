@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+from enum import Enum
 from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
 
+class Backend(str, Enum):
+    cli = "cli"
+    engine = "engine"
+
+
 class SandboxConfig(BaseModel):
     image: str = Field(
         default="runner-core", description="Docker image to start for the session."
@@ -20,11 +26,100 @@ class SandboxConfig(BaseModel):
     network: str = Field(
         default="bridge", description="Docker network mode (e.g., bridge, none)."
     )
+    backend: Backend = Field(
+        default=Backend.cli, description="How to talk to docker: the `docker` CLI or the Engine API socket."
+    )
+    docker_socket: str = Field(
+        default="/var/run/docker.sock", description="Engine API unix socket used by the engine backend."
+    )
+    output_buffer_bytes: int = Field(
+        default=64 * 1024,
+        description="Bytes of each command's head and tail kept in memory; the rest is only in the spill file.",
+    )
+    cache_dir: str = Field(
+        default="~/.cache/agentbench", description="Host cache root shared by all runs."
+    )
+    pip_cache_volume: Optional[str] = Field(
+        default=None, description="Named docker volume mounted as the pip cache (PIP_CACHE_DIR)."
+    )
+    uv_cache_volume: Optional[str] = Field(
+        default=None, description="Named docker volume mounted as the uv cache (UV_CACHE_DIR)."
+    )
+    wheelhouse_volume: Optional[str] = Field(
+        default=None,
+        description="Named docker volume of wheels mounted at /cache/wheelhouse as pip/uv find-links. With network "
+        "'none' it is the only package source; otherwise setups that downloaded anything add their wheels to it.",
+    )
+    snapshots: bool = Field(
+        default=False,
+        description="Commit the container after setup and start later runs with the same key from that image.",
+    )
+    snapshot_budget_gb: float = Field(
+        default=50.0, description="Disk budget for setup snapshots; least recently used are evicted."
+    )
+    git_mirror: bool = Field(
+        default=False,
+        description="Clone from a host-side bare mirror (<cache_dir>/git/<hash>.git) mounted into the container.",
+    )
+    command_channel: bool = Field(
+        default=False,
+        description="Run shell commands through one persistent in-container helper instead of a docker exec each.",
+    )
+    single_pass_deps: bool = Field(
+        default=False,
+        description="Resolve compat pins and leading pip installs in one install against a constraints file.",
+    )
+    env_lock: bool = Field(
+        default=False,
+        description="Save `pip freeze` after a successful setup (<cache_dir>/locks/<key>.txt) and replay it with "
+        "`uv pip sync` on later runs of the same setup, falling back to the setup commands if the replay fails.",
+    )
+    batch_setup: bool = Field(
+        default=False,
+        description="Send all setup commands as one marker-delimited script instead of one shell per command.",
+    )
+    two_phase: bool = Field(
+        default=False,
+        description="Set up in a container on `network`, then test in a fresh container on `test_network`; both "
+        "mount the same named volumes at the workdir and the venv. Not combinable with snapshots or a pool.",
+    )
+    test_network: str = Field(
+        default="none", description="Network mode of the test container in two-phase runs."
+    )
+    sharded_tests: bool = Field(
+        default=False,
+        description="Run the task's FAIL_TO_PASS and PASS_TO_PASS ids as parallel pytest shards and judge the test "
+        "stage from their JUnit XML; tasks without ids or a pytest test_command run test_command as usual.",
+    )
+    test_shards: Optional[int] = Field(
+        default=None, description="Number of pytest shards for sharded_tests (default: the container's CPU count)."
+    )
+    keep_container: bool = Field(
+        default=False, description="Leave the container (two-phase: the volumes) after the run so `ab rerun` can reuse it."
+    )
+    keep_ttl_hours: float = Field(
+        default=24.0, description="Kept containers older than this are removed by `ab gc`."
+    )
+
+
+class FetchStrategy(str, Enum):
+    full = "full"
+    shallow = "shallow"
+    partial = "partial"
 
 
 class RepoSpec(BaseModel):
     repo_url: str = Field(description="Git URL (or local path) to clone.")
     commit: str = Field(description="Commit SHA or ref to checkout.")
+    environment_setup_commit: Optional[str] = Field(
+        default=None,
+        description="Commit to run setup at when snapshots are enabled (defaults to `commit`).",
+    )
+    fetch_strategy: FetchStrategy = Field(
+        default=FetchStrategy.full,
+        description="full: clone all history; shallow: depth-1 fetch of `commit` only; "
+        "partial: --filter=blob:none clone, blobs fetched on checkout.",
+    )
     apply_compat: bool = Field(
         default=True, description="Apply compatibility rewrites before setup."
     )
@@ -47,3 +142,9 @@ class TaskSpec(BaseModel):
     env: Dict[str, str] = Field(
         default_factory=dict, description="Env overrides for setup/test commands."
     )
+    fail_to_pass: List[str] = Field(
+        default_factory=list, description="pytest node ids the fix makes pass (fail at baseline)."
+    )
+    pass_to_pass: List[str] = Field(
+        default_factory=list, description="pytest node ids that pass both before and after the fix."
+    )
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class DependencyPin(BaseModel):
+    requirement: str = Field(description="Requirement specifier, e.g. 'setuptools<69'.")
+    source: str = Field(description="Where the pin comes from: setuptools_cap, pytest_cap, repo_compat, or a runtime-plan heuristic.")
+
+
+class DependencyPlan(BaseModel):
+    pins: List[DependencyPin] = Field(default_factory=list, description="Compat pins, written to the constraints file.")
+    constraints_path: str = Field(description="In-container path of the constraints file.")
+    commands: List[str] = Field(default_factory=list, description="Setup commands to run, in order.")
+    install_index: Optional[int] = Field(
+        default=None, description="Index in `commands` of the single-pass install, if there is one."
+    )
+    merged: List[str] = Field(
+        default_factory=list, description="Original setup commands folded into the single-pass install."
+    )
+    env: Dict[str, str] = Field(default_factory=dict, description="Env vars that apply the constraints to every pip run.")
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from .deps import DependencyPin
+
+
+class RepoFacts(BaseModel):
+    """What a static parse of one commit found; cached per (repo, commit)."""
+
+    repo_url: str = Field(description="Repository URL.")
+    commit: str = Field(description="Commit that was parsed.")
+    files: List[str] = Field(default_factory=list, description="Packaging/config files present at the commit.")
+    python_requires: Optional[str] = Field(default=None, description="requires-python / python_requires, if declared.")
+    python_versions: List[str] = Field(
+        default_factory=list, description="Python versions hinted by classifiers, .python-version, runtime.txt or tox envs."
+    )
+    max_python: Optional[str] = Field(default=None, description="Newest Python the hints allow, if they bound it.")
+    requirement_files: List[str] = Field(default_factory=list, description="requirements*.txt files, install order.")
+    extras: List[str] = Field(default_factory=list, description="Test/dev extras declared by the project.")
+    lockfile: Optional[str] = Field(default=None, description="poetry.lock or Pipfile.lock, if present.")
+    dependencies: List[str] = Field(default_factory=list, description="Normalized project names the repo depends on.")
+    flags: List[str] = Field(
+        default_factory=list,
+        description="Known problem markers: legacy_setuptools, legacy_pytest, flask_2_0, collections_rewrite.",
+    )
+
+
+class CandidateFix(BaseModel):
+    name: str = Field(description="Heuristic name, e.g. setuptools_cap.")
+    reason: str = Field(description="Why it was proposed: the error it matched, or 'fallback'.")
+    pins: List[DependencyPin] = Field(default_factory=list, description="Pins the fix adds.")
+    python_version: Optional[str] = Field(default=None, description="Python to switch to; forces a fresh container.")
+    no_build_isolation: bool = Field(default=False, description="Install the project with --no-build-isolation.")
+    apply_compat: bool = Field(default=False, description="Turn on the collections.abc rewrite.")
+
+
+class RuntimePlan(BaseModel):
+    repo_url: str = Field(description="Repository URL.")
+    commit: str = Field(description="Commit the plan is for.")
+    python_version: Optional[str] = Field(default=None, description="Python version; None keeps the configured image.")
+    image: str = Field(description="Image to run the plan in.")
+    pins: List[DependencyPin] = Field(default_factory=list, description="Pins applied through the constraints file.")
+    installs: List[str] = Field(
+        default_factory=list, description="Dependency installs (lockfile or requirements files) before the project itself."
+    )
+    extras: List[str] = Field(default_factory=list, description="Extras to install the project with.")
+    install_pytest: bool = Field(default=True, description="Install pytest separately (the project does not bring it).")
+    no_build_isolation: bool = Field(default=False, description="Install the project without build isolation.")
+    apply_compat: bool = Field(default=False, description="Run the collections.abc rewrite before setup.")
+    setup_commands: List[str] = Field(default_factory=list, description="Full setup command list for a fresh container.")
+    env: Dict[str, str] = Field(default_factory=dict, description="Env for setup and test (PIP_CONSTRAINT).")
+    test_command: str = Field(description="Test command.")
+    fixes: List[str] = Field(default_factory=list, description="Heuristic fixes applied so far, in order.")
+
+
+class PlanTrial(BaseModel):
+    round: int = Field(description="Validation round (0 is the unmodified plan).")
+    fixes: List[str] = Field(default_factory=list, description="Fixes this trial's plan carries.")
+    image: str = Field(description="Image the trial container started from (a checkpoint when forked).")
+    forked: bool = Field(default=False, description="True if started from a checkpoint instead of a fresh clone.")
+    outcome: str = Field(description="ok, start_failed, setup_failed, test_broken or test_unexpected.")
+    completed: int = Field(default=0, description="Setup commands of the plan done when the trial stopped.")
+    failed_command: Optional[str] = Field(default=None, description="Command that failed, if any.")
+    error: Optional[str] = Field(default=None, description="Tail of the failing command's output.")
+    duration_sec: float = Field(default=0.0, description="Trial wall time.")
+
+
+class PlanOutcome(BaseModel):
+    success: bool = Field(default=False, description="True if a plan installed and its tests behaved as expected.")
+    plan: RuntimePlan = Field(description="The validated plan, or the one that got furthest.")
+    facts: RepoFacts = Field(description="Static parse the plan was built from.")
+    trials: List[PlanTrial] = Field(default_factory=list, description="Every trial, in the order they finished.")
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -20,16 +20,42 @@ class CommandResult(BaseModel):
     exit_code: Optional[int] = Field(default=None, description="Exit code (None if timeout).")
     stdout: str = Field(default="", description="Captured stdout.")
     stderr: str = Field(default="", description="Captured stderr.")
+    stdout_path: Optional[str] = Field(default=None, description="File holding the full stdout, if spilled.")
+    stderr_path: Optional[str] = Field(default=None, description="File holding the full stderr, if spilled.")
+    stdout_bytes: Optional[int] = Field(default=None, description="Total stdout size; larger than `stdout` when trimmed.")
+    stderr_bytes: Optional[int] = Field(default=None, description="Total stderr size; larger than `stderr` when trimmed.")
     duration_sec: float = Field(default=0.0, description="Duration in seconds.")
+    in_container_sec: Optional[float] = Field(
+        default=None, description="Time the command itself ran inside the container; the rest of duration_sec is docker overhead."
+    )
     started_at: datetime = Field(default_factory=datetime.utcnow, description="Start timestamp.")
     timed_out: bool = Field(default=False, description="True if command timed out.")
 
 
+class TestStatus(str, Enum):
+    passed = "passed"
+    failed = "failed"
+    error = "error"
+    skipped = "skipped"
+    missing = "missing"
+
+
+class TestOutcome(BaseModel):
+    nodeid: str = Field(description="pytest node id from FAIL_TO_PASS/PASS_TO_PASS.")
+    status: TestStatus = Field(description="Outcome from the JUnit XML; missing if no shard reported the test.")
+    duration_sec: float = Field(default=0.0, description="Duration reported in the JUnit XML.")
+    shard: Optional[int] = Field(default=None, description="Shard that ran the test.")
+    message: Optional[str] = Field(default=None, description="Failure, error or skip message (truncated).")
+
+
 class StageResult(BaseModel):
     name: str = Field(description="Stage name (clone, checkout, setup, test, etc.).")
     status: StageStatus = Field(default=StageStatus.success, description="Stage status.")
     commands: List[CommandResult] = Field(default_factory=list, description="Commands run.")
     error: Optional[str] = Field(default=None, description="Error summary, if any.")
+    tests: List[TestOutcome] = Field(
+        default_factory=list, description="Per-test outcomes of a sharded test stage, FAIL_TO_PASS first."
+    )
 
 
 class RunReport(BaseModel):
@@ -40,4 +66,52 @@ class RunReport(BaseModel):
     started_at: datetime = Field(default_factory=datetime.utcnow, description="Run start time.")
     completed_at: Optional[datetime] = Field(default=None, description="Run end time.")
     success: bool = Field(default=False, description="True if all expected conditions met.")
+    cache_stats: Dict[str, int] = Field(
+        default_factory=dict, description="Package cache hits/misses observed in setup output."
+    )
     notes: Optional[str] = Field(default=None, description="Optional run notes.")
+    container: Optional[str] = Field(default=None, description="Container left running for `ab rerun`, if kept.")
+    volumes: List[str] = Field(
+        default_factory=list, description="Named volumes of a kept two-phase run (workspace, venv) for `ab rerun`."
+    )
+
+
+class ContainerHandle(BaseModel):
+    container: str = Field(default="", description="Name of the kept container; empty for a two-phase run.")
+    volumes: List[str] = Field(default_factory=list, description="Kept two-phase volumes (workspace, venv).")
+    run_dir: str = Field(description="Run directory whose report reruns append to.")
+    test_patch: str = Field(default="", description="Test patch applied by the run (needed to rerun apply_patch).")
+    created_at: datetime = Field(default_factory=datetime.utcnow, description="When the container was kept.")
+    expires_at: datetime = Field(description="After this, `ab gc` removes the container.")
+
+
+class InstanceResult(BaseModel):
+    instance_id: str = Field(description="Instance id from the config.")
+    success: bool = Field(default=False, description="True if the run met expectations.")
+    run_dir: Optional[str] = Field(default=None, description="Per-instance run directory.")
+    report_path: Optional[str] = Field(default=None, description="Path to run_report.json.")
+    failed_stage: Optional[str] = Field(default=None, description="First stage that did not succeed.")
+    error: Optional[str] = Field(default=None, description="Error summary, if any.")
+    duration_sec: float = Field(default=0.0, description="Wall-clock duration in seconds.")
+    stage_metrics: Dict[str, Dict[str, float]] = Field(
+        default_factory=dict, description="Per stage: wall, in-container and overhead seconds (see sandbox.metrics)."
+    )
+
+
+class BatchReport(BaseModel):
+    config: Optional[str] = Field(default=None, description="Config file the batch was loaded from.")
+    workers: int = Field(default=1, description="Number of concurrent workers.")
+    results: List[InstanceResult] = Field(default_factory=list, description="Per-instance outcomes.")
+    started_at: datetime = Field(default_factory=datetime.utcnow, description="Batch start time.")
+    completed_at: Optional[datetime] = Field(default=None, description="Batch end time.")
+    stage_percentiles: Dict[str, Dict[str, Dict[str, float]]] = Field(
+        default_factory=dict, description="Per stage and field: count, p50, p95 and p99 across instances."
+    )
+
+    @property
+    def passed(self) -> int:
+        return sum(1 for r in self.results if r.success)
+
+    @property
+    def failed(self) -> int:
+        return len(self.results) - self.passed
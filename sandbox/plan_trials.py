@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from sandbox.backend import DockerBackend, make_client
+from sandbox.caches import cache_mounts
+from sandbox.compat import collections_rewrite_command
+from sandbox.deps import constraints_command, install_command
+from sandbox.logger import EventLogger
+from sandbox.models import CandidateFix, CommandResult, PlanOutcome, PlanTrial, RepoFacts, RepoSpec, RuntimePlan, SandboxConfig, StageStatus, TaskSpec
+from sandbox.runtime_plan import apply_fix, candidate_fixes
+from sandbox.session import SessionRunner, merge_env
+
+# Test output that means the suite never really ran (collection/import/build errors).
+BROKEN_TEST_RE = re.compile(r"ImportError|ModuleNotFoundError|SyntaxError|ERROR collecting|errors? during collection|INTERNALERROR")
+_OUTCOME_RANK = {"start_failed": 0, "setup_failed": 1, "test_broken": 2, "test_unexpected": 2, "ok": 3}
+
+
+class Checkpoint:
+    """A committed image of a trial container and the plan commands already done in it."""
+
+    def __init__(self, tag: str, plan: RuntimePlan, done: List[str]):
+        self.tag = tag
+        self.plan = plan
+        self.done = done
+
+
+def _tail(res: CommandResult, limit: int = 4000) -> str:
+    return f"{res.stdout}\n{res.stderr}".strip()[-limit:]
+
+
+class PlanValidator:
+    """Validation loop for a RuntimePlan: run it, and on failure try candidate fixes in parallel.
+
+    Round 0 runs the plan in a fresh container (clone, checkout, rewrite,
+    then setup one command at a time). Every setup command that takes at
+    least ``checkpoint_min_sec`` is followed by a ``docker commit``, so the
+    last good state is an image. When a trial fails, up to ``parallel``
+    fixes from ``candidate_fixes`` are tried at once, each in a container
+    started from the latest checkpoint. Only the new pins are installed
+    there, and setup resumes from the first command not yet done. A Python
+    change needs a new image and starts fresh instead. The best trial of a
+    round (success, else the one that got furthest) seeds the next round.
+    """
+
+    def __init__(
+        self,
+        config: SandboxConfig,
+        client: Optional[DockerBackend] = None,
+        logger: Optional[EventLogger] = None,
+        parallel: int = 3,
+        max_rounds: int = 3,
+        checkpoint_min_sec: float = 20.0,
+    ):
+        self.config = config
+        self.client = client or make_client(config, logger=logger)
+        self.logger = logger
+        self.parallel = max(1, parallel)
+        self.max_rounds = max_rounds
+        self.checkpoint_min_sec = checkpoint_min_sec
+        self.repo_dir = f"{config.workdir}/repo"
+        self._images: List[str] = []
+
+    def _fresh(self, repo: RepoSpec, plan: RuntimePlan, name: str, test_patch: str) -> CommandResult:
+        """Start ``name`` from the plan's image with the repo cloned, checked out and patched."""
+        cfg = self.config.model_copy(
+            update={"image": plan.image, "container_name": name, "keep_container": True, "batch_setup": False, "single_pass_deps": False, "snapshots": False}
+        )
+        spec = repo.model_copy(update={"commit": plan.commit, "apply_compat": plan.apply_compat, "setuptools_cap": None, "pytest_cap": None})
+        report = SessionRunner(cfg, client=self.client, logger=self.logger).run(spec, TaskSpec(test_command="true", expected_fail=False), test_patch=test_patch)
+        failed = next((s for s in report.stages if s.status == StageStatus.failed), None)
+        if failed is None:
+            return CommandResult(command="prepare", exit_code=0)
+        return failed.commands[-1] if failed.commands else CommandResult(command=failed.name, exit_code=1, stderr=failed.error or "")
+
+    def _fork(self, tag: str, name: str) -> CommandResult:
+        volumes, cache_env = cache_mounts(self.config)
+        return self.client.run_container(
+            image=tag,
+            name=name,
+            workdir=self.config.workdir,
+            env=merge_env(cache_env, self.config.env),
+            network=self.config.network,
+            detach=True,
+            volumes=volumes,
+        )
+
+    def _commands(self, plan: RuntimePlan, start: Optional[Checkpoint], fix: Optional[CandidateFix]) -> List[str]:
+        if start is None:
+            return list(plan.setup_commands)
+        remaining = [c for c in plan.setup_commands if c not in start.done]
+        prelude: List[str] = []
+        if fix and fix.apply_compat:
+            prelude.append(collections_rewrite_command(self.repo_dir))
+        if fix and fix.pins:
+            # Earlier installs already happened under the old constraints; put the pinned versions in place.
+            prelude.append(install_command([p.requirement for p in fix.pins]))
+        head = 1 if plan.pins and remaining[:1] == [constraints_command(plan.pins)] else 0
+        return remaining[:head] + prelude + remaining[head:]
+
+    def trial(
+        self,
+        round_no: int,
+        repo: RepoSpec,
+        plan: RuntimePlan,
+        test_patch: str = "",
+        expected_fail: bool = True,
+        start: Optional[Checkpoint] = None,
+        fix: Optional[CandidateFix] = None,
+    ) -> Tuple[PlanTrial, Optional[Checkpoint]]:
+        """Run ``plan`` once; returns the trial and the latest checkpoint it left (or ``start``)."""
+        began = time.time()
+        name = f"ab-plan-{uuid.uuid4().hex[:8]}"
+        trial = PlanTrial(round=round_no, fixes=plan.fixes, image=start.tag if start else plan.image, forked=start is not None, outcome="start_failed")
+        checkpoint = start
+        done = list(start.done) if start else []
+        env = merge_env(self.config.env, plan.env)
+        try:
+            res = self._fork(start.tag, name) if start else self._fresh(repo, plan, name, test_patch)
+            if res.exit_code != 0:
+                trial.failed_command, trial.error = res.command, _tail(res)
+                return trial, checkpoint
+            commands = self._commands(plan, start, fix)
+            for i, cmd in enumerate(commands):
+                res = self.client.exec(name, ["bash", "-lc", f"cd {self.repo_dir} && {cmd}"], env=env, timeout=self.config.tool_timeout_sec)
+                if res.exit_code != 0 or res.timed_out:
+                    trial.outcome, trial.failed_command, trial.error = "setup_failed", cmd, _tail(res)
+                    return trial, checkpoint
+                if cmd in plan.setup_commands:
+                    done.append(cmd)
+                if res.duration_sec >= self.checkpoint_min_sec and i < len(commands) - 1:
+                    tag = f"ab-plan-checkpoint:{uuid.uuid4().hex[:12]}"
+                    if self.client.commit(name, tag).exit_code == 0:
+                        self._images.append(tag)
+                        checkpoint = Checkpoint(tag, plan, list(done))
+            res = self.client.exec(name, ["bash", "-lc", f"cd {self.repo_dir} && {plan.test_command}"], env=env, timeout=self.config.tool_timeout_sec)
+            output = _tail(res)
+            broken = BROKEN_TEST_RE.search(output) is not None
+            passed = res.exit_code == 0
+            if broken and not passed:
+                trial.outcome = "test_broken"
+            elif passed == (not expected_fail):
+                trial.outcome = "ok"
+            else:
+                trial.outcome = "test_unexpected"
+            if trial.outcome != "ok":
+                trial.failed_command, trial.error = plan.test_command, output
+            return trial, checkpoint
+        finally:
+            trial.completed = sum(1 for c in plan.setup_commands if c in done)
+            trial.duration_sec = time.time() - began
+            self.client.rm(name, force=True)
+            if self.logger:
+                self.logger.info(
+                    "plan trial",
+                    stage="plan",
+                    data={"round": round_no, "fixes": plan.fixes, "forked": trial.forked, "outcome": trial.outcome, "completed": trial.completed},
+                )
+
+    def validate(self, repo: RepoSpec, plan: RuntimePlan, facts: RepoFacts, test_patch: str = "", expected_fail: bool = True) -> PlanOutcome:
+        outcome = PlanOutcome(plan=plan, facts=facts)
+        try:
+            trial, checkpoint = self.trial(0, repo, plan, test_patch, expected_fail)
+            outcome.trials.append(trial)
+            best = (plan, trial, checkpoint)
+            for round_no in range(1, self.max_rounds + 1):
+                if best[1].outcome in ("ok", "start_failed"):
+                    break
+                fixes = candidate_fixes(best[1].error or "", best[0], facts, limit=self.parallel)
+                if not fixes:
+                    break
+                with ThreadPoolExecutor(max_workers=len(fixes), thread_name_prefix="ab-plan") as executor:
+                    futures = []
+                    for fix in fixes:
+                        fixed = apply_fix(best[0], fix, self.config.image)
+                        start = None if fix.python_version else best[2]
+                        futures.append((fixed, executor.submit(self.trial, round_no, repo, fixed, test_patch, expected_fail, start, fix)))
+                    results = [(fixed, *fut.result()) for fixed, fut in futures]
+                outcome.trials += [t for _, t, _ in results]
+                # Candidate order breaks ties: matched heuristics come before fallbacks.
+                best = max(results, key=lambda r: (_OUTCOME_RANK[r[1].outcome], r[1].completed))
+            outcome.plan = best[0]
+            outcome.success = best[1].outcome == "ok"
+            return outcome
+        finally:
+            for tag in self._images:
+                self.client.rmi(tag)
+            self._images = []
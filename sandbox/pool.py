@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Optional, Tuple
+
+from sandbox.caches import cache_mounts
+from sandbox.backend import DockerBackend
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult, SandboxConfig
+
+# Copy of the image's empty venv, taken when a pooled container starts, so a
+# reset can throw away whatever the previous run installed.
+PRISTINE_VENV = "/home/agent/.ab-venv-pristine"
+
+
+class PooledContainer:
+    def __init__(self, name: str, start_result: CommandResult):
+        self.name = name
+        self.start_result = start_result
+        self.uses = 0
+        self.created_at = time.time()
+
+
+class ContainerPool:
+    """Pre-started containers handed to SessionRunner instead of a cold ``docker run``.
+
+    Released containers are reset (stray python processes killed; workspace,
+    /tmp, $HOME caches and the venv wiped back to the image state) and reused
+    until ``max_uses``; then, or when a reset fails, they are destroyed and a
+    replacement is started in the background. ``resize`` moves the target with
+    demand: surplus containers are destroyed when they come back.
+    """
+
+    def __init__(
+        self,
+        client: DockerBackend,
+        config: SandboxConfig,
+        size: int = 0,
+        max_uses: int = 10,
+        logger: Optional[EventLogger] = None,
+    ):
+        self.client = client
+        self.config = config
+        self.max_uses = max(1, max_uses)
+        self.logger = logger
+        self.target = max(0, size)
+        self.volumes, cache_env = cache_mounts(config)
+        self.env = {**cache_env, **config.env}
+        self._idle: Deque[PooledContainer] = deque()
+        self._busy: Dict[str, PooledContainer] = {}
+        self._starting = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start_one(self) -> Optional[PooledContainer]:
+        name = f"ab-pool-{uuid.uuid4().hex[:10]}"
+        res = self.client.run_container(
+            image=self.config.image,
+            name=name,
+            workdir=self.config.workdir,
+            env=self.env,
+            network=self.config.network,
+            detach=True,
+            volumes=self.volumes,
+        )
+        if res.exit_code != 0:
+            self.client.rm(name)
+            return None
+        prep = self.client.exec(name, ["bash", "-lc", f"cp -a /opt/venv {PRISTINE_VENV}"])
+        if prep.exit_code != 0:
+            self._destroy(name)
+            return None
+        return PooledContainer(name, res)
+
+    def _destroy(self, name: str) -> None:
+        self.client.rm(name, force=True)
+        if self.logger:
+            self.logger.info("pool destroy", stage="pool", data={"container": name})
+
+    def _reset(self, name: str) -> bool:
+        workdir = self.config.workdir
+        script = (
+            "cd / && pkill -KILL -u \"$(id -u)\" -f -x 'python.*|pytest.*' 2>/dev/null; "
+            f"find {workdir} /tmp -mindepth 1 -maxdepth 1 -exec rm -rf {{}} + "
+            "&& rm -rf \"$HOME/.local\" \"$HOME/.cache\" "
+            f"&& find /opt/venv -mindepth 1 -maxdepth 1 -exec rm -rf {{}} + "
+            f"&& cp -a {PRISTINE_VENV}/. /opt/venv/"
+        )
+        res = self.client.exec(name, ["bash", "-lc", script])
+        return res.exit_code == 0
+
+    def prewarm(self) -> int:
+        """Start containers until the pool holds ``target``; returns how many were started."""
+        with self._lock:
+            missing = self.target - (len(self._idle) + len(self._busy) + self._starting)
+            if missing <= 0 or self._closed:
+                return 0
+            self._starting += missing
+        started = 0
+        with ThreadPoolExecutor(max_workers=missing, thread_name_prefix="ab-pool") as pool:
+            for item in pool.map(lambda _: self._start_one(), range(missing)):
+                with self._lock:
+                    self._starting -= 1
+                    if item is not None:
+                        self._idle.append(item)
+                        started += 1
+        if self.logger:
+            self.logger.info("pool prewarm", stage="pool", data={"started": started, "target": self.target})
+        return started
+
+    def acquire(self) -> Tuple[Optional[str], CommandResult]:
+        """Hand out an idle container, starting one if none is warm."""
+        start = time.time()
+        with self._lock:
+            item = self._idle.popleft() if self._idle else None
+            if item is not None:
+                self._busy[item.name] = item
+        if item is not None:
+            return item.name, CommandResult(
+                command=f"pool acquire {item.name}",
+                exit_code=0,
+                stdout=f"{item.name}\n",
+                duration_sec=time.time() - start,
+            )
+        item = self._start_one()
+        if item is None:
+            return None, CommandResult(
+                command="pool acquire (cold start)",
+                exit_code=1,
+                stderr="failed to start pooled container",
+                duration_sec=time.time() - start,
+            )
+        with self._lock:
+            self._busy[item.name] = item
+        return item.name, item.start_result
+
+    def release(self, name: str, reusable: bool = True) -> None:
+        with self._lock:
+            item = self._busy.pop(name, None)
+            surplus = len(self._idle) + len(self._busy) >= self.target
+        if item is None:
+            return
+        item.uses += 1
+        if self._closed or not reusable or surplus or item.uses >= self.max_uses or not self._reset(name):
+            self._destroy(name)
+            if not self._closed and not surplus:
+                threading.Thread(target=self.prewarm, name="ab-pool-refill", daemon=True).start()
+            return
+        with self._lock:
+            self._idle.append(item)
+
+    def resize(self, target: int) -> None:
+        """Set the number of containers to keep; idle surplus is destroyed now."""
+        with self._lock:
+            self.target = max(0, target)
+            drop = []
+            while self._idle and len(self._idle) + len(self._busy) > self.target:
+                drop.append(self._idle.pop())
+        for item in drop:
+            self._destroy(item.name)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            drop = list(self._idle)
+            self._idle.clear()
+        for item in drop:
+            self._destroy(item.name)
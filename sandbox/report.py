@@ -1,19 +1,84 @@
 from __future__ import annotations
 
+import errno
+import gzip
+import hashlib
+import io
 import json
+import os
+import shutil
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import IO, Dict, Optional, Tuple
 
-from sandbox.models import RunReport
+from sandbox.metrics import write_run_metrics
+from sandbox.models import RunReport, StageResult
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is used instead
+    zstandard = None
+
+COMPRESSION_SUFFIX = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def resolve_compression(compression: Optional[str]) -> Optional[str]:
+    if compression in (None, "", "none"):
+        return None
+    if compression == "zstd" and zstandard is None:
+        return "gzip"
+    if compression not in COMPRESSION_SUFFIX:
+        raise ValueError(f"unknown compression: {compression}")
+    return compression
+
+
+def open_artifact(path: Path) -> IO[bytes]:
+    """Open a stream file written by RunRecorder, decompressing by suffix."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst artifacts")
+        return zstandard.ZstdDecompressor().stream_reader(path.open("rb"))
+    return path.open("rb")
 
 
 class RunRecorder:
-    def __init__(self, artifacts_dir: Path, stdout_limit: int = 8000, stderr_limit: int = 8000):
+    """Writes a run's report and command output under its run directory.
+
+    ``record_stage`` (SessionRunner's ``on_stage`` hook) stores each stage's
+    streams as soon as the stage finishes and rewrites ``run_report.json``
+    with ``"complete": false``, so a crashed controller still leaves every
+    finished stage on disk; ``save`` only handles what is left, and writes
+    the run's ``metrics.json`` / ``metrics.prom`` (see sandbox.metrics).
+
+    With ``blob_dir`` set, streams are stored once by sha256 under that
+    directory (shared by every run that uses it) and hard-linked into the
+    stage dirs. ``compression`` (gzip or zstd) applies to stream files;
+    zstd falls back to gzip when ``zstandard`` is not installed.
+    """
+
+    def __init__(
+        self,
+        artifacts_dir: Path,
+        stdout_limit: int = 8000,
+        stderr_limit: int = 8000,
+        compression: Optional[str] = None,
+        blob_dir: Optional[Path] = None,
+    ):
         # artifacts_dir is the run-specific directory (e.g., artifacts/<repo>-<ts>)
         self.artifacts_dir = artifacts_dir
         self.stdout_limit = stdout_limit
         self.stderr_limit = stderr_limit
+        self.compression = resolve_compression(compression)
+        self.blob_dir = blob_dir
+        self.events_path: Optional[Path] = None
+        self._stages: Dict[int, dict] = {}
+        # Stages loaded by resume(); their stream paths are stored artifacts, not spills.
+        self._resumed = 0
         self.artifacts_dir.mkdir(parents=True, exist_ok=True)
+        if blob_dir is not None:
+            blob_dir.mkdir(parents=True, exist_ok=True)
 
     def __enter__(self):
         return self
@@ -21,46 +86,139 @@ class RunRecorder:
     def __exit__(self, exc_type, exc, tb):
         return False
 
-    def _write_stream(self, content: str, path: Path, limit: int) -> tuple[str, bool]:
-        path.write_text(content)
-        truncated = len(content.encode("utf-8")) > limit
-        preview = content
+    @property
+    def suffix(self) -> str:
+        return COMPRESSION_SUFFIX.get(self.compression or "", "")
+
+    def _source(self, content: str, spilled: Optional[str]) -> IO[bytes]:
+        if spilled and Path(spilled).is_file():
+            # The client already streamed the full output to disk.
+            return open(spilled, "rb")
+        return io.BytesIO(content.encode("utf-8"))
+
+    def _copy(self, src: IO[bytes], dest: IO[bytes]) -> str:
+        """Copy ``src`` to ``dest`` through the compressor; returns the sha256 of the raw bytes."""
+        digest = hashlib.sha256()
+        if self.compression == "zstd":
+            sink = zstandard.ZstdCompressor(level=10).stream_writer(dest, closefd=False)
+        elif self.compression == "gzip":
+            sink = gzip.GzipFile(fileobj=dest, mode="wb", mtime=0)
+        else:
+            sink = dest
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            digest.update(chunk)
+            sink.write(chunk)
+        if sink is not dest:
+            sink.close()
+        return digest.hexdigest()
+
+    def _link(self, blob: Path, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        try:
+            os.link(blob, path)
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+                raise
+            shutil.copyfile(blob, path)
+
+    def _store_stream(self, content: str, spilled: Optional[str], path: Path) -> Tuple[Path, str]:
+        """Write one stream to ``path`` (plus suffix); returns (path, sha256)."""
+        path = path.with_name(path.name + self.suffix)
+        if self.blob_dir is None and self.compression is None and spilled and Path(spilled).is_file():
+            # Plain layout: the spill file already is the artifact.
+            self._link(Path(spilled), path)
+            with path.open("rb") as fh:
+                return path, hashlib.file_digest(fh, "sha256").hexdigest()
+        with self._source(content, spilled) as src:
+            if self.blob_dir is None:
+                with path.open("wb") as dest:
+                    return path, self._copy(src, dest)
+            fd, tmp_name = tempfile.mkstemp(prefix=".blob-", dir=self.blob_dir)
+            with os.fdopen(fd, "wb") as dest:
+                digest = self._copy(src, dest)
+        tmp = Path(tmp_name)
+        blob = self.blob_dir / digest[:2] / f"{digest}{self.suffix}"
+        if blob.exists():
+            tmp.unlink()
+        else:
+            blob.parent.mkdir(exist_ok=True)
+            os.replace(tmp, blob)
+        self._link(blob, path)
+        return path, digest
+
+    def _preview(self, content: str, size: Optional[int], limit: int) -> Tuple[str, bool]:
+        truncated = max(len(content.encode("utf-8")), size or 0) > limit
         if truncated:
-            preview = content.encode("utf-8")[:limit].decode("utf-8", errors="ignore")
-        return preview, truncated
+            content = content.encode("utf-8")[:limit].decode("utf-8", errors="ignore")
+        return content, truncated
 
-    def save(self, report: RunReport, events_path: Optional[Path] = None, name: str = "run_report.json") -> Path:
-        data = report.model_dump()
-        run_dir = self.artifacts_dir
-        if events_path is None:
-            events_path = run_dir / "events.log"
-        artifacts = {"events_log": str(events_path)}
-        data["artifacts"] = artifacts
-
-        for si, stage in enumerate(data.get("stages", [])):
-            cmds = stage.get("commands") or []
-            stage_dir = run_dir / f"stage_{stage.get('name','unknown')}_{si}"
-            stage_dir.mkdir(parents=True, exist_ok=True)
-            for ci, cmd in enumerate(cmds):
-                stdout_file = stage_dir / f"cmd{ci}_stdout.txt"
-                stderr_file = stage_dir / f"cmd{ci}_stderr.txt"
-                preview_out, out_trunc = self._write_stream(cmd.get("stdout", "") or "", stdout_file, self.stdout_limit)
-                preview_err, err_trunc = self._write_stream(cmd.get("stderr", "") or "", stderr_file, self.stderr_limit)
-                cmd["stdout"] = preview_out
-                cmd["stderr"] = preview_err
-                cmd["stdout_truncated"] = out_trunc
-                cmd["stderr_truncated"] = err_trunc
-                cmd["stdout_path"] = str(stdout_file)
-                cmd["stderr_path"] = str(stderr_file)
+    def _stage_dict(self, si: int, stage: StageResult) -> dict:
+        data = stage.model_dump(mode="json")
+        stage_dir = self.artifacts_dir / f"stage_{stage.name}_{si}"
+        stage_dir.mkdir(parents=True, exist_ok=True)
+        for ci, cmd in enumerate(data.get("commands") or []):
+            for stream, limit in (("stdout", self.stdout_limit), ("stderr", self.stderr_limit)):
+                content = cmd.get(stream, "") or ""
+                path, digest = self._store_stream(content, cmd.get(f"{stream}_path"), stage_dir / f"cmd{ci}_{stream}.txt")
+                cmd[stream], cmd[f"{stream}_truncated"] = self._preview(content, cmd.get(f"{stream}_bytes"), limit)
+                cmd[f"{stream}_path"] = str(path)
+                cmd[f"{stream}_sha256"] = digest
+        return data
 
+    def _write_report(self, report: RunReport, complete: bool, name: str) -> Path:
+        data = report.model_dump(mode="json", exclude={"stages"})
+        data["stages"] = []
+        for si, stage in enumerate(report.stages):
+            if si not in self._stages:
+                self._stages[si] = self._stage_dict(si, stage)
+            data["stages"].append(self._stages[si])
+        events_path = self.events_path or self.artifacts_dir / "events.log"
+        data["artifacts"] = {
+            "events_log": str(events_path),
+            "compression": self.compression,
+            "blob_dir": str(self.blob_dir) if self.blob_dir else None,
+        }
+        data["complete"] = complete
         out_path = self.artifacts_dir / name
+        # Compact, and replaced atomically so a reader never sees a half-written report.
+        tmp = out_path.with_name(f".{name}.tmp")
+        tmp.write_text(json.dumps(data, separators=(",", ":")))
+        os.replace(tmp, out_path)
+        return out_path
+
+    def resume(self, name: str = "run_report.json") -> RunReport:
+        """Load a saved report so later stages (``ab rerun``) append to it.
 
-        def default(o):
-            from datetime import datetime
+        Stages already on disk keep their stored dicts and stream files, and
+        new streams are stored the way the original run stored its own.
+        """
+        data = json.loads((self.artifacts_dir / name).read_text())
+        for si, stage in enumerate(data.get("stages") or []):
+            self._stages[si] = stage
+        self._resumed = len(self._stages)
+        artifacts = data.get("artifacts") or {}
+        self.compression = resolve_compression(artifacts.get("compression"))
+        self.blob_dir = Path(artifacts["blob_dir"]) if artifacts.get("blob_dir") else None
+        if artifacts.get("events_log"):
+            self.events_path = Path(artifacts["events_log"])
+        return RunReport.model_validate(data)
 
-            if isinstance(o, datetime):
-                return o.isoformat()
-            return str(o)
+    def record_stage(self, report: RunReport, stage: StageResult) -> None:
+        """Checkpoint hook: store this stage's streams now and rewrite the partial report."""
+        self._write_report(report, complete=False, name="run_report.json")
 
-        out_path.write_text(json.dumps(data, indent=2, default=default))
+    def _drop_spills(self, report: RunReport) -> None:
+        # Everything is stored under the stage dirs now; the raw captures are no longer needed.
+        for stage in report.stages[self._resumed :]:
+            for cmd in stage.commands:
+                for spilled in (cmd.stdout_path, cmd.stderr_path):
+                    if spilled:
+                        Path(spilled).unlink(missing_ok=True)
+
+    def save(self, report: RunReport, events_path: Optional[Path] = None, name: str = "run_report.json") -> Path:
+        if events_path is not None:
+            self.events_path = events_path
+        out_path = self._write_report(report, complete=True, name=name)
+        write_run_metrics(self.artifacts_dir, report)
+        self._drop_spills(report)
         return out_path
@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import configparser
+import hashlib
+import json
+import os
+import re
+import shlex
+import tomllib
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sandbox.deps import CONSTRAINTS_PATH, constraints_command, project_name, repo_pins
+from sandbox.git_cache import GitMirrorCache, normalize_url
+from sandbox.logger import EventLogger
+from sandbox.models import CandidateFix, CommandResult, DependencyPin, RepoFacts, RuntimePlan
+from sandbox.scripts.snippets import COLLECTIONS_PATTERN
+
+# Bump when the parse changes so cached facts are not reused.
+PARSER_VERSION = 1
+
+# The runner-core Dockerfile's default; other versions are runner-core:py<version>
+# (docker build --build-arg PYTHON_VERSION=<version> -t runner-core:py<version> .).
+DEFAULT_PYTHON = "3.9"
+PYTHON_LADDER = ("3.11", "3.10", "3.9", "3.8", "3.7")
+
+SETUPTOOLS_CAP = "setuptools<58"  # use_2to3 and friends were removed in 58
+FLASK_20_PINS = ["Werkzeug<2.1", "Jinja2<3.1", "itsdangerous<2.1", "click<8.1", "MarkupSafe<2.1"]
+PYTEST_PINS = ["pytest>=6.2.5", "py>=1.11"]
+TEST_EXTRAS = ("test", "tests", "testing", "dev")
+
+# Repo-specific knowledge (matched as a substring of the repo URL).
+SKIP_REQUIREMENT_FILES = ("requests",)  # requirements files pin an ancient toolchain
+SHIPS_PYTEST = ("pytest-dev/pytest",)  # installing pytest would shadow the checkout
+
+_PLAN_FILE_RE = re.compile(
+    r"^(pyproject\.toml|setup\.cfg|setup\.py|tox\.ini|\.python-version|runtime\.txt|poetry\.lock|Pipfile\.lock"
+    r"|requirements[^/]*\.txt|requirements/[^/]+\.txt)$"
+)
+_VERSION_RE = re.compile(r"(?<![\d.])3\.(\d+)(?![\d])")
+_CLASSIFIER_RE = re.compile(r"Programming Language :: Python :: 3\.(\d+)")
+_UPPER_RE = re.compile(r"(<=?)\s*3\.(\d+)")
+_LEGACY_SETUP_RE = re.compile(r"use_2to3|numpy\.distutils|from distutils\.command|setup_requires\s*=")
+_LEGACY_PYTEST_RE = re.compile(r"(?im)^\s*(pytest\s*(==|<=?|~=)\s*[2-5]\.|py\s*(==|<=?)\s*1\.[0-9]\.)")
+_FLASK_20_RE = re.compile(r"(?i)\b(flask|werkzeug)\s*(==|~=|>=)\s*2\.0\b")
+_REQ_NAME_RE = re.compile(r"(?m)^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def _version_key(version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in version.split("."))
+
+
+def python_image(image: str, version: Optional[str]) -> str:
+    return f"{image.split(':')[0]}:py{version}" if version else image
+
+
+def _upper_bound(spec: Optional[str]) -> Optional[str]:
+    """Newest 3.x a ``requires-python`` spec allows, if it has an upper bound."""
+    bounds = []
+    for op, minor in _UPPER_RE.findall(spec or ""):
+        bounds.append(int(minor) if op == "<=" else int(minor) - 1)
+    return f"3.{min(bounds)}" if bounds else None
+
+
+def _requirement_names(text: str) -> List[str]:
+    names = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line or line.startswith("-"):
+            continue
+        match = _REQ_NAME_RE.match(line)
+        if match:
+            names.append(project_name(match.group(1)))
+    return names
+
+
+def _setup_py_list(text: str, keyword: str) -> str:
+    match = re.search(rf"{keyword}\s*=\s*\[(.*?)\]", text, re.S)
+    return match.group(1) if match else ""
+
+
+def parse_facts(repo_url: str, commit: str, files: Dict[str, str], collections_hits: bool) -> RepoFacts:
+    """Facts from the packaging files of one commit (``files`` maps path to contents)."""
+    facts = RepoFacts(repo_url=repo_url, commit=commit, files=sorted(files))
+    versions: set = set()
+    deps: List[str] = []
+    extras: List[str] = []
+    blob = "\n".join(files.values())
+
+    if "pyproject.toml" in files:
+        try:
+            data = tomllib.loads(files["pyproject.toml"])
+        except tomllib.TOMLDecodeError:
+            data = {}
+        project = data.get("project") or {}
+        poetry = (data.get("tool") or {}).get("poetry") or {}
+        facts.python_requires = project.get("requires-python") or str((poetry.get("dependencies") or {}).get("python") or "") or None
+        deps += [project_name(d) for d in project.get("dependencies") or []]
+        deps += [project_name(d) for d in (poetry.get("dependencies") or {}) if d != "python"]
+        extras += list(project.get("optional-dependencies") or {})
+        versions.update(_CLASSIFIER_RE.findall("\n".join(project.get("classifiers") or [])))
+    if "setup.cfg" in files:
+        cfg = configparser.ConfigParser(interpolation=None)
+        try:
+            cfg.read_string(files["setup.cfg"])
+        except configparser.Error:
+            pass
+        facts.python_requires = facts.python_requires or cfg.get("options", "python_requires", fallback=None)
+        deps += _requirement_names(cfg.get("options", "install_requires", fallback=""))
+        extras += list(cfg["options.extras_require"]) if cfg.has_section("options.extras_require") else []
+        versions.update(_CLASSIFIER_RE.findall(cfg.get("metadata", "classifiers", fallback="")))
+    if "setup.py" in files:
+        text = files["setup.py"]
+        match = re.search(r"python_requires\s*=\s*['\"]([^'\"]+)['\"]", text)
+        facts.python_requires = facts.python_requires or (match.group(1) if match else None)
+        deps += [project_name(d) for d in re.findall(r"['\"]([^'\"]+)['\"]", _setup_py_list(text, "install_requires"))]
+        extras += re.findall(r"['\"](\w+)['\"]\s*:", _setup_py_list(text, "extras_require") or text[text.find("extras_require"):][:2000])
+        versions.update(_CLASSIFIER_RE.findall(text))
+        if _LEGACY_SETUP_RE.search(text):
+            facts.flags.append("legacy_setuptools")
+    if "tox.ini" in files:
+        envlist = re.search(r"(?m)^envlist\s*=\s*(.+(?:\n[ \t]+.+)*)", files["tox.ini"])
+        versions.update(re.findall(r"py3(\d+)", envlist.group(1)) if envlist else [])
+    for name in (".python-version", "runtime.txt"):
+        versions.update(_VERSION_RE.findall(files.get(name, "")))
+
+    facts.requirement_files = sorted(
+        (p for p in files if p.startswith("requirements")),
+        key=lambda p: (any(t in p for t in ("dev", "test")), p),
+    )
+    for path in facts.requirement_files:
+        deps += _requirement_names(files[path])
+    facts.lockfile = next((p for p in ("poetry.lock", "Pipfile.lock") if p in files), None)
+    facts.python_versions = [f"3.{m}" for m in sorted({int(v) for v in versions})]
+    # An explicit upper bound wins; otherwise the newest classifier is as far as the project vouches for.
+    facts.max_python = _upper_bound(facts.python_requires) or (facts.python_versions[-1] if facts.python_versions else None)
+    facts.dependencies = sorted({d for d in deps if d})
+    facts.extras = [e for e in dict.fromkeys(extras) if e in TEST_EXTRAS]
+    if _LEGACY_PYTEST_RE.search(blob):
+        facts.flags.append("legacy_pytest")
+    if _FLASK_20_RE.search(blob):
+        facts.flags.append("flask_2_0")
+    if collections_hits:
+        facts.flags.append("collections_rewrite")
+    return facts
+
+
+class RepoParser:
+    """Static parse of a commit from the host git mirror, cached per (repo, commit).
+
+    Reads the packaging files with ``git show`` and greps for the collections
+    pattern, without a container. Results go to ``<root>/<key>.json``; a
+    commit never changes, so entries only go stale when PARSER_VERSION does.
+    """
+
+    def __init__(self, mirrors: GitMirrorCache, root: Path, logger: Optional[EventLogger] = None):
+        self.mirrors = mirrors
+        self.root = root.expanduser()
+        self.logger = logger
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(self, repo_url: str, commit: str) -> str:
+        blob = json.dumps([normalize_url(repo_url), commit, PARSER_VERSION])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+    def facts(self, repo_url: str, commit: str) -> Tuple[Optional[RepoFacts], CommandResult]:
+        """Facts for ``commit``; None when the mirror cannot provide them."""
+        path = self.root / f"{self.key(repo_url, commit)}.json"
+        try:
+            return RepoFacts.model_validate_json(path.read_text()), CommandResult(command=f"plan parse cache {path.name}", cwd=str(self.root), exit_code=0)
+        except (FileNotFoundError, ValueError):
+            pass
+        res = self.mirrors.ensure(repo_url, commit)
+        if res.exit_code != 0:
+            return None, res
+        listing = self.mirrors.ls_files(repo_url, commit)
+        if listing.exit_code != 0:
+            return None, listing
+        files: Dict[str, str] = {}
+        for name in listing.stdout.splitlines():
+            if _PLAN_FILE_RE.match(name):
+                shown = self.mirrors.show(repo_url, commit, name)
+                if shown.exit_code == 0:
+                    files[name] = shown.stdout
+        grep = self.mirrors.grep(repo_url, commit, COLLECTIONS_PATTERN, ["*.py"])
+        facts = parse_facts(repo_url, commit, files, collections_hits=grep.exit_code == 0)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(facts.model_dump_json(indent=2))
+        os.replace(tmp, path)
+        if self.logger:
+            self.logger.info("plan parse", stage="plan", data={"commit": commit, "files": len(files), "flags": facts.flags})
+        return facts, listing
+
+
+def _merge_pins(pins: List[DependencyPin], extra: Iterable[DependencyPin]) -> List[DependencyPin]:
+    """``pins`` plus ``extra``; an extra pin replaces any earlier pin on the same project."""
+    extra = list(extra)
+    replaced = {project_name(p.requirement) for p in extra}
+    return [p for p in pins if project_name(p.requirement) not in replaced] + extra
+
+
+def build_setup(plan: RuntimePlan) -> RuntimePlan:
+    """``plan`` with ``setup_commands`` and ``env`` derived from its fields."""
+    commands: List[str] = []
+    env: Dict[str, str] = {}
+    if plan.pins:
+        commands.append(constraints_command(plan.pins))
+        env["PIP_CONSTRAINT"] = CONSTRAINTS_PATH
+    # PIP_CONSTRAINT holds setuptools (and everything else) to the pins from here on.
+    commands.append("python -m pip install -U pip setuptools wheel")
+    commands += plan.installs
+    if plan.install_pytest:
+        commands.append("python -m pip install pytest")
+    target = f".[{','.join(plan.extras)}]" if plan.extras else "."
+    flags = ["--no-build-isolation"] if plan.no_build_isolation else []
+    commands.append(shlex.join(["python", "-m", "pip", "install", *flags, "-e", target]))
+    return plan.model_copy(update={"setup_commands": commands, "env": env})
+
+
+def synthesize(facts: RepoFacts, image: str, test_command: str = "python -m pytest -q", python_version: Optional[str] = None) -> RuntimePlan:
+    """First-guess runtime plan from a static parse."""
+    if python_version is None and facts.max_python and _version_key(facts.max_python) < _version_key(DEFAULT_PYTHON):
+        python_version = facts.max_python
+    pins = [DependencyPin(requirement=r, source="repo_compat") for r in repo_pins(facts.repo_url)]
+    if "legacy_setuptools" in facts.flags:
+        pins = _merge_pins(pins, [DependencyPin(requirement=SETUPTOOLS_CAP, source="legacy_setuptools")])
+    if "legacy_pytest" in facts.flags:
+        pins = _merge_pins(pins, [DependencyPin(requirement=r, source="legacy_pytest") for r in PYTEST_PINS])
+    if "flask_2_0" in facts.flags:
+        pins = _merge_pins(pins, [DependencyPin(requirement=r, source="flask_2_0") for r in FLASK_20_PINS])
+
+    repo_lower = facts.repo_url.lower()
+    installs: List[str] = []
+    if facts.lockfile == "poetry.lock":
+        installs.append(
+            "python -m pip install poetry poetry-plugin-export && poetry export --with dev --without-hashes"
+            " -f requirements.txt -o /tmp/ab-lock.txt && python -m pip install -r /tmp/ab-lock.txt"
+        )
+    elif facts.lockfile == "Pipfile.lock":
+        installs.append("python -m pip install pipenv && pipenv requirements --dev > /tmp/ab-lock.txt && python -m pip install -r /tmp/ab-lock.txt")
+    elif not any(needle in repo_lower for needle in SKIP_REQUIREMENT_FILES):
+        installs += [f"python -m pip install -r {shlex.quote(p)}" for p in facts.requirement_files]
+    return build_setup(
+        RuntimePlan(
+            repo_url=facts.repo_url,
+            commit=facts.commit,
+            python_version=python_version,
+            image=python_image(image, python_version),
+            pins=pins,
+            installs=installs,
+            extras=facts.extras,
+            install_pytest=not any(needle in repo_lower for needle in SHIPS_PYTEST) and "pytest" not in facts.dependencies,
+            no_build_isolation="legacy_setuptools" in facts.flags,
+            apply_compat="collections_rewrite" in facts.flags,
+            test_command=test_command,
+        )
+    )
+
+
+def _pin_fix(name: str, requirements: List[str]) -> Callable[[RuntimePlan, RepoFacts, str], Optional[CandidateFix]]:
+    def build(plan: RuntimePlan, facts: RepoFacts, reason: str) -> Optional[CandidateFix]:
+        current = {p.requirement for p in plan.pins}
+        if all(r in current for r in requirements):
+            return None
+        return CandidateFix(name=name, reason=reason, pins=[DependencyPin(requirement=r, source=name) for r in requirements])
+
+    return build
+
+
+def _python_downgrade(plan: RuntimePlan, facts: RepoFacts, reason: str) -> Optional[CandidateFix]:
+    current = _version_key(plan.python_version or DEFAULT_PYTHON)
+    lower = [v for v in PYTHON_LADDER if _version_key(v) < current]
+    return CandidateFix(name="python_downgrade", reason=reason, python_version=lower[0]) if lower else None
+
+
+def _no_build_isolation(plan: RuntimePlan, facts: RepoFacts, reason: str) -> Optional[CandidateFix]:
+    if plan.no_build_isolation:
+        return None
+    return CandidateFix(
+        name="no_build_isolation",
+        reason=reason,
+        no_build_isolation=True,
+        pins=[DependencyPin(requirement=SETUPTOOLS_CAP, source="no_build_isolation")],
+    )
+
+
+def _collections(plan: RuntimePlan, facts: RepoFacts, reason: str) -> Optional[CandidateFix]:
+    return None if plan.apply_compat else CandidateFix(name="collections_rewrite", reason=reason, apply_compat=True)
+
+
+# (name, error pattern, fix builder), most specific first.
+HEURISTICS: List[Tuple[str, re.Pattern, Callable[[RuntimePlan, RepoFacts, str], Optional[CandidateFix]]]] = [
+    ("collections_rewrite", re.compile(r"cannot import name '(Mutable)?Mapping' from 'collections'|module 'collections' has no attribute"), _collections),
+    ("flask_2_0", re.compile(r"cannot import name '(url_quote|escape|Markup|soft_unicode|json)' from '(werkzeug|jinja2|markupsafe|itsdangerous)"), _pin_fix("flask_2_0", FLASK_20_PINS)),
+    ("pytest_bump", re.compile(r"module 'py' has no attribute|No module named 'py\.|_pytest.*(AttributeError|TypeError)|'(Function|Module)' object has no attribute"), _pin_fix("pytest_bump", PYTEST_PINS)),
+    ("setuptools_cap", re.compile(r"use_2to3 is invalid|pkg_resources is deprecated|cannot import name '\w+' from 'setuptools|No module named 'setuptools\.\w+'"), _pin_fix("setuptools_cap", [SETUPTOOLS_CAP])),
+    ("no_build_isolation", re.compile(r"BackendUnavailable|Getting requirements to build wheel did not run successfully"), _no_build_isolation),
+    ("python_downgrade", re.compile(r"SyntaxError|No module named '(distutils|imp|asynchat)'|requires a different Python|Requires-Python"), _python_downgrade),
+]
+# Tried when the error matches nothing (or too little) to fill the parallel slots.
+FALLBACKS = ("setuptools_cap", "python_downgrade", "flask_2_0")
+
+
+def candidate_fixes(error: str, plan: RuntimePlan, facts: RepoFacts, limit: int = 3) -> List[CandidateFix]:
+    """Fixes to try in parallel for a failure with output ``error``: matching heuristics first, then fallbacks."""
+    builders = {name: build for name, _, build in HEURISTICS}
+    fixes: List[CandidateFix] = []
+    for name, pattern, build in HEURISTICS:
+        match = pattern.search(error)
+        if match and name not in plan.fixes:
+            fix = build(plan, facts, match.group(0))
+            if fix:
+                fixes.append(fix)
+    for name in FALLBACKS:
+        if name in plan.fixes or any(f.name == name for f in fixes):
+            continue
+        if name == "flask_2_0" and not {"flask", "werkzeug"} & set(facts.dependencies):
+            continue
+        fix = builders[name](plan, facts, "fallback")
+        if fix:
+            fixes.append(fix)
+    return fixes[:limit]
+
+
+def apply_fix(plan: RuntimePlan, fix: CandidateFix, image: str) -> RuntimePlan:
+    """``plan`` with ``fix`` folded in; ``image`` is the unversioned base image."""
+    version = fix.python_version or plan.python_version
+    return build_setup(
+        plan.model_copy(
+            update={
+                "python_version": version,
+                "image": python_image(image, version),
+                "pins": _merge_pins(plan.pins, fix.pins),
+                "no_build_isolation": plan.no_build_isolation or fix.no_build_isolation,
+                "apply_compat": plan.apply_compat or fix.apply_compat,
+                "fixes": [*plan.fixes, fix.name],
+            }
+        )
+    )
+
+
+def plan_instance(plan: RuntimePlan, instance_id: str, expected_fail: bool = True, test_patch: str = "") -> dict:
+    """The plan as one instance of a batch config (see sandbox.batch.instance_specs)."""
+    return {
+        "id": instance_id,
+        "repo_url": plan.repo_url,
+        "commit": plan.commit,
+        "image": plan.image,
+        "setup_commands": plan.setup_commands,
+        "test_command": plan.test_command,
+        "env": plan.env,
+        "expected_fail": expected_fail,
+        "test_patch": test_patch,
+        "notes": f"runtime plan; fixes: {', '.join(plan.fixes) or 'none'}",
+    }
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import yaml
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from fake_backend import FakeBackend  # noqa: E402
+
+from sandbox.batch import instance_specs, load_instances  # noqa: E402
+from sandbox.logger import EventLogger  # noqa: E402
+from sandbox.models import SandboxConfig  # noqa: E402
+from sandbox.report import RunRecorder  # noqa: E402
+from sandbox.session import SessionRunner  # noqa: E402
+
+BASELINE = Path(__file__).with_name("baseline.json")
+
+
+def make_repo(root: Path) -> Tuple[Path, str, str]:
+    """Bare repo with a failing and a passing commit, built like runner_core_local_clone_checkout.sh."""
+    src = root / "src"
+    src.mkdir()
+
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], cwd=src, check=True, capture_output=True, text=True).stdout.strip()
+
+    git("init", "-q")
+    git("config", "user.email", "runner@example.com")
+    git("config", "user.name", "Runner Core")
+    (src / "app.py").write_text("def add(a, b):\n    return a + b\n")
+    (src / "test_app.py").write_text("from app import add\n\ndef test_add():\n    assert add(1, 1) == 3\n")
+    git("add", "app.py", "test_app.py")
+    git("commit", "-q", "-m", "failing test commit")
+    fail_sha = git("rev-parse", "HEAD")
+    (src / "test_app.py").write_text("from app import add\n\ndef test_add():\n    assert add(1, 1) == 2\n")
+    git("add", "test_app.py")
+    git("commit", "-q", "-m", "fix test")
+    pass_sha = git("rev-parse", "HEAD")
+    bare = root / "repo.git"
+    subprocess.run(["git", "clone", "--bare", "-q", str(src), str(bare)], check=True)
+    return bare, fail_sha, pass_sha
+
+
+def write_config(root: Path, bare: Path, sha: str, count: int) -> Path:
+    instances = [
+        {
+            "id": f"bench-{i}",
+            "repo_url": str(bare),
+            "commit": sha,
+            "setup_commands": ["pip install -e .", "pip install pytest", "python -c 'import app'"],
+            "test_command": "pytest -q test_app.py",
+            "expected_fail": False,
+        }
+        for i in range(count)
+    ]
+    path = root / "bench.yaml"
+    path.write_text(yaml.safe_dump({"instances": instances}))
+    return path
+
+
+class Context:
+    def __init__(self, root: Path, scale: float) -> None:
+        self.root = root
+        self.scale = scale
+        self.bare, _, self.sha = make_repo(root)
+        self.config_path = write_config(root, self.bare, self.sha, 200)
+        self.instance = load_instances(self.config_path)[0]
+
+    def n(self, count: int) -> int:
+        return max(1, int(count * self.scale))
+
+
+def _run_instance(ctx: Context, cfg: SandboxConfig, run_dir: Path, record: bool = True):
+    repo, task, test_patch = instance_specs(ctx.instance)
+    run_dir.mkdir(parents=True, exist_ok=True)
+    logger = EventLogger(run_dir / "events.log", name="bench", echo=False)
+    try:
+        runner = SessionRunner(cfg, client=FakeBackend(), logger=logger)
+        if not record:
+            return runner.run(repo, task, test_patch=test_patch)
+        with RunRecorder(run_dir) as recorder:
+            runner.on_stage = recorder.record_stage
+            report = runner.run(repo, task, test_patch=test_patch)
+            recorder.save(report, events_path=run_dir / "events.log")
+            return report
+    finally:
+        logger.close()
+
+
+def _per_instance_ms(ctx: Context, cfg: SandboxConfig, name: str, count: int) -> float:
+    # One warm-up run fills the mirror and import caches.
+    _run_instance(ctx, cfg, ctx.root / name / "warmup")
+    times: List[float] = []
+    for i in range(ctx.n(count)):
+        start = time.perf_counter()
+        report = _run_instance(ctx, cfg, ctx.root / name / str(i))
+        times.append(time.perf_counter() - start)
+        if not report.success:
+            raise RuntimeError(f"{name}: run {i} failed: {[(s.name, s.status.value) for s in report.stages]}")
+    return statistics.median(times) * 1000
+
+
+def bench_session_overhead(ctx: Context) -> float:
+    """SessionRunner + RunRecorder for one instance against a zero-latency backend."""
+    return _per_instance_ms(ctx, SandboxConfig(cache_dir=str(ctx.root / "cache")), "session", 40)
+
+
+def bench_session_mirror(ctx: Context) -> float:
+    """As session_overhead, plus the host mirror sync and compat precheck on the local bare repo."""
+    cfg = SandboxConfig(git_mirror=True, cache_dir=str(ctx.root / "cache"))
+    return _per_instance_ms(ctx, cfg, "mirror", 20)
+
+
+def bench_report_memory(ctx: Context) -> float:
+    """KiB retained per RunReport held in memory."""
+    cfg = SandboxConfig(cache_dir=str(ctx.root / "cache"))
+    _run_instance(ctx, cfg, ctx.root / "memory" / "warmup", record=False)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    reports = [_run_instance(ctx, cfg, ctx.root / "memory" / str(i), record=False) for i in range(ctx.n(30))]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(reports) / 1024
+
+
+def bench_logger_throughput(ctx: Context) -> float:
+    """Events per second through EventLogger, including the drain on close."""
+    count = ctx.n(50_000)
+    logger = EventLogger(ctx.root / "logger" / "events.log", name="bench", echo=False)
+    start = time.perf_counter()
+    for i in range(count):
+        logger.info("command finished", stage="bench", data={"index": i, "exit": 0, "duration_sec": 0.01})
+    logger.close()
+    return count / (time.perf_counter() - start)
+
+
+def bench_config_load(ctx: Context) -> float:
+    """Microseconds per instance to load a batch config and build its specs."""
+    times: List[float] = []
+    for _ in range(ctx.n(10)):
+        start = time.perf_counter()
+        instances = load_instances(ctx.config_path)
+        for inst in instances:
+            instance_specs(inst)
+        times.append((time.perf_counter() - start) / len(instances))
+    return statistics.median(times) * 1e6
+
+
+# name -> (function, unit, higher is better)
+BENCHMARKS: Dict[str, Tuple[Callable[[Context], float], str, bool]] = {
+    "session_overhead": (bench_session_overhead, "ms/instance", False),
+    "session_mirror": (bench_session_mirror, "ms/instance", False),
+    "report_memory": (bench_report_memory, "KiB/report", False),
+    "logger_throughput": (bench_logger_throughput, "events/s", True),
+    "config_load": (bench_config_load, "us/instance", False),
+}
+
+
+def regressions(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    found = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        higher_is_better = BENCHMARKS[name][2]
+        worse = value < base * (1 - tolerance) if higher_is_better else value > base * (1 + tolerance)
+        if worse:
+            found.append(name)
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the harness itself against a fake docker backend.")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="Run only these benchmarks.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply iteration counts (e.g. 0.2 for a quick run).")
+    parser.add_argument("--baseline", type=Path, default=BASELINE, help="Baseline JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative slowdown before failing.")
+    parser.add_argument("--update-baseline", action="store_true", help="Write these results as the new baseline.")
+    parser.add_argument(
+        "--check", action="store_true", help="Fail (exit 2) when the baseline is missing or lacks a benchmark, instead of warning."
+    )
+    parser.add_argument("--json", type=Path, help="Also write results to this file.")
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.is_file() else {}
+    if not args.baseline.is_file() and not args.update_baseline:
+        print(f"WARNING: no baseline at {args.baseline}; nothing to compare against.", file=sys.stderr)
+        if args.check:
+            return 2
+    ctx = Context(Path(tempfile.mkdtemp(prefix="ab_bench_")), args.scale)
+    results: Dict[str, float] = {}
+    for name in args.only or BENCHMARKS:
+        fn, unit, _ = BENCHMARKS[name]
+        results[name] = fn(ctx)
+        base = baseline.get(name)
+        change = f"{(results[name] / base - 1) * 100:+.1f}%" if base else "n/a"
+        print(f"{name:20} {results[name]:12.2f} {unit:12} baseline={base if base is not None else '-'} ({change})")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps({**baseline, **{k: round(v, 2) for k, v in results.items()}}, indent=2) + "\n")
+        print(f"baseline updated: {args.baseline}")
+        return 0
+    unknown = [name for name in results if not baseline.get(name)]
+    if unknown and baseline:
+        print(f"WARNING: not in the baseline, not checked: {', '.join(unknown)}", file=sys.stderr)
+        if args.check:
+            return 2
+    failed = regressions(results, baseline, args.tolerance)
+    if failed:
+        print(f"REGRESSION (>{args.tolerance:.0%} worse than baseline): {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sandbox.models import CommandResult
+
+
+class FakeBackend:
+    """A DockerBackend that runs nothing and records every call.
+
+    Every operation succeeds after ``latency_sec``; ``exec`` returns
+    ``output_bytes`` of stdout so capture and reporting do real work. With
+    the default zero latency, whatever time a run takes is the controller's.
+    """
+
+    timeout_sec = 600
+
+    def __init__(self, latency_sec: float = 0.0, output_bytes: int = 2048) -> None:
+        self.latency_sec = latency_sec
+        self.output = ("x" * 79 + "\n") * max(1, output_bytes // 80)
+        self.calls: List[Tuple[str, tuple]] = []
+        self.images: Dict[str, str] = {}
+
+    def _result(self, command: str, stdout: str = "", exit_code: int = 0, in_container: Optional[float] = None) -> CommandResult:
+        started = datetime.utcnow()
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+        return CommandResult(
+            command=command,
+            exit_code=exit_code,
+            stdout=stdout,
+            stdout_bytes=len(stdout),
+            duration_sec=self.latency_sec,
+            in_container_sec=in_container,
+            started_at=started,
+        )
+
+    def run_container(self, image, name=None, workdir=None, env=None, network=None, detach=True, cmd=None, volumes=None, labels=None) -> CommandResult:
+        self.calls.append(("run_container", (image, name)))
+        return self._result(f"docker run {image}", stdout="0" * 64 + "\n")
+
+    def exec(self, container, command, workdir=None, env=None, timeout=None) -> CommandResult:
+        self.calls.append(("exec", (container, tuple(command))))
+        return self._result(" ".join(command), stdout=self.output, in_container=0.0)
+
+    def cp(self, src: str, dest: str) -> CommandResult:
+        self.calls.append(("cp", (src, dest)))
+        return self._result(f"docker cp {src} {dest}")
+
+    def commit(self, container: str, tag: str, labels: Optional[Dict[str, str]] = None) -> CommandResult:
+        self.calls.append(("commit", (container, tag)))
+        self.images[tag] = f"sha256:{len(self.images):064d}"
+        return self._result(f"docker commit {container} {tag}")
+
+    def inspect_image(self, image: str, fmt: str = "{{.Id}}") -> CommandResult:
+        self.calls.append(("inspect_image", (image,)))
+        if image not in self.images:
+            return self._result(f"docker image inspect {image}", exit_code=1)
+        return self._result(f"docker image inspect {image}", stdout=self.images[image] + "\n")
+
+    def containers(self, label: str) -> CommandResult:
+        self.calls.append(("containers", (label,)))
+        return self._result(f"docker ps --filter label={label}")
+
+    def rmi(self, image: str) -> CommandResult:
+        self.calls.append(("rmi", (image,)))
+        self.images.pop(image, None)
+        return self._result(f"docker rmi {image}")
+
+    def create_volume(self, name: str, labels: Optional[Dict[str, str]] = None) -> CommandResult:
+        self.calls.append(("create_volume", (name,)))
+        return self._result(f"docker volume create {name}", stdout=f"{name}\n")
+
+    def volumes(self, label: str) -> CommandResult:
+        self.calls.append(("volumes", (label,)))
+        return self._result(f"docker volume ls --filter label={label}")
+
+    def volume_users(self, name: str) -> CommandResult:
+        self.calls.append(("volume_users", (name,)))
+        return self._result(f"docker ps -a --filter volume={name}")
+
+    def rm_volume(self, name: str) -> CommandResult:
+        self.calls.append(("rm_volume", (name,)))
+        return self._result(f"docker volume rm -f {name}")
+
+    def stop(self, container: str) -> CommandResult:
+        self.calls.append(("stop", (container,)))
+        return self._result(f"docker stop {container}")
+
+    def rm(self, container: str, force: bool = True) -> CommandResult:
+        self.calls.append(("rm", (container,)))
+        return self._result(f"docker rm {container}")
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.async_session import AsyncSessionRunner
+from sandbox.batch import instance_specs, load_instances
+from sandbox.models import SandboxConfig
+
+
+async def run() -> int:
+    configs = [
+        Path("scripts/swe-bench/swebench_smoke.yaml"),
+        Path("scripts/swe-bench/swebench_smoke_requests.yaml"),
+    ]
+    jobs = [instance_specs(inst) for cfg in configs for inst in load_instances(cfg)]
+    runner = AsyncSessionRunner(SandboxConfig())
+    reports = await runner.run_many(jobs, concurrency=4)
+    for (repo, _, _), report in zip(jobs, reports):
+        print(f"[{Path(repo.repo_url).stem}] success={report.success} stages={[s.name for s in report.stages]}")
+    return 0 if all(r.success for r in reports) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(run()))
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.docker_client import DockerClient
+from sandbox.setup_script import new_nonce, setup_script, split_results
+
+COMMANDS = ["cd /tmp && export AB_SMOKE=1", "pwd; echo ${AB_SMOKE:-unset}", "echo warn >&2; printf partial", "exit 3", "echo never"]
+
+
+def main() -> int:
+    client = DockerClient()
+    container = "batch-setup-smoke"
+    client.rm(container)  # best-effort cleanup
+    start = client.run_container(image="runner-core", name=container, cmd=["sleep", "120"])
+    if start.exit_code not in (0, None):
+        print("start failed", start.exit_code)
+        return 1
+    try:
+        nonce = new_nonce()
+        begin = time.time()
+        res = client.exec(container, ["bash", "-lc", setup_script(COMMANDS, "/workspace", nonce)])
+        batched = time.time() - begin
+        results = split_results(res, COMMANDS, "/workspace", nonce)
+        begin = time.time()
+        for cmd in COMMANDS[:4]:
+            client.exec(container, ["bash", "-lc", f"cd /workspace && {cmd}"])
+        separate = time.time() - begin
+    finally:
+        client.stop(container)
+        client.rm(container)
+    for r in results:
+        print(r.exit_code, repr(r.stdout), repr(r.stderr), f"{r.duration_sec * 1000:.1f}ms")
+    print(f"batched={batched * 1000:.0f}ms separate={separate * 1000:.0f}ms")
+    ok = (
+        [r.exit_code for r in results] == [0, 0, 0, 3]
+        # Each command gets a fresh subshell, like its own docker exec.
+        and results[1].stdout == "/workspace\nunset\n"
+        and (results[2].stdout, results[2].stderr) == ("partial", "warn\n")
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.batch import BatchRunner, load_instances
+from sandbox.models import SandboxConfig
+
+
+def main() -> int:
+    configs = [
+        Path("scripts/swe-bench/swebench_smoke.yaml"),
+        Path("scripts/swe-bench/swebench_smoke_requests.yaml"),
+    ]
+    instances = [inst for cfg in configs for inst in load_instances(cfg)]
+    runner = BatchRunner(SandboxConfig(), Path("artifacts"), workers=2)
+    report = runner.run(instances)
+    summary = runner.save(report)
+    for res in report.results:
+        print(f"[{res.instance_id}] success={res.success} stage={res.failed_stage} {res.duration_sec:.1f}s")
+    print(f"summary: {summary}")
+    names = {Path(r.run_dir).name for r in report.results if r.run_dir}
+    return 0 if report.failed == 0 and len(names) == len(instances) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
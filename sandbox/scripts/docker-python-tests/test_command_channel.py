@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.docker_client import DockerClient
+
+
+def main() -> int:
+    client = DockerClient()
+    container = "command-channel-smoke"
+    client.rm(container)  # best-effort cleanup
+    start = client.run_container(image="runner-core", name=container, cmd=["sleep", "120"])
+    if start.exit_code not in (0, None):
+        print("start failed", start.exit_code)
+        return 1
+    channel, opened = client.open_channel(container)
+    try:
+        if not channel.alive:
+            print("channel open failed", opened.stdout, opened.stderr)
+            return 1
+        channel.run("cd /tmp && export AB_SMOKE=1")
+        state = channel.run("pwd; echo $AB_SMOKE; which python")
+        timeout = channel.run("sleep 30", timeout=2)
+        begin = time.time()
+        for _ in range(20):
+            channel.run("true")
+        per_channel = (time.time() - begin) / 20
+        begin = time.time()
+        for _ in range(20):
+            client.exec(container, ["bash", "-lc", "true"])
+        per_exec = (time.time() - begin) / 20
+    finally:
+        channel.close()
+        client.stop(container)
+        client.rm(container)
+    print(f"state={state.stdout.split()} timed_out={timeout.timed_out}")
+    print(f"per command: channel={per_channel * 1000:.1f}ms exec={per_exec * 1000:.1f}ms")
+    ok = state.stdout.split()[:2] == ["/tmp", "1"] and timeout.timed_out
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import socketserver
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.engine_client import EngineClient
+
+# Stand-in Engine API: "containers" are temp dirs on the host and exec runs the
+# command there. Enough of the API for EngineClient, no docker daemon needed.
+CONTAINERS: dict = {}
+EXECS: dict = {}
+CONNECTIONS = []
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        CONNECTIONS.append(self.client_address)
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", ctype: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, obj) -> None:
+        self._reply(status, json.dumps(obj).encode("utf-8"))
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _route(self, method: str) -> None:
+        url = urlparse(self.path)
+        parts = url.path.split("/")[2:]  # drop "" and the version prefix
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body()
+        if parts == ["containers", "create"]:
+            cid = uuid.uuid4().hex
+            CONTAINERS[cid] = CONTAINERS[query.get("name", cid)] = Path(tempfile.mkdtemp(prefix="engine-"))
+            return self._json(201, {"Id": cid})
+        if parts[0] == "containers" and parts[1] not in CONTAINERS:
+            return self._json(404, {"message": f"No such container: {parts[1]}"})
+        if parts[0] == "containers" and parts[2:] == ["start"]:
+            return self._reply(204)
+        if parts[0] == "containers" and parts[2:] == ["exec"]:
+            eid = uuid.uuid4().hex
+            EXECS[eid] = {"root": CONTAINERS[parts[1]], "spec": json.loads(body), "code": None}
+            return self._json(201, {"Id": eid})
+        if parts[0] == "containers" and parts[2:] == ["archive"]:
+            root = CONTAINERS[parts[1]]
+            target = root / query["path"].lstrip("/")
+            if method == "PUT":
+                target.mkdir(parents=True, exist_ok=True)
+                with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+                    tar.extractall(target, filter="data")
+                return self._reply(200)
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode="w") as tar:
+                tar.add(target, arcname=target.name)
+            return self._reply(200, buf.getvalue(), "application/x-tar")
+        if parts[0] == "containers" and method == "DELETE":
+            return self._reply(204)
+        if parts[0] == "exec" and parts[2:] == ["start"]:
+            ex = EXECS[parts[1]]
+            proc = subprocess.run(ex["spec"]["Cmd"], cwd=ex["root"], capture_output=True)
+            ex["code"] = proc.returncode
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.end_headers()
+            for kind, data in ((1, proc.stdout), (2, proc.stderr)):
+                if data:
+                    self.wfile.write(struct.pack(">BxxxI", kind, len(data)) + data)
+            self.close_connection = True
+            return None
+        if parts[0] == "exec" and parts[2:] == ["json"]:
+            return self._json(200, {"ExitCode": EXECS[parts[1]]["code"]})
+        if parts[0] == "images" and parts[-1] == "json":
+            return self._json(200, {"Id": "sha256:standin", "Size": 1234})
+        return self._json(404, {"message": f"unsupported {method} {url.path}"})
+
+    def do_GET(self) -> None:
+        self._route("GET")
+
+    def do_POST(self) -> None:
+        self._route("POST")
+
+    def do_PUT(self) -> None:
+        self._route("PUT")
+
+    def do_DELETE(self) -> None:
+        self._route("DELETE")
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main() -> int:
+    sock = os.path.join(tempfile.mkdtemp(), "engine.sock")
+    server = Server(sock, Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = EngineClient(socket_path=sock)
+    checks = {}
+
+    start = client.run_container(image="runner-core", name="engine-smoke")
+    checks["start"] = start.exit_code == 0
+    res = client.exec("engine-smoke", ["bash", "-c", "echo out; echo err >&2; exit 3"])
+    checks["exec"] = (res.exit_code, res.stdout, res.stderr) == (3, "out\n", "err\n")
+
+    src = Path(tempfile.mkdtemp()) / "patch.diff"
+    src.write_text("hello\n")
+    client.cp(str(src), "engine-smoke:/tmp/patch.diff")
+    back = src.with_name("back.diff")
+    client.cp("engine-smoke:/tmp/patch.diff", str(back))
+    checks["cp"] = back.read_text() == "hello\n"
+
+    checks["inspect"] = client.inspect_image("runner-core", fmt="{{.Size}}").stdout.strip() == "1234"
+    missing = client.exec("nope", ["true"])
+    checks["missing"] = missing.exit_code == 1 and "No such container" in missing.stderr
+
+    before = len(CONNECTIONS)
+    for _ in range(20):
+        client.inspect_image("runner-core")
+    checks["keepalive"] = len(CONNECTIONS) - before <= 1
+    client.rm("engine-smoke")
+    client.close()
+    server.shutdown()
+    print(checks)
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.batch import instance_specs, load_instances
+from sandbox.models import SandboxConfig
+from sandbox.session import SessionRunner
+
+
+def main() -> int:
+    inst = load_instances(Path("scripts/swe-bench/swebench_smoke_requests.yaml"))[0]
+    repo, task, test_patch = instance_specs(inst)
+    # A fresh cache dir so the first run always installs and saves the lock.
+    cfg = SandboxConfig(env_lock=True, cache_dir=tempfile.mkdtemp(prefix="ab_env_lock_"))
+    reports = []
+    for label in ("install", "replay"):
+        begin = time.time()
+        report = SessionRunner(cfg).run(repo, task, test_patch=test_patch)
+        print(label, report.success, f"{time.time() - begin:.1f}s", [(s.name, s.status.value) for s in report.stages])
+        reports.append(report)
+    first, second = ([s.name for s in r.stages] for r in reports)
+    ok = (
+        all(r.success for r in reports)
+        and "lock_save" in first
+        # The second run syncs from the lock and never runs the setup commands.
+        and "lock_replay" in second
+        and "setup" not in second
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from typer.testing import CliRunner
+
+from cli.ab import app
+from sandbox.docker_client import DockerClient
+from sandbox.keep import HANDLE_NAME, kept_containers, load_handle
+
+CONFIG = "scripts/swe-bench/swebench_smoke_requests.yaml"
+
+
+def main() -> int:
+    cli = CliRunner()
+    artifacts = Path(tempfile.mkdtemp(prefix="ab-gc-"))
+    # A zero TTL makes the kept container expire as soon as the run ends.
+    res = cli.invoke(
+        app, ["--config", CONFIG, "--artifacts-dir", str(artifacts), "--keep-container", "--keep-ttl-hours", "0"]
+    )
+    print(res.output)
+    container = load_handle(next(p.parent for p in artifacts.rglob(HANDLE_NAME))).container
+    client = DockerClient()
+    try:
+        res = cli.invoke(app, ["gc", "--dry-run"])
+        print(res.output)
+        listed = f"would remove {container}" in res.output
+        res = cli.invoke(app, ["gc"])
+        print(res.output)
+        removed = f"removed {container}" in res.output
+        gone = container not in [name for name, _ in kept_containers(client)[0]]
+        print("listed:", listed, "removed:", removed, "gone:", gone)
+    finally:
+        client.rm(container, force=True)
+    return 0 if listed and removed and gone else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.models import FetchStrategy, RepoSpec, SandboxConfig, TaskSpec
+from sandbox.session import SessionRunner
+
+
+def make_repo(root: Path) -> tuple[Path, str]:
+    src = root / "src"
+    src.mkdir()
+
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], cwd=src, check=True, capture_output=True, text=True).stdout.strip()
+
+    git("init", "-q")
+    git("config", "user.email", "runner@example.com")
+    git("config", "user.name", "Runner Core")
+    for i in range(3):
+        (src / "app.py").write_text(f"VALUE = {i}\n")
+        git("add", "app.py")
+        git("commit", "-q", "-m", f"commit {i}")
+    sha = git("rev-parse", "HEAD~1")
+    bare = root / "repo.git"
+    subprocess.run(["git", "clone", "--bare", "-q", str(src), str(bare)], check=True)
+    return bare, sha
+
+
+def main() -> int:
+    root = Path(tempfile.mkdtemp(prefix="mirror_strategies_"))
+    bare, sha = make_repo(root)
+    # The host path only exists on the host, so every clone has to go through the mounted mirror.
+    cfg = SandboxConfig(git_mirror=True, cache_dir=str(root / "cache"), network="none")
+    failures = 0
+    for strategy in FetchStrategy:
+        repo = RepoSpec(repo_url=str(bare), commit=sha, fetch_strategy=strategy, apply_compat=False)
+        task = TaskSpec(
+            setup_commands=["git rev-list --count HEAD"],
+            test_command='python -c "import app; assert app.VALUE == 1"',
+            expected_fail=False,
+        )
+        report = SessionRunner(cfg).run(repo, task)
+        setup = next((s for s in report.stages if s.name == "setup"), None)
+        depth = setup.commands[0].stdout.strip() if setup and setup.commands else "?"
+        print(f"[{strategy.value}] success={report.success} history={depth}")
+        if not report.success or (strategy == FetchStrategy.shallow and depth != "1"):
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
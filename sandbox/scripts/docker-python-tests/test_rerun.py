@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from typer.testing import CliRunner
+
+from cli.ab import app
+from sandbox.docker_client import DockerClient
+from sandbox.keep import HANDLE_NAME, load_handle
+
+CONFIG = "scripts/swe-bench/swebench_smoke_requests.yaml"
+
+
+def main() -> int:
+    cli = CliRunner()
+    artifacts = Path(tempfile.mkdtemp(prefix="ab-rerun-"))
+    res = cli.invoke(app, ["--config", CONFIG, "--artifacts-dir", str(artifacts), "--keep-container"])
+    print(res.output)
+    run_dir = next(p.parent for p in artifacts.rglob(HANDLE_NAME))
+    container = load_handle(run_dir).container
+    try:
+        # The kept container already has the installed tree; only the test stage runs again.
+        begin = time.time()
+        res = cli.invoke(app, ["rerun", str(run_dir), "--from-stage", "test"])
+        print(res.output)
+        print(f"rerun exit {res.exit_code} {time.time() - begin:.1f}s")
+        report = json.loads((run_dir / "run_report.json").read_text())
+        tests = [s for s in report["stages"] if s["name"] == "test"]
+        print("test stages:", [s["status"] for s in tests])
+    finally:
+        DockerClient().rm(container, force=True)
+    return 0 if res.exit_code == 0 and len(tests) == 2 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
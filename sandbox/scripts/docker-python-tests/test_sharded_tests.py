@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.batch import instance_specs, load_instances
+from sandbox.models import SandboxConfig, TestStatus
+from sandbox.session import SessionRunner
+from sandbox.shards import selected_tests
+
+
+def main() -> int:
+    inst = load_instances(Path("scripts/swe-bench/swebench_smoke_requests.yaml"))[0]
+    repo, task, test_patch = instance_specs(inst)
+    begin = time.time()
+    report = SessionRunner(SandboxConfig(sharded_tests=True, test_shards=2)).run(repo, task, test_patch=test_patch)
+    print("run", report.success, f"{time.time() - begin:.1f}s", [(s.name, s.status.value) for s in report.stages])
+    stage = next((s for s in report.stages if s.name == "test"), None)
+    if stage is None:
+        return 1
+    print(stage.error or "", stage.commands[1].stdout.strip() if len(stage.commands) > 1 else "")
+    for outcome in stage.tests:
+        print(f"  {outcome.status.value:8} {outcome.duration_sec:6.2f}s shard={outcome.shard} {outcome.nodeid}")
+    # Every FAIL_TO_PASS/PASS_TO_PASS id must come back from the JUnit XML, spread over both shards.
+    ok = (
+        [o.nodeid for o in stage.tests] == selected_tests(task)
+        and all(o.status != TestStatus.missing for o in stage.tests)
+        and len({o.shard for o in stage.tests}) == 2
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
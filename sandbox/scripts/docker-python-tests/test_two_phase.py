@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.batch import instance_specs, load_instances
+from sandbox.docker_client import DockerClient
+from sandbox.keep import keeper_name
+from sandbox.models import SandboxConfig
+from sandbox.session import SessionRunner
+
+# Must fail inside a network=none test container.
+NETWORK_PROBE = "python -c \"import socket; socket.create_connection(('1.1.1.1', 53), 2)\""
+
+
+def main() -> int:
+    inst = load_instances(Path("scripts/swe-bench/swebench_smoke_requests.yaml"))[0]
+    repo, task, test_patch = instance_specs(inst)
+    runner = SessionRunner(SandboxConfig(two_phase=True, keep_container=True))
+    report = runner.run(repo, task, test_patch=test_patch)
+    print("run", report.success, [(s.name, s.status.value) for s in report.stages], report.volumes)
+    try:
+        # Each attempt gets a fresh test container on the same installed workspace and venv.
+        begin = time.time()
+        report = runner.rerun(report, repo, task, None, from_stage="test")
+        print(f"rerun test {report.success} {time.time() - begin:.1f}s")
+        probe = task.model_copy(update={"test_command": NETWORK_PROBE, "expected_fail": True})
+        report = runner.rerun(report, repo, probe, None, from_stage="test")
+        print("network probe failed as expected:", report.success)
+    finally:
+        client = DockerClient()
+        # The keeper container holds the volumes; they can only go after it.
+        client.rm(keeper_name(report.volumes[0].removesuffix("-workspace")), force=True)
+        for name in report.volumes:
+            client.rm_volume(name)
+    return 0 if report.success and len([s for s in report.stages if s.name == "start_test"]) == 3 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from sandbox.batch import instance_specs, load_instances
+from sandbox.docker_client import DockerClient
+from sandbox.models import SandboxConfig
+from sandbox.session import SessionRunner
+from sandbox.wheelhouse import added_wheels, failed_requirements, prefetch, suite_requirements
+
+VOLUME = "agentbench-wheelhouse-smoke"
+
+
+def main() -> int:
+    inst = load_instances(Path("scripts/swe-bench/swebench_smoke_requests.yaml"))[0]
+    repo, task, test_patch = instance_specs(inst)
+    subprocess.run(["docker", "volume", "rm", "-f", VOLUME], capture_output=True)
+    # The host mirror lets the offline run clone without a network.
+    cfg = SandboxConfig(wheelhouse_volume=VOLUME, git_mirror=True, cache_dir=tempfile.mkdtemp(prefix="ab_wheelhouse_"))
+    try:
+        results = prefetch(DockerClient(), cfg, suite_requirements([(repo, task)]))
+        print("prefetch added", added_wheels(results), "failed", failed_requirements(results))
+        # Bridged: installs the project's own dependencies and adds their wheels.
+        online = SessionRunner(cfg).run(repo, task, test_patch=test_patch)
+        print("online", online.success, [(s.name, s.status.value) for s in online.stages])
+        offline = SessionRunner(cfg.model_copy(update={"network": "none"})).run(repo, task, test_patch=test_patch)
+        print("offline", offline.success, [(s.name, s.status.value) for s in offline.stages], offline.cache_stats)
+    finally:
+        subprocess.run(["docker", "volume", "rm", "-f", VOLUME], capture_output=True)
+    ok = (
+        online.success
+        and offline.success
+        and "wheelhouse_fill" not in [s.name for s in offline.stages]
+        and offline.cache_stats.get("misses") == 0
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
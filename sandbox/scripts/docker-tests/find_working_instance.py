@@ -1,51 +1,59 @@
 from __future__ import annotations
 
+import fcntl
+import hashlib
 import json
 import os
 import subprocess
 import sys
-import tempfile
+import time
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Iterable, Optional
 
+ROOT = Path(__file__).resolve().parents[3]
+sys.path.append(str(ROOT))
+sys.path.append(str(ROOT / "scripts" / "swe-bench"))
+
+from import_swebench import DEFAULT_CACHE_DIR, iter_instances as iter_swebench
+from sandbox.deps import project_name, repo_pins
+from sandbox.runtime_plan import SHIPS_PYTEST, SKIP_REQUIREMENT_FILES
+
 CONFIG_PATH = Path("scripts/swe-bench/tmp_instance.yaml")
+OUT_DIR = Path("scripts/swe-bench/working")
 RUNNER = Path("sandbox/scripts/docker-tests/runner_core_swebench_smoke.sh")
 ENV_ROOT = Path("SWE-bench/swebench/resources/swebench-og")
+# The runner's verdicts: 0 when an instance worked, 1 when every check ran and one failed. Other exit
+# codes come from an aborted docker, clone or checkout step and say nothing about the instance.
+VERDICT_EXITS = (0, 1)
+# A known failure can still be a PyPI or network flake in setup; it is tried again after this long.
+DEFAULT_BAD_TTL_HOURS = 24 * 7
 
 
 def iter_instances(limit: Optional[int] = None, allow: Optional[list[str]] = None, block: Optional[list[str]] = None) -> Iterable[dict]:
-    try:
-        from datasets import load_dataset
-    except ImportError:
-        sys.exit("Install `datasets` to load SWE-bench (e.g., `uv add datasets`).")
-
-    cache_dir = Path(".hf_cache").resolve()
-    cache_dir.mkdir(exist_ok=True)
-    stream = load_dataset(
-        "princeton-nlp/SWE-bench_Lite",
-        split="test",
-        streaming=True,
-        cache_dir=str(cache_dir),
-    )
-    count = 0
-    for row in stream:
-        repo = row.get("repo", "")
-        repo_norm = repo.replace("/", "__")
-        def match(item: str) -> bool:
-            item = item.strip()
-            if not item:
-                return False
-            return item in repo or item in repo_norm
-        if allow and not any(match(a) for a in allow):
-            print(f"Skipping {row.get('instance_id')} (allowlist mismatch)", flush=True)
-            continue
-        if block and any(match(b) for b in block):
-            print(f"Skipping {row.get('instance_id')} (blocklist)", flush=True)
-            continue
-        yield row
-        count += 1
-        if limit and limit > 0 and count >= limit:
-            break
+    # Goes through the importer's local dataset cache; only the first scan needs the network.
+    # Closing the importer's stream reads a first download to the end, so the cache is written even though the scan stops early.
+    with closing(iter_swebench("lite", "test", cache_dir=os.environ.get("SWEBENCH_CACHE_DIR", DEFAULT_CACHE_DIR))) as stream:
+        count = 0
+        for row in stream:
+            repo = row.get("repo", "")
+            repo_norm = repo.replace("/", "__")
+            def match(item: str) -> bool:
+                item = item.strip()
+                if not item:
+                    return False
+                return item in repo or item in repo_norm
+            if allow and not any(match(a) for a in allow):
+                print(f"Skipping {row.get('instance_id')} (allowlist mismatch)", flush=True)
+                continue
+            if block and any(match(b) for b in block):
+                print(f"Skipping {row.get('instance_id')} (blocklist)", flush=True)
+                continue
+            yield row
+            count += 1
+            if limit and limit > 0 and count >= limit:
+                break
 
 
 def env_for_instance(instance: dict) -> Optional[Path]:
@@ -79,19 +87,10 @@ def parse_pip_deps(env_path: Path) -> list[str]:
 
 
 def adjust_deps_for_compat(repo: str, deps: list[str]) -> list[str]:
-    repo_lower = repo.lower()
-    patched: list[str] = []
-    for d in deps:
-        if "setuptools" in d and ("astropy" in repo_lower or "numpy" in repo_lower):
-            patched.append("setuptools<58")
-            continue
-        if "requests" in repo_lower and d.strip().startswith("pytest"):
-            continue
-        patched.append(d)
-    if "requests" in repo_lower:
-        patched.append("pytest==6.0.0")
-        patched.append("py>=1.8.2")
-    return patched
+    # The repo pins (sandbox.deps.REPO_PINS) replace any dep on the same project.
+    pins = repo_pins(repo)
+    pinned = {project_name(p) for p in pins}
+    return [d for d in deps if project_name(d) not in pinned] + pins
 
 
 def build_config(instance: dict) -> dict:
@@ -123,17 +122,14 @@ def build_config(instance: dict) -> dict:
     setup_cmds = ["python -m pip install -U pip setuptools wheel"]
 
     env_path = env_for_instance(instance)
-    use_requirements = True
-    if "requests" in (instance.get("repo") or "").lower():
-        use_requirements = False
+    repo_lower = (instance.get("repo") or "").lower()
+    use_requirements = not any(needle in repo_lower for needle in SKIP_REQUIREMENT_FILES)
     if env_path:
         deps = adjust_deps_for_compat(instance.get("repo", ""), parse_pip_deps(env_path))
         if deps:
             setup_cmds.append("python -m pip install " + " ".join(deps))
 
-    repo_lower = (instance.get("repo") or "").lower()
-
-    if "pytest-dev/pytest" not in repo_lower:
+    if not any(needle in repo_lower for needle in SHIPS_PYTEST):
         setup_cmds.append("pip install pytest")
         if use_requirements:
             setup_cmds.extend(
@@ -165,23 +161,78 @@ def build_config(instance: dict) -> dict:
     }
 
 
-def write_config(cfg: dict) -> Path:
-    CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
+def write_config(cfg: dict, path: Path = CONFIG_PATH) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
     text = json.dumps(cfg, indent=2)
-    CONFIG_PATH.write_text(text)
-    return CONFIG_PATH
+    path.write_text(text)
+    return path
+
+
+def image_digest(image: str) -> str:
+    proc = subprocess.run(["docker", "image", "inspect", "--format", "{{.Id}}", image], capture_output=True, text=True)
+    return proc.stdout.strip() if proc.returncode == 0 else f"unresolved:{image}"
+
 
+def setup_hash(cfg: dict) -> str:
+    # The test command is included too: a changed command can flip the outcome just like a changed install.
+    inst = cfg["instances"][0]
+    payload = json.dumps([inst["setup_commands"], inst["test_command"]])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
 
-def run_instance(cfg_path: Path) -> int:
+
+class ResultCache:
+    """Known-good/known-bad scan results, keyed by (instance_id, image digest, setup hash).
+
+    An append-only JSON-lines file (the last entry for a key wins). Appends
+    happen under an flock, so concurrent scans can share it. Known-bad
+    entries expire after ``bad_ttl_sec``; known-good ones do not.
+    """
+
+    def __init__(self, path: Path, bad_ttl_sec: float = DEFAULT_BAD_TTL_HOURS * 3600) -> None:
+        self.path = path
+        self.bad_ttl_sec = bad_ttl_sec
+        self.results: dict[tuple[str, str, str], dict] = {}
+        if path.is_file():
+            for line in path.read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                    self.results[(entry["instance_id"], entry["image"], entry["setup_hash"])] = entry
+                except (ValueError, KeyError):
+                    continue
+
+    def get(self, instance_id: str, image_digest: str, setup_hash: str) -> Optional[dict]:
+        entry = self.results.get((instance_id, image_digest, setup_hash))
+        if entry is None or entry["ok"] or time.time() - entry.get("at", 0) < self.bad_ttl_sec:
+            return entry
+        return None
+
+    def put(self, instance_id: str, image_digest: str, setup_hash: str, code: int) -> None:
+        entry = {
+            "instance_id": instance_id,
+            "image": image_digest,
+            "setup_hash": setup_hash,
+            "ok": code == 0,
+            "exit": code,
+            "at": time.time(),
+        }
+        self.results[(instance_id, image_digest, setup_hash)] = entry
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.write(json.dumps(entry) + "\n")
+            fh.flush()
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def run_instance(cfg_path: Path, log_path: Optional[Path] = None) -> int:
     env = os.environ.copy()
     env["CONFIG"] = str(cfg_path)
-    proc = subprocess.run(
-        ["bash", str(RUNNER)],
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-        env=env,
-    )
-    return proc.returncode
+    if log_path is None:
+        return subprocess.run(["bash", str(RUNNER)], stdout=sys.stdout, stderr=sys.stderr, env=env).returncode
+    # Parallel runs each get a log file so their output does not interleave.
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("w") as log:
+        return subprocess.run(["bash", str(RUNNER)], stdout=log, stderr=subprocess.STDOUT, env=env).returncode
 
 
 def main() -> None:
@@ -191,21 +242,65 @@ def main() -> None:
     block = os.environ.get("SWEBENCH_BLOCK") or ""
     allow_list = [a.strip() for a in allow.split(",") if a.strip()] if allow else []
     block_list = [b.strip() for b in block.split(",") if b.strip()] if block else []
+    workers = max(1, int(os.environ.get("SWEBENCH_WORKERS", "4")))
+    want = max(1, int(os.environ.get("SWEBENCH_WANT", "1")))
+    out_dir = Path(os.environ.get("SWEBENCH_OUT_DIR", str(OUT_DIR)))
+    rescan = os.environ.get("SWEBENCH_RESCAN") == "1"
+    image = os.environ.get("IMAGE", "runner-core")
+    digest = image_digest(image)
+    bad_ttl_hours = float(os.environ.get("SWEBENCH_BAD_TTL_HOURS", DEFAULT_BAD_TTL_HOURS))
+    cache = ResultCache(
+        Path(os.environ.get("SWEBENCH_CACHE_DIR", DEFAULT_CACHE_DIR)).expanduser() / "scan-results.jsonl", bad_ttl_hours * 3600
+    )
+
+    found: list[Path] = []
+    pending: dict[Future, tuple[str, str, Path]] = {}
 
-    for inst in iter_instances(limit=limit, allow=allow_list, block=block_list):
-        env_path = env_for_instance(inst)
-        if env_path:
-            inst["_env_path"] = str(env_path)
-        cfg = build_config(inst)
-        cfg_path = write_config(cfg)
-        print(f"Trying {inst['instance_id']}...", flush=True)
-        code = run_instance(cfg_path)
+    def record(inst_id: str, key: str, cfg_path: Path, code: int, cached: bool = False) -> None:
+        if not cached and code in VERDICT_EXITS:
+            cache.put(inst_id, digest, key, code)
         if code == 0:
-            print(f"Success on {inst['instance_id']}")
-            return
+            found.append(cfg_path)
+            print(f"Success on {inst_id}{' (cached)' if cached else ''}: {cfg_path}", flush=True)
         else:
-            print(f"Failed on {inst['instance_id']} (exit {code}), continuing...")
-    sys.exit("No instance succeeded within scan limit")
+            cfg_path.unlink(missing_ok=True)
+            print(f"Failed on {inst_id} (exit {code}{', cached' if cached else ''}), continuing...", flush=True)
+
+    def drain(block_until: int) -> None:
+        while len(pending) > block_until:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                inst_id, key, cfg_path = pending.pop(fut)
+                record(inst_id, key, cfg_path, fut.result())
+
+    instances = iter_instances(limit=limit, allow=allow_list, block=block_list)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor, closing(instances):
+        for inst in instances:
+            if len(found) >= want:
+                break
+            env_path = env_for_instance(inst)
+            if env_path:
+                inst["_env_path"] = str(env_path)
+            cfg = build_config(inst)
+            inst_id = inst["instance_id"]
+            cfg_path = write_config(cfg, out_dir / f"{inst_id}.json")
+            key = setup_hash(cfg)
+            known = None if rescan else cache.get(inst_id, digest, key)
+            if known is not None:
+                record(inst_id, key, cfg_path, known["exit"], cached=True)
+                continue
+            print(f"Trying {inst_id}...", flush=True)
+            pending[executor.submit(run_instance, cfg_path, out_dir / "logs" / f"{inst_id}.log")] = (inst_id, key, cfg_path)
+            # Keep K tries in flight; stop feeding once enough have succeeded.
+            drain(workers - 1)
+        # Tries already running finish and are cached, even past the N wanted.
+        drain(0)
+
+    if not found:
+        sys.exit("No instance succeeded within scan limit")
+    print(f"{len(found)} working instance config(s) in {out_dir}:")
+    for path in found:
+        print(f"  {path}")
 
 
 if __name__ == "__main__":
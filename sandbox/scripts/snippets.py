@@ -1,16 +1,30 @@
-COLLECTIONS_REWRITE = """cd {workdir} && python - <<'PY'
-from pathlib import Path
-repl = {{
+COLLECTIONS_REPLACEMENTS = {
     'from collections import MutableMapping': 'from collections.abc import MutableMapping',
     'from collections import Mapping': 'from collections.abc import Mapping',
     'collections.MutableMapping': 'collections.abc.MutableMapping',
     'collections.Mapping': 'collections.abc.Mapping',
-}}
-for p in Path('.').rglob('*.py'):
+}
+
+# Matches every file COLLECTIONS_REPLACEMENTS would change (ERE, usable by rg, grep -E and git grep -E).
+COLLECTIONS_PATTERN = r"collections( import |\.)(Mutable)?Mapping"
+
+# Candidate files come from rg (grep when rg is not installed); only those are
+# read and rewritten. Each rewritten file is printed as "rewrote <path>".
+# --hidden --no-ignore make rg walk the same files as grep -r, ignored and dot paths included.
+COLLECTIONS_REWRITE = """cd {workdir} && {{ if command -v rg >/dev/null 2>&1; then rg -l0 --no-messages --hidden --no-ignore -g '*.py' -e '{pattern}' .; else grep -rlZE --include='*.py' -e '{pattern}' .; fi; }} | python -c "$(cat <<'PY'
+import sys
+from pathlib import Path
+repl = {repl!r}
+for name in sys.stdin.buffer.read().split(b'\\0'):
+    if not name:
+        continue
+    p = Path(name.decode('utf-8', 'surrogateescape'))
     txt = p.read_text()
     new = txt
     for old, new_val in repl.items():
         new = new.replace(old, new_val)
     if new != txt:
         p.write_text(new)
-PY"""
+        print('rewrote', p.as_posix().removeprefix('./'))
+PY
+)\""""
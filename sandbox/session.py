@@ -1,22 +1,47 @@
 from __future__ import annotations
 
+import shutil
 import tempfile
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from sandbox.docker_client import DockerClient
+from sandbox.backend import DockerBackend, make_client
+from sandbox.caches import cache_mounts, cache_stats
+from sandbox.capture import OutputCallback
+from sandbox.channel import ChannelError, CommandChannel
+from sandbox.envlock import CONTAINER_LOCK_PATH, FREEZE_COMMAND, LockStore, full_stdout, lock_key, lock_text, replay_command
+from sandbox.git_cache import GitMirrorCache, mirror_root
+from sandbox.keep import keep_labels, keeper_name, owner_labels
 from sandbox.logger import EventLogger
-from sandbox.compat import apply_collections_rewrite, apply_pytest_cap, apply_setuptools_cap
+from sandbox.deps import PROBE_CONSTRAINTS_PATH, blame, constraint_env, describe_blame, plan_dependencies, probe_commands
+from sandbox.compat import (
+    CompatPrecheck,
+    collections_rewrite_command,
+    patch_needs_rewrite,
+    pytest_cap_command,
+    rewritten_files,
+    setuptools_cap_command,
+)
+from sandbox.pool import ContainerPool
+from sandbox.setup_script import KILL_AFTER_SEC, new_nonce, setup_script, split_results
+from sandbox.shards import CONTAINER_IDS_PATH, JUNIT_DIR, judge, parse_junit, pytest_prefix, selected_tests, shard_command, summary
+from sandbox.snapshot import SnapshotStore, snapshot_key
+from sandbox.stages import Copy, Host, Request, Shell, Steps, drive
+from sandbox.wheelhouse import added_wheels, failed_requirements, fill_command
 from sandbox.models import (
     CommandResult,
+    DependencyPin,
+    DependencyPlan,
+    FetchStrategy,
     RepoSpec,
     RunReport,
     SandboxConfig,
     StageResult,
     StageStatus,
     TaskSpec,
+    TestOutcome,
 )
 
 
@@ -29,11 +54,713 @@ def merge_env(base: Optional[Dict[str, str]], extra: Optional[Dict[str, str]]) -
     return merged
 
 
+def clone_command(repo: RepoSpec, workdir: str, source: Optional[str] = None) -> str:
+    """Shell command that materializes ``repo`` at ``<workdir>/repo``.
+
+    ``source`` is an in-container path to a host mirror; when set, origin is
+    pointed back at ``repo.repo_url`` afterwards. Shallow and partial modes do
+    not check out a tree; the checkout stage does that.
+    """
+    src = source or repo.repo_url
+    mirrored = src != repo.repo_url
+    # The mirror is owned by the host user; trust it explicitly.
+    git = "git -c safe.directory='*'" if mirrored else "git"
+    if mirrored and repo.fetch_strategy != FetchStrategy.full:
+        # --depth/--filter are ignored for plain local-path clones.
+        src = f"file://{src}"
+
+    if repo.fetch_strategy == FetchStrategy.shallow:
+        # The environment commit is needed too when setup runs there (snapshots).
+        commits = " ".join(dict.fromkeys(c for c in (repo.commit, repo.environment_setup_commit) if c))
+        steps = [
+            "git init -q repo",
+            f"{git} -C repo fetch -q --depth 1 {src} {commits}",
+            f"git -C repo remote add origin {repo.repo_url}",
+        ]
+    elif repo.fetch_strategy == FetchStrategy.partial:
+        steps = [f"{git} clone -q --filter=blob:none --no-checkout {src} repo"]
+        if mirrored:
+            # Missing blobs are fetched lazily from the promisor remote, so keep origin on the mirror.
+            steps.append(f"git -C repo remote add upstream {repo.repo_url}")
+    else:
+        steps = [f"{git} clone {src} repo"]
+        if mirrored:
+            steps.append(f"git -C repo remote set-url origin {repo.repo_url}")
+    return f"cd {workdir} && " + " && ".join(steps)
+
+
+def checkout_command(repo_dir: str, commit: str, reset: bool = False) -> str:
+    if not reset:
+        return f"cd {repo_dir} && git -c safe.directory='*' checkout {commit}"
+    # Drop compat rewrites left in the tree and fetch the commit if the clone does not have it.
+    return (
+        f"cd {repo_dir} && git reset -q --hard"
+        f" && {{ git cat-file -e {commit}^{{commit}} 2>/dev/null"
+        f" || git -c safe.directory='*' fetch -q $([ -f .git/shallow ] && echo --depth 1) origin {commit}; }}"
+        f" && git -c safe.directory='*' checkout -q {commit}"
+    )
+
+
+# The runner image's venv; two-phase runs carry it from setup to test in a volume.
+VENV_DIR = "/opt/venv"
+
+# Stages `rerun` can start from, in run order.
+RERUN_STAGES = ("checkout", "apply_patch", "compat_rewrite", "compat_pins", "setup", "test")
+
+
 class SessionRunner:
-    def __init__(self, config: SandboxConfig, client: Optional[DockerClient] = None, logger: Optional[EventLogger] = None):
+    def __init__(
+        self,
+        config: SandboxConfig,
+        client: Optional[DockerBackend] = None,
+        logger: Optional[EventLogger] = None,
+        pool: Optional[ContainerPool] = None,
+        output_dir: Optional[Path] = None,
+        on_output: Optional[OutputCallback] = None,
+        on_stage: Optional[Callable[[RunReport, StageResult], None]] = None,
+    ):
+        if config.two_phase and (config.snapshots or pool):
+            # Snapshots commit the container, not its volumes; pooled containers come with their own mounts.
+            raise ValueError("two_phase does not combine with snapshots or a container pool")
+        if config.keep_container and pool:
+            # A pooled container is reset and handed to the next run, so it cannot also be kept.
+            raise ValueError("keep_container does not combine with a container pool")
         self.config = config
         self.logger = logger
-        self.client = client or DockerClient(timeout_sec=config.tool_timeout_sec, logger=logger)
+        self.pool = pool
+        # Called after every stage is appended (RunRecorder.record_stage checkpoints with it).
+        self.on_stage = on_stage
+        # output_dir receives the full stdout/stderr of every command; memory keeps head and tail only.
+        self.client = client or make_client(config, logger=logger, spill_dir=output_dir, on_output=on_output)
+        self.channel: Optional[CommandChannel] = None
+        self.mirrors: Optional[GitMirrorCache] = None
+        if config.git_mirror:
+            self.mirrors = GitMirrorCache(mirror_root(config.cache_dir), logger=logger)
+        # With mirrors on the host, a git grep there can rule the collections rewrite out before any container starts.
+        self.compat_precheck: Optional[CompatPrecheck] = None
+        if self.mirrors:
+            self.compat_precheck = CompatPrecheck(self.mirrors, Path(config.cache_dir).expanduser() / "compat", logger=logger)
+        self.snapshots: Optional[SnapshotStore] = None
+        if config.snapshots:
+            self.snapshots = SnapshotStore(
+                self.client,
+                Path(config.cache_dir).expanduser() / "snapshots",
+                budget_bytes=int(config.snapshot_budget_gb * 1024**3),
+                logger=logger,
+            )
+        self.env_locks: Optional[LockStore] = None
+        if config.env_lock:
+            self.env_locks = LockStore(Path(config.cache_dir).expanduser() / "locks", logger=logger)
+
+    @property
+    def repo_dir(self) -> str:
+        return f"{self.config.workdir}/repo"
+
+    def _shell(self, container: str, command: str, env: Optional[Dict[str, str]] = None, timeout: Optional[int] = None) -> CommandResult:
+        env = self.config.env if env is None else env
+        if self.channel and self.channel.alive:
+            try:
+                return self.channel.run(command, env=env, timeout=timeout)
+            except ChannelError as exc:
+                # The helper died (or hung past its timeout); carry on with plain execs.
+                if self.logger:
+                    self.logger.info("channel lost", stage="channel", data={"error": str(exc)})
+        return self.client.exec(container, ["bash", "-lc", command], env=env, timeout=timeout)
+
+    def add_stage(
+        self,
+        report: RunReport,
+        name: str,
+        commands: List[CommandResult],
+        ok: bool,
+        error: str,
+        status: Optional[StageStatus] = None,
+        tests: Optional[List[TestOutcome]] = None,
+    ) -> bool:
+        stage = StageResult(
+            name=name,
+            status=status or (StageStatus.success if ok else StageStatus.failed),
+            commands=commands,
+            error=None if ok else error,
+            tests=tests or [],
+        )
+        report.stages.append(stage)
+        if self.on_stage:
+            self.on_stage(report, stage)
+        return ok
+
+    def finish(self, report: RunReport) -> RunReport:
+        report.completed_at = datetime.now().astimezone()
+        return report
+
+    def sync_mirror(self, report: RunReport, repo: RepoSpec) -> str:
+        """Bring the host mirror up to date; returns the clone source for the container."""
+        if not self.mirrors:
+            return repo.repo_url
+        results = [self.mirrors.ensure(repo.repo_url, repo.commit)]
+        if self.snapshots and repo.environment_setup_commit and repo.environment_setup_commit != repo.commit:
+            results.append(self.mirrors.ensure(repo.repo_url, repo.environment_setup_commit))
+        ok = all(r.exit_code == 0 for r in results)
+        self.add_stage(
+            report,
+            "mirror",
+            results,
+            ok,
+            "mirror sync failed; cloning from repo_url",
+            status=StageStatus.success if ok else StageStatus.skipped,
+        )
+        return self.mirrors.container_path(repo.repo_url) if ok else repo.repo_url
+
+    def snapshot_lookup(self, report: RunReport, repo: RepoSpec, task: TaskSpec) -> tuple[Optional[str], Optional[str]]:
+        """Returns (snapshot key, restorable image tag)."""
+        assert self.snapshots is not None
+        base_id, inspect_res = self.snapshots.base_image_id(self.config.image)
+        if not base_id:
+            self.add_stage(report, "snapshot", [inspect_res], False, "base image not found; snapshots disabled", status=StageStatus.skipped)
+            return None, None
+        key = snapshot_key(base_id, repo, task, self.config.workdir, single_pass_deps=self.config.single_pass_deps)
+        tag, lookup_res = self.snapshots.lookup(key)
+        if self.logger:
+            self.logger.info("snapshot lookup", stage="snapshot", data={"key": key, "hit": tag is not None})
+        self.add_stage(report, "snapshot", [lookup_res], tag is not None, "no snapshot for key", status=StageStatus.success if tag else StageStatus.skipped)
+        return key, tag
+
+    def container_labels(self) -> Optional[Dict[str, str]]:
+        return keep_labels(self.config.keep_ttl_hours) if self.config.keep_container else None
+
+    def start_stage(self, report: RunReport, start_res: CommandResult, image: str) -> bool:
+        if self.logger:
+            self.logger.info("container start", stage="start", data={"exit": start_res.exit_code, "image": image})
+        return self.add_stage(report, "start", [start_res], start_res.exit_code == 0, "container start failed")
+
+    def _start(self, report: RunReport, container: str, image: str, volumes: List[str], env: Dict[str, str]) -> bool:
+        start_res = self.client.run_container(
+            image=image,
+            name=container,
+            workdir=self.config.workdir,
+            env=env,
+            network=self.config.network,
+            detach=True,
+            volumes=volumes,
+            labels=self.container_labels(),
+        )
+        return self.start_stage(report, start_res, image)
+
+    def _acquire(self, report: RunReport) -> Optional[str]:
+        assert self.pool is not None
+        container, res = self.pool.acquire()
+        if self.logger:
+            self.logger.info("container start", stage="start", data={"exit": res.exit_code, "pooled": True})
+        self.add_stage(report, "start", [res], container is not None, "pooled container start failed")
+        return container
+
+    def _open_channel(self, report: RunReport, container: str) -> None:
+        self.channel, res = self.client.open_channel(container, workdir=self.config.workdir)
+        ok = self.channel.alive
+        # Without a channel every command still runs, one docker exec each.
+        self.add_stage(
+            report,
+            "channel",
+            [res],
+            ok,
+            "command channel failed to start; using docker exec",
+            status=StageStatus.success if ok else StageStatus.skipped,
+        )
+
+    def _perform(self, request: Request) -> Any:
+        if isinstance(request, Shell):
+            if request.plain:
+                env = self.config.env if request.env is None else request.env
+                return self.client.exec(request.container, ["bash", "-lc", request.command], env=env, timeout=request.timeout)
+            return self._shell(request.container, request.command, env=request.env, timeout=request.timeout)
+        if isinstance(request, Copy):
+            return self.client.cp(request.src, request.dest)
+        return request.fn(*request.args)
+
+    def _drive(self, steps: Steps[bool]) -> bool:
+        return drive(steps, self._perform)
+
+    # Stages as Steps generators, shared with AsyncSessionRunner: they only
+    # describe the I/O (Shell, Copy, Host) and record the stage from its results.
+
+    def clone_steps(self, report: RunReport, container: str, repo: RepoSpec, source: str) -> Steps[bool]:
+        clone_res = yield Shell(container, clone_command(repo, self.config.workdir, source))
+        if self.logger:
+            self.logger.info("clone", stage="clone", data={"exit": clone_res.exit_code})
+        return self.add_stage(report, "clone", [clone_res], clone_res.exit_code == 0, "clone failed")
+
+    def checkout_steps(self, report: RunReport, container: str, commit: str, name: str = "checkout", reset: bool = False) -> Steps[bool]:
+        checkout_res = yield Shell(container, checkout_command(self.repo_dir, commit, reset=reset))
+        if self.logger:
+            self.logger.info("checkout", stage=name, data={"exit": checkout_res.exit_code, "commit": commit})
+        return self.add_stage(report, name, [checkout_res], checkout_res.exit_code == 0, "checkout failed")
+
+    def apply_patch_steps(self, report: RunReport, container: str, test_patch: str) -> Steps[bool]:
+        if not test_patch.strip():
+            return True
+        tmp_dir = Path(tempfile.mkdtemp(prefix="sandbox_patch_"))
+        patch_path = tmp_dir / "patch.diff"
+        patch_path.write_text(test_patch)
+        write_res = yield Copy(str(patch_path), f"{container}:/tmp/patch.diff")
+        apply_res = yield Shell(container, f"cd {self.repo_dir} && patch -p1 < /tmp/patch.diff")
+        if self.logger:
+            self.logger.info("patch", stage="apply_patch", data={"exit": apply_res.exit_code})
+        return self.add_stage(report, "apply_patch", [write_res, apply_res], apply_res.exit_code == 0, "patch failed")
+
+    def _compat_unneeded(self, report: RunReport, repo: RepoSpec, commit: str, test_patch: str = "") -> bool:
+        """True (and records a skipped stage) when the host mirror shows nothing to rewrite at ``commit``."""
+        if not self.compat_precheck:
+            return False
+        files, res = self.compat_precheck.candidates(repo.repo_url, commit)
+        if files is None or files or patch_needs_rewrite(test_patch):
+            return False
+        self.add_stage(report, "compat_rewrite", [res], True, "", status=StageStatus.skipped)
+        return True
+
+    def compat_rewrite_steps(self, report: RunReport, container: str, repo: RepoSpec, commit: str, test_patch: str = "") -> Steps[bool]:
+        if not repo.apply_compat or (yield Host(self._compat_unneeded, report, repo, commit, test_patch)):
+            return True
+        compat_res = yield Shell(container, collections_rewrite_command(self.repo_dir), env={})
+        if self.logger:
+            self.logger.info("compat", stage="compat_rewrite", data={"exit": compat_res.exit_code, "changed": rewritten_files(compat_res.stdout)})
+        return self.add_stage(report, "compat_rewrite", [compat_res], compat_res.exit_code == 0, "compat rewrite failed")
+
+    def compat_pins_steps(self, report: RunReport, container: str, repo: RepoSpec) -> Steps[bool]:
+        if self.config.single_pass_deps:
+            # Folded into the setup stage's single install.
+            return True
+        if repo.setuptools_cap:
+            set_res = yield Shell(container, setuptools_cap_command(repo.setuptools_cap, self.repo_dir), env={})
+            if self.logger:
+                self.logger.info("compat_setuptools_cap", stage="setup", data={"exit": set_res.exit_code, "cap": repo.setuptools_cap})
+            if not self.add_stage(report, "compat_setuptools", [set_res], set_res.exit_code == 0, "setuptools cap failed"):
+                return False
+        if repo.pytest_cap:
+            py_res = yield Shell(container, pytest_cap_command(repo.pytest_cap, self.repo_dir), env={})
+            if self.logger:
+                self.logger.info("compat_pytest_cap", stage="setup", data={"exit": py_res.exit_code, "version": repo.pytest_cap})
+            if not self.add_stage(report, "compat_pytest", [py_res], py_res.exit_code == 0, "pytest pin failed"):
+                return False
+        return True
+
+    def _setup_commands(self, task: TaskSpec, repo: RepoSpec) -> Tuple[Optional[DependencyPlan], List[str], Dict[str, str]]:
+        """(plan, commands, env) for the setup stage; the plan is None unless single_pass_deps is on."""
+        env = merge_env(self.config.env, task.env)
+        if not self.config.single_pass_deps:
+            return None, list(task.setup_commands or []), env
+        plan = plan_dependencies(repo, task)
+        return plan, plan.commands, constraint_env(env, plan.constraints_path) if plan.env else env
+
+    def _probes(self, task: TaskSpec, plan: Optional[DependencyPlan], results: List[CommandResult], ok: bool) -> List[Tuple[DependencyPin, str, Dict[str, str]]]:
+        """Attribution probes to run when the single-pass install itself failed."""
+        if ok or not plan or not plan.pins or len(results) - 1 != plan.install_index:
+            return []
+        env = constraint_env(merge_env(self.config.env, task.env), PROBE_CONSTRAINTS_PATH)
+        return [(pin, f"cd {self.repo_dir} && {cmd}", env) for pin, cmd in probe_commands(plan)]
+
+    def _setup_stage(
+        self,
+        report: RunReport,
+        plan: Optional[DependencyPlan],
+        results: List[CommandResult],
+        ok: bool,
+        probes: List[Tuple[DependencyPin, CommandResult]],
+    ) -> bool:
+        if self.logger:
+            data = {"exit": results[-1].exit_code if results else None}
+            if plan:
+                data.update(merged=len(plan.merged), pins=[p.requirement for p in plan.pins])
+            self.logger.info("setup", stage="setup", data=data)
+        error = "setup failed"
+        if plan and probes:
+            blamed = blame(plan, results[plan.install_index], probes)
+            if blamed:
+                error = f"setup failed: dependency conflict caused by {describe_blame(blamed)}"
+            if self.logger:
+                self.logger.info("deps attribution", stage="setup", data={"blamed": [p.model_dump() for p in blamed]})
+        return self.add_stage(report, "setup", results + [res for _, res in probes], ok, error)
+
+    def _split_setup(self, res: CommandResult, commands: List[str], nonce: str) -> Tuple[List[CommandResult], bool]:
+        results = split_results(
+            res, commands, self.repo_dir, nonce, self.config.output_buffer_bytes, timeout_sec=self.config.tool_timeout_sec
+        )
+        ok = len(results) == len(commands) and all(r.exit_code == 0 and not r.timed_out for r in results)
+        if self.logger:
+            self.logger.info("setup batch", stage="setup", data={"commands": len(commands), "ran": len(results), "exit": res.exit_code})
+        return results, ok
+
+    def _env_lock(self, repo: RepoSpec, task: TaskSpec, commands: List[str]) -> Tuple[Optional[str], Optional[str]]:
+        """(lock key, stored lockfile) for this setup; the key is None when env locks are off, there is no setup, or the image cannot be inspected."""
+        if not self.env_locks or not commands:
+            return None, None
+        res = self.client.inspect_image(self.config.image)
+        image_id = res.stdout.strip() if res.exit_code == 0 else ""
+        if not image_id:
+            if self.logger:
+                self.logger.info("env lock disabled", stage="lock_replay", data={"image": self.config.image, "error": res.stderr.strip()})
+            return None, None
+        key = lock_key(image_id, repo, task, self.config.workdir, single_pass_deps=self.config.single_pass_deps)
+        return key, self.env_locks.load(key)
+
+    def _lock_replay_stage(self, report: RunReport, key: str, results: List[CommandResult]) -> bool:
+        ok = all(r.exit_code == 0 and not r.timed_out for r in results)
+        if self.logger:
+            self.logger.info("env lock replay", stage="lock_replay", data={"key": key[:24], "exit": results[-1].exit_code})
+        # A stale or broken lock only costs the replay: the setup commands run as before.
+        self.add_stage(
+            report,
+            "lock_replay",
+            results,
+            ok,
+            "lock replay failed; running setup commands",
+            status=StageStatus.success if ok else StageStatus.skipped,
+        )
+        return ok
+
+    def _replay_lock_steps(self, report: RunReport, container: str, key: str, text: str, env: Dict[str, str]) -> Steps[bool]:
+        assert self.env_locks is not None
+        results = [(yield Copy(str(self.env_locks.path(key)), f"{container}:{CONTAINER_LOCK_PATH}"))]
+        if results[0].exit_code == 0:
+            results.append((yield Shell(container, replay_command(text, self.repo_dir), env=env)))
+        return self._lock_replay_stage(report, key, results)
+
+    def _lock_save_stage(self, report: RunReport, key: str, freeze_res: CommandResult) -> None:
+        assert self.env_locks is not None
+        text = lock_text(full_stdout(freeze_res), key) if freeze_res.exit_code == 0 else None
+        if text:
+            freeze_res.stdout = f"saved {self.env_locks.save(key, text)}\n"
+        self.add_stage(
+            report,
+            "lock_save",
+            [freeze_res],
+            text is not None,
+            "pip freeze failed; no env lock saved",
+            status=StageStatus.success if text else StageStatus.skipped,
+        )
+
+    def _needs_fill(self, report: RunReport) -> bool:
+        """True when a wheelhouse is mounted, the index is reachable, and setup fetched or built anything."""
+        if not self.config.wheelhouse_volume or self.config.network == "none":
+            return False
+        stats = cache_stats(report.stages)
+        return stats["misses"] > 0 or stats["wheel_builds"] > 0
+
+    def _fill_stage(self, report: RunReport, res: CommandResult) -> None:
+        ok = res.exit_code == 0 and not res.timed_out
+        if self.logger:
+            data = {"exit": res.exit_code, "added": added_wheels([res]), "failed": failed_requirements([res])}
+            self.logger.info("wheelhouse fill", stage="wheelhouse_fill", data=data)
+        # The run itself is already set up; a failed fill only means the next one downloads again.
+        self.add_stage(
+            report,
+            "wheelhouse_fill",
+            [res],
+            ok,
+            "wheelhouse fill failed",
+            status=StageStatus.success if ok else StageStatus.skipped,
+        )
+
+    def setup_steps(self, report: RunReport, container: str, task: TaskSpec, repo: RepoSpec) -> Steps[bool]:
+        plan, commands, env = self._setup_commands(task, repo)
+        key, lock = yield Host(self._env_lock, repo, task, commands)
+        if key and lock and (yield from self._replay_lock_steps(report, container, key, lock, env)):
+            ok = True
+        else:
+            ok = yield from self._run_setup_steps(report, container, task, plan, commands, env, key)
+        if ok and (yield Host(self._needs_fill, report)):
+            self._fill_stage(report, (yield Shell(container, fill_command(), env=env, timeout=self.config.tool_timeout_sec * 10)))
+        return ok
+
+    def _run_setup_steps(
+        self,
+        report: RunReport,
+        container: str,
+        task: TaskSpec,
+        plan: Optional[DependencyPlan],
+        commands: List[str],
+        env: Dict[str, str],
+        key: Optional[str],
+    ) -> Steps[bool]:
+        if self.config.batch_setup and len(commands) > 1:
+            # Each command runs under `timeout` with its own tool_timeout_sec, as one exec per command would;
+            # the exec's limit only backs that up, with room for every command's SIGTERM grace.
+            nonce = new_nonce()
+            script = setup_script(commands, self.repo_dir, nonce, timeout_sec=self.config.tool_timeout_sec)
+            # A plain exec, not the channel: the markers are parsed from the full output, which only exec spills.
+            limit = (self.config.tool_timeout_sec + KILL_AFTER_SEC) * len(commands)
+            batch_res = yield Shell(container, script, env=env, timeout=limit, plain=True)
+            setup_results, ok = yield Host(self._split_setup, batch_res, commands, nonce)
+        else:
+            setup_results = []
+            ok = True
+            for cmd in commands:
+                cmd_res = yield Shell(container, f"cd {self.repo_dir} && {cmd}", env=env)
+                setup_results.append(cmd_res)
+                if cmd_res.exit_code != 0 or cmd_res.timed_out:
+                    ok = False
+                    break
+        # Only runs when the single-pass install failed: re-resolve without each pin to find the culprit.
+        probes = []
+        for pin, cmd, penv in self._probes(task, plan, setup_results, ok):
+            probes.append((pin, (yield Shell(container, cmd, env=penv))))
+        ok = self._setup_stage(report, plan, setup_results, ok, probes)
+        if ok and key:
+            freeze_res = yield Shell(container, f"cd {self.repo_dir} && {FREEZE_COMMAND}", env=env)
+            yield Host(self._lock_save_stage, report, key, freeze_res)
+        return ok
+
+    def _snapshot_save(self, report: RunReport, container: str, key: str) -> None:
+        assert self.snapshots is not None
+        res = self.snapshots.save(container, key, self.config.image)
+        # A failed commit only costs the next run its shortcut.
+        self.add_stage(
+            report,
+            "snapshot_save",
+            [res],
+            res.exit_code == 0,
+            "snapshot commit failed",
+            status=StageStatus.success if res.exit_code == 0 else StageStatus.skipped,
+        )
+
+    def build_steps(
+        self,
+        report: RunReport,
+        container: str,
+        repo: RepoSpec,
+        task: TaskSpec,
+        test_patch: str,
+        clone_source: str,
+        key: Optional[str] = None,
+        restore_image: Optional[str] = None,
+    ) -> Steps[bool]:
+        """Every stage between container start and test, for a fresh, snapshotting or restored container."""
+        if restore_image:
+            # Environment already set up: only move the tree to this task's commit.
+            return (
+                (yield from self.checkout_steps(report, container, repo.commit, reset=True))
+                and (yield from self.apply_patch_steps(report, container, test_patch))
+                and (yield from self.compat_rewrite_steps(report, container, repo, repo.commit, test_patch))
+            )
+        if key:
+            # Set up at the environment commit, snapshot, then switch to the task commit.
+            env_commit = repo.environment_setup_commit or repo.commit
+            ok = (
+                (yield from self.clone_steps(report, container, repo, clone_source))
+                and (yield from self.checkout_steps(report, container, env_commit))
+                and (yield from self.compat_rewrite_steps(report, container, repo, env_commit))
+                and (yield from self.compat_pins_steps(report, container, repo))
+                and (yield from self.setup_steps(report, container, task, repo))
+            )
+            if not ok:
+                return False
+            yield Host(self._snapshot_save, report, container, key)
+            return (
+                (yield from self.checkout_steps(report, container, repo.commit, name="checkout_base", reset=True))
+                and (yield from self.apply_patch_steps(report, container, test_patch))
+                and (yield from self.compat_rewrite_steps(report, container, repo, repo.commit, test_patch))
+            )
+        return (
+            (yield from self.clone_steps(report, container, repo, clone_source))
+            and (yield from self.checkout_steps(report, container, repo.commit))
+            and (yield from self.apply_patch_steps(report, container, test_patch))
+            and (yield from self.compat_rewrite_steps(report, container, repo, repo.commit, test_patch))
+            and (yield from self.compat_pins_steps(report, container, repo))
+            and (yield from self.setup_steps(report, container, task, repo))
+        )
+
+    def _shard_plan(self, task: TaskSpec) -> Tuple[List[str], Optional[str]]:
+        """Selected node ids and the pytest prefix to shard them with; no prefix means run test_command as is."""
+        if not self.config.sharded_tests:
+            return [], None
+        tests = selected_tests(task)
+        prefix = pytest_prefix(task.test_command, tests) if tests else None
+        if prefix is None and self.logger:
+            reason = "no pytest test_command" if tests else "no FAIL_TO_PASS/PASS_TO_PASS ids"
+            self.logger.info("sharded tests unavailable", stage="test", data={"reason": reason})
+        return tests, prefix
+
+    def _write_ids(self, tests: List[str]) -> Path:
+        tmp_dir = Path(tempfile.mkdtemp(prefix="sandbox_tests_"))
+        # Sorted, so contiguous shards keep each file's tests together.
+        (tmp_dir / "ids.txt").write_text("".join(f"{t}\n" for t in sorted(tests)))
+        return tmp_dir
+
+    def _sharded_test_stage(self, report: RunReport, task: TaskSpec, tests: List[str], results: List[CommandResult], junit_dir: Path) -> bool:
+        outcomes = parse_junit(junit_dir, tests)
+        ran = len(results) == 3 and results[1].exit_code == 0 and not results[1].timed_out
+        passed, error = judge(task, outcomes) if ran else (False, "test shards did not run to completion")
+        if self.logger:
+            self.logger.info(
+                "test",
+                stage="test",
+                data={"sharded": True, "expected_fail": task.expected_fail, "passed": passed, "tests": summary(outcomes)},
+            )
+        report.success = passed
+        return self.add_stage(report, "test", results, passed, error or "", tests=outcomes)
+
+    def _sharded_test_steps(self, report: RunReport, container: str, task: TaskSpec, tests: List[str], prefix: str) -> Steps[bool]:
+        """Run the selected ids as parallel pytest shards and judge them per test from the JUnit XML."""
+        tmp_dir = yield Host(self._write_ids, tests)
+        try:
+            results = [(yield Copy(str(tmp_dir / "ids.txt"), f"{container}:{CONTAINER_IDS_PATH}"))]
+            if results[0].exit_code == 0:
+                command = shard_command(prefix, self.repo_dir, self.config.test_shards)
+                results.append((yield Shell(container, command, env=merge_env(self.config.env, task.env))))
+                results.append((yield Copy(f"{container}:{JUNIT_DIR}", str(tmp_dir / "junit"))))
+            return (yield Host(self._sharded_test_stage, report, task, tests, results, tmp_dir / "junit"))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def test_steps(self, report: RunReport, container: str, task: TaskSpec) -> Steps[bool]:
+        tests, prefix = self._shard_plan(task)
+        if prefix is not None:
+            return (yield from self._sharded_test_steps(report, container, task, tests, prefix))
+        test_res = yield Shell(container, f"cd {self.repo_dir} && {task.test_command}", env=merge_env(self.config.env, task.env))
+        expected_fail = task.expected_fail
+        passed = (test_res.exit_code != 0) if expected_fail else (test_res.exit_code == 0)
+        if self.logger:
+            self.logger.info(
+                "test",
+                stage="test",
+                data={"exit": test_res.exit_code, "expected_fail": expected_fail, "passed": passed},
+            )
+        report.success = passed
+        return self.add_stage(report, "test", [test_res], passed, "test outcome did not match expectation")
+
+    def rerun_steps(
+        self, report: RunReport, repo: RepoSpec, task: TaskSpec, container: str, from_stage: str, test_patch: str, last: str = "test"
+    ) -> Steps[bool]:
+        """The ``RERUN_STAGES`` from ``from_stage`` through ``last``, stopping at the first failure."""
+        stages = {
+            "checkout": lambda: self.checkout_steps(report, container, repo.commit, reset=True),
+            "apply_patch": lambda: self.apply_patch_steps(report, container, test_patch),
+            "compat_rewrite": lambda: self.compat_rewrite_steps(report, container, repo, repo.commit, test_patch),
+            "compat_pins": lambda: self.compat_pins_steps(report, container, repo),
+            "setup": lambda: self.setup_steps(report, container, task, repo),
+            "test": lambda: self.test_steps(report, container, task),
+        }
+        for name in RERUN_STAGES[RERUN_STAGES.index(from_stage) : RERUN_STAGES.index(last) + 1]:
+            if not (yield from stages[name]()):
+                return False
+        return True
+
+    def record_cache_stats(self, report: RunReport) -> None:
+        report.cache_stats = cache_stats(report.stages)
+        if self.logger:
+            self.logger.info("package cache", stage="setup", data=report.cache_stats)
+
+    def _shared_mounts(self, volumes: List[str]) -> List[str]:
+        workspace, venv = volumes
+        return [f"{workspace}:{self.config.workdir}", f"{venv}:{VENV_DIR}"]
+
+    def _create_volumes(self, report: RunReport, container: str) -> Optional[List[str]]:
+        names = [f"{container}-workspace", f"{container}-venv"]
+        # Owner-labelled, so `ab gc` can find volumes a crashed run left behind once no container uses them.
+        results = [self.client.create_volume(name, labels=owner_labels(container)) for name in names]
+        ok = all(r.exit_code == 0 for r in results)
+        if self.logger:
+            self.logger.info("volumes", stage="volumes", data={"volumes": names, "ok": ok})
+        if not self.add_stage(report, "volumes", results, ok, "volume create failed"):
+            self._remove_volumes(names)
+            return None
+        return names
+
+    def _keep_volumes(self, report: RunReport, container: str, volumes: List[str]) -> bool:
+        """Leave an exited keeper container on ``volumes`` carrying the keep TTL, counted from now.
+
+        Volume labels cannot change after creation, so the keeper holds the
+        expiry: ``ab gc`` removes it once expired, and the volumes with it.
+        """
+        res = self.client.run_container(
+            image=self.config.image,
+            name=keeper_name(container),
+            network="none",
+            detach=True,
+            cmd=["true"],
+            volumes=self._shared_mounts(volumes),
+            labels=keep_labels(self.config.keep_ttl_hours),
+        )
+        ok = res.exit_code == 0
+        self.add_stage(
+            report,
+            "keep_volumes",
+            [res],
+            ok,
+            "keeper container failed to start; volumes removed",
+            status=StageStatus.success if ok else StageStatus.skipped,
+        )
+        return ok
+
+    def _remove_volumes(self, names: List[str]) -> None:
+        for name in names:
+            self.client.rm_volume(name)
+
+    def test_attempt(self, report: RunReport, task: TaskSpec, volumes: List[str]) -> bool:
+        """Run the test stage in a fresh container on a two-phase run's volumes.
+
+        The container starts on ``test_network`` and is removed afterwards, so
+        attempts share the installed workspace and venv but no processes,
+        /tmp or network access.
+        """
+        name = f"{volumes[0].removesuffix('-workspace')}-test-{uuid.uuid4().hex[:6]}"
+        start_res = self.client.run_container(
+            image=self.config.image,
+            name=name,
+            workdir=self.config.workdir,
+            env=self.config.env,
+            network=self.config.test_network,
+            detach=True,
+            volumes=self._shared_mounts(volumes),
+        )
+        if self.logger:
+            self.logger.info("container start", stage="start_test", data={"exit": start_res.exit_code, "network": self.config.test_network})
+        try:
+            if not self.add_stage(report, "start_test", [start_res], start_res.exit_code == 0, "test container start failed"):
+                return False
+            if self.config.command_channel:
+                self._open_channel(report, name)
+            return self._drive(self.test_steps(report, name, task))
+        finally:
+            if self.channel:
+                self.channel.close()
+                self.channel = None
+            self.client.rm(name, force=True)
+
+    def _run_two_phase(
+        self, report: RunReport, repo: RepoSpec, task: TaskSpec, test_patch: str, container: str, clone_source: str
+    ) -> RunReport:
+        """Clone and set up in ``container`` on ``network``, discard it, then test in a fresh container."""
+        volumes = self._create_volumes(report, container)
+        if volumes is None:
+            return self.finish(report)
+        cache_volumes, cache_env = cache_mounts(self.config)
+        kept = False
+        try:
+            mounts = cache_volumes + self._shared_mounts(volumes)
+            ok = self._start(report, container, self.config.image, mounts, merge_env(cache_env, self.config.env))
+            try:
+                if ok and self.config.command_channel:
+                    self._open_channel(report, container)
+                ok = ok and self._drive(self.build_steps(report, container, repo, task, test_patch, clone_source))
+            finally:
+                if self.channel:
+                    self.channel.close()
+                    self.channel = None
+                # Nothing the setup phase started survives into the test container.
+                self.client.rm(container, force=True)
+            if ok:
+                self.test_attempt(report, task, volumes)
+            kept = self.config.keep_container and self._keep_volumes(report, container, volumes)
+            return self.finish(report)
+        finally:
+            if cache_env:
+                self.record_cache_stats(report)
+            if kept:
+                report.volumes = volumes
+                if self.logger:
+                    self.logger.info("volumes kept", stage="cleanup", data={"volumes": volumes})
+            else:
+                self._remove_volumes(volumes)
 
     def run(self, repo: RepoSpec, task: TaskSpec, test_patch: str = "") -> RunReport:
         now = datetime.now().astimezone()
@@ -47,214 +774,93 @@ class SessionRunner:
         )
         container = self.config.container_name or f"sandbox-{uuid.uuid4().hex[:8]}"
         started = False
+        pooled = False
 
-        def add_stage(name: str, status: StageStatus, commands: List[CommandResult], error: Optional[str] = None):
-            report.stages.append(
-                StageResult(
-                    name=name,
-                    status=status,
-                    commands=commands,
-                    error=error,
-                )
-            )
+        volumes, cache_env = cache_mounts(self.config)
+        clone_source = self.sync_mirror(report, repo)
+        if self.config.two_phase:
+            return self._run_two_phase(report, repo, task, test_patch, container, clone_source)
+        key, restore_image = (None, None)
+        if self.snapshots:
+            key, restore_image = self.snapshot_lookup(report, repo, task)
 
         try:
-            start_res = self.client.run_container(
-                image=self.config.image,
-                name=container,
-                workdir=self.config.workdir,
-                env=self.config.env,
-                network=self.config.network,
-                detach=True,
-            )
-            if self.logger:
-                self.logger.info("container start", stage="start", data={"exit": start_res.exit_code})
-            started = start_res.exit_code == 0
-            add_stage(
-                "start",
-                StageStatus.success if start_res.exit_code == 0 else StageStatus.failed,
-                [start_res],
-                None if start_res.exit_code == 0 else "container start failed",
-            )
+            if self.pool and not restore_image:
+                # Snapshot restores need their own image, so they always cold-start.
+                pooled_name = self._acquire(report)
+                pooled = started = pooled_name is not None
+                container = pooled_name or container
+            else:
+                started = self._start(report, container, restore_image or self.config.image, volumes, merge_env(cache_env, self.config.env))
             if not started:
-                report.completed_at = datetime.now().astimezone()
-                return report
+                return self.finish(report)
+            if self.config.command_channel:
+                self._open_channel(report, container)
 
-            clone_res = self.client.exec(
-                container,
-                ["bash", "-lc", f"cd {self.config.workdir} && git clone {repo.repo_url} repo"],
-                env=self.config.env,
-            )
-            if self.logger:
-                self.logger.info("clone", stage="clone", data={"exit": clone_res.exit_code})
-            add_stage(
-                "clone",
-                StageStatus.success if clone_res.exit_code == 0 else StageStatus.failed,
-                [clone_res],
-                None if clone_res.exit_code == 0 else "clone failed",
-            )
-            if clone_res.exit_code != 0:
-                report.completed_at = datetime.now().astimezone()
-                return report
-
-            checkout_res = self.client.exec(
-                container,
-                ["bash", "-lc", f"cd {self.config.workdir}/repo && git checkout {repo.commit}"],
-                env=self.config.env,
-            )
-            if self.logger:
-                self.logger.info("checkout", stage="checkout", data={"exit": checkout_res.exit_code})
-            add_stage(
-                "checkout",
-                StageStatus.success if checkout_res.exit_code == 0 else StageStatus.failed,
-                [checkout_res],
-                None if checkout_res.exit_code == 0 else "checkout failed",
-            )
-            if checkout_res.exit_code != 0:
-                report.completed_at = datetime.utcnow()
-                return report
-
-            if test_patch.strip():
-                tmp_dir = Path(tempfile.mkdtemp(prefix="sandbox_patch_"))
-                patch_path = tmp_dir / "patch.diff"
-                patch_path.write_text(test_patch)
-                write_res = self.client.cp(str(patch_path), f"{container}:/tmp/patch.diff")
-                apply_res = self.client.exec(
-                    container,
-                    ["bash", "-lc", "cd /workspace/repo && patch -p1 < /tmp/patch.diff"],
-                    env=self.config.env,
-                )
-                if self.logger:
-                    self.logger.info("patch", stage="apply_patch", data={"exit": apply_res.exit_code})
-                status = StageStatus.success if apply_res.exit_code == 0 else StageStatus.failed
-                add_stage("apply_patch", status, [write_res, apply_res], None if status == StageStatus.success else "patch failed")
-                if status != StageStatus.success:
-                    report.completed_at = datetime.now().astimezone()
-                    return report
-
-            if repo.apply_compat:
-                compat_exit = apply_collections_rewrite(self.client, container, workdir=f"{self.config.workdir}/repo", logger=self.logger)
-                compat_res = CommandResult(
-                    command="compat_collections_rewrite",
-                    cwd=f"{self.config.workdir}/repo",
-                    env=self.config.env,
-                    exit_code=compat_exit,
-                    stdout="",
-                    stderr="",
-                    duration_sec=0.0,
-                    timed_out=False,
-                )
-                if self.logger:
-                    self.logger.info("compat", stage="compat_rewrite", data={"exit": compat_res.exit_code})
-                add_stage(
-                    "compat_rewrite",
-                    StageStatus.success if compat_exit == 0 else StageStatus.failed,
-                    [compat_res],
-                    None if compat_exit == 0 else "compat rewrite failed",
-                )
-                if compat_exit != 0:
-                    report.completed_at = datetime.now().astimezone()
-                    return report
-
-            if repo.setuptools_cap:
-                set_exit = apply_setuptools_cap(
-                    self.client,
-                    container,
-                    version_cap=repo.setuptools_cap,
-                    workdir=f"{self.config.workdir}/repo",
-                    logger=self.logger,
-                )
-                set_res = CommandResult(
-                    command=f"pip install {repo.setuptools_cap}",
-                    cwd=f"{self.config.workdir}/repo",
-                    env=self.config.env,
-                    exit_code=set_exit,
-                    stdout="",
-                    stderr="",
-                    duration_sec=0.0,
-                    timed_out=False,
-                )
-                add_stage(
-                    "compat_setuptools",
-                    StageStatus.success if set_exit == 0 else StageStatus.failed,
-                    [set_res],
-                    None if set_exit == 0 else "setuptools cap failed",
-                )
-                if set_exit != 0:
-                    report.completed_at = datetime.now().astimezone()
-                    return report
-
-            if repo.pytest_cap:
-                py_exit = apply_pytest_cap(
-                    self.client,
-                    container,
-                    version=repo.pytest_cap,
-                    workdir=f"{self.config.workdir}/repo",
-                    logger=self.logger,
-                )
-                py_res = CommandResult(
-                    command=f"pip install pytest=={repo.pytest_cap}",
-                    cwd=f"{self.config.workdir}/repo",
-                    env=self.config.env,
-                    exit_code=py_exit,
-                    stdout="",
-                    stderr="",
-                    duration_sec=0.0,
-                    timed_out=False,
-                )
-                add_stage(
-                    "compat_pytest",
-                    StageStatus.success if py_exit == 0 else StageStatus.failed,
-                    [py_res],
-                    None if py_exit == 0 else "pytest pin failed",
-                )
-                if py_exit != 0:
-                    report.completed_at = datetime.now().astimezone()
-                    return report
-
-            setup_commands = task.setup_commands or []
-            setup_results: List[CommandResult] = []
-            setup_status = StageStatus.success
-            for cmd in setup_commands:
-                cmd_res = self.client.exec(
-                    container,
-                    ["bash", "-lc", f"cd {self.config.workdir}/repo && {cmd}"],
-                    env=merge_env(self.config.env, task.env),
-                )
-                setup_results.append(cmd_res)
-                if cmd_res.exit_code != 0 or cmd_res.timed_out:
-                    setup_status = StageStatus.failed
-                    break
-            if self.logger:
-                self.logger.info("setup", stage="setup", data={"exit": setup_results[-1].exit_code if setup_results else None})
-            add_stage("setup", setup_status, setup_results, None if setup_status == StageStatus.success else "setup failed")
-            if setup_status != StageStatus.success:
-                report.completed_at = datetime.now().astimezone()
-                return report
-
-            test_res = self.client.exec(
-                container,
-                ["bash", "-lc", f"cd {self.config.workdir}/repo && {task.test_command}"],
-                env=merge_env(self.config.env, task.env),
-            )
-            expected_fail = task.expected_fail
-            passed = (test_res.exit_code != 0) if expected_fail else (test_res.exit_code == 0)
-            if self.logger:
-                self.logger.info(
-                    "test",
-                    stage="test",
-                    data={"exit": test_res.exit_code, "expected_fail": expected_fail, "passed": passed},
-                )
-            add_stage(
-                "test",
-                StageStatus.success if passed else StageStatus.failed,
-                [test_res],
-                None if passed else "test outcome did not match expectation",
-            )
-            report.success = passed
-            report.completed_at = datetime.now().astimezone()
-            return report
+            ok = self._drive(self.build_steps(report, container, repo, task, test_patch, clone_source, key, restore_image))
+            if ok:
+                self._drive(self.test_steps(report, container, task))
+            return self.finish(report)
         finally:
-            if started:
+            if self.channel:
+                self.channel.close()
+                self.channel = None
+            if cache_env:
+                self.record_cache_stats(report)
+            if pooled:
+                self.pool.release(container)
+            elif started and self.config.keep_container:
+                report.container = container
+                if self.logger:
+                    self.logger.info("container kept", stage="cleanup", data={"container": container})
+            elif started:
                 self.client.stop(container)
                 self.client.rm(container)
+
+    def _rerun_stages(
+        self, report: RunReport, repo: RepoSpec, task: TaskSpec, container: str, from_stage: str, test_patch: str, last: str = "test"
+    ) -> bool:
+        try:
+            if self.config.command_channel:
+                self._open_channel(report, container)
+            return self._drive(self.rerun_steps(report, repo, task, container, from_stage, test_patch, last))
+        finally:
+            if self.channel:
+                self.channel.close()
+                self.channel = None
+
+    def rerun(
+        self, report: RunReport, repo: RepoSpec, task: TaskSpec, container: Optional[str], from_stage: str = "test", test_patch: str = ""
+    ) -> RunReport:
+        """Run ``from_stage`` and every stage after it again in a kept container, appending to ``report``.
+
+        Starting after ``checkout`` assumes the tree is as the original run
+        left it; ``checkout`` resets it to ``repo.commit`` first. For a kept
+        two-phase run (no container, ``report.volumes`` set) the stages before
+        ``test`` run in a new setup container on the volumes, and the test in
+        a fresh test container.
+        """
+        if from_stage not in RERUN_STAGES:
+            raise ValueError(f"unknown stage {from_stage!r}; expected one of {', '.join(RERUN_STAGES)}")
+        report.success = False
+        report.completed_at = None
+        if self.logger:
+            self.logger.info("rerun", stage="rerun", data={"container": container, "volumes": report.volumes, "from_stage": from_stage})
+        if container:
+            self._rerun_stages(report, repo, task, container, from_stage, test_patch)
+            return self.finish(report)
+        if not report.volumes:
+            raise ValueError("rerun needs a kept container or kept two-phase volumes")
+        ok = True
+        if from_stage != "test":
+            setup_container = f"sandbox-{uuid.uuid4().hex[:8]}"
+            volumes, cache_env = cache_mounts(self.config)
+            mounts = volumes + self._shared_mounts(report.volumes)
+            try:
+                ok = self._start(report, setup_container, self.config.image, mounts, merge_env(cache_env, self.config.env))
+                ok = ok and self._rerun_stages(report, repo, task, setup_container, from_stage, test_patch, last="setup")
+            finally:
+                self.client.rm(setup_container, force=True)
+        if ok:
+            self.test_attempt(report, task, report.volumes)
+        return self.finish(report)
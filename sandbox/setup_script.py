@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import re
+import shlex
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sandbox.capture import BoundedBuffer
+from sandbox.models import CommandResult
+
+# Marker lines: "@@AB:<nonce>:B:<i>::<epoch>@@" before command i and
+# "@@AB:<nonce>:E:<i>:<rc>:<epoch>@@" after it (stderr gets them without rc/time).
+# Each is preceded by a newline so it starts a line even after unterminated output.
+
+# Exit codes of coreutils `timeout` when it stops a command: after SIGTERM, and after the SIGKILL that follows.
+TIMEOUT_EXIT_CODES = (124, 137)
+# Seconds a command gets between SIGTERM and SIGKILL once it is over its limit.
+KILL_AFTER_SEC = 10
+
+
+def new_nonce() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def setup_script(commands: List[str], workdir: str, nonce: str, timeout_sec: Optional[int] = None) -> str:
+    """One shell script running ``commands`` in order, each in its own subshell, stopping at the first failure.
+
+    Every command starts from ``workdir`` with a fresh subshell, like one
+    ``docker exec`` per command would. With ``timeout_sec`` each command
+    runs under ``timeout`` with that limit of its own, as it would have as
+    its own exec; ``split_results`` reports one stopped that way as timed out.
+    """
+    lines: List[str] = []
+    for i, cmd in enumerate(commands):
+        tag = f"@@AB:{nonce}"
+        lines += [
+            f"printf '\\n{tag}:B:{i}::%s@@\\n' \"$EPOCHREALTIME\"",
+            f"printf '\\n{tag}:B:{i}::@@\\n' >&2",
+            *(
+                [f"timeout -k {KILL_AFTER_SEC} {timeout_sec} bash -c {shlex.quote(f'cd {workdir} && {cmd}')}"]
+                if timeout_sec
+                else ["(", f"cd {workdir} && {cmd}", ")"]
+            ),
+            "rc=$?",
+            f"printf '\\n{tag}:E:{i}:%s:%s@@\\n' \"$rc\" \"$EPOCHREALTIME\"",
+            f"printf '\\n{tag}:E:{i}::@@\\n' >&2",
+            '[ "$rc" -eq 0 ] || exit "$rc"',
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def _lines(text: str, spilled: Optional[str]) -> Iterator[bytes]:
+    if spilled and Path(spilled).is_file():
+        with open(spilled, "rb") as fh:
+            yield from fh
+    else:
+        yield from text.encode("utf-8").splitlines(keepends=True)
+
+
+def _split(
+    text: str, spilled: Optional[str], nonce: str, buffer_bytes: int
+) -> Tuple[Dict[int, BoundedBuffer], Dict[int, Tuple[float, Optional[int], Optional[float]]]]:
+    """Per-command buffers and, from stdout markers, (start, exit code, end) per command."""
+    marker = re.compile(rb"@@AB:" + nonce.encode() + rb":([BE]):(\d+):(-?\d*):([\d.,]*)@@\r?\n?$")
+    buffers: Dict[int, BoundedBuffer] = {}
+    times: Dict[int, Tuple[float, Optional[int], Optional[float]]] = {}
+    current: Optional[BoundedBuffer] = None
+    pending: Optional[bytes] = None
+    for line in _lines(text, spilled):
+        match = marker.match(line)
+        if not match:
+            if current is not None and pending is not None:
+                current.feed(pending)
+            pending = line
+            continue
+        # The line before a marker ends with the newline the marker printed.
+        if current is not None and pending:
+            current.feed(pending[:-1])
+        pending = None
+        kind, index = match.group(1), int(match.group(2))
+        stamp = float(match.group(4).replace(b",", b".")) if match.group(4) else None
+        if kind == b"B":
+            spill = Path(f"{spilled}.{index}") if spilled else None
+            current = buffers[index] = BoundedBuffer("", buffer_bytes, buffer_bytes, spill)
+            if stamp is not None:
+                times[index] = (stamp, None, None)
+        else:
+            if current is not None:
+                current.close()
+            current = None
+            if index in times:
+                times[index] = (times[index][0], int(match.group(3)), stamp)
+    if current is not None:
+        # The batch died (timeout, killed container) inside this command.
+        if pending is not None:
+            current.feed(pending)
+        current.close()
+    return buffers, times
+
+
+def split_results(
+    res: CommandResult,
+    commands: List[str],
+    workdir: str,
+    nonce: str,
+    buffer_bytes: int = 64 * 1024,
+    timeout_sec: Optional[int] = None,
+) -> List[CommandResult]:
+    """Turn the result of a ``setup_script`` run back into one CommandResult per command that started.
+
+    A command without an end marker was cut short: it gets the batch's exit
+    code, or no exit code when the batch timed out. One that ended with a
+    ``timeout`` exit code after running for its whole ``timeout_sec`` hit its
+    own limit and is timed out, without an exit code. When no marker at all
+    came back (the exec itself failed), the batch result is returned as the
+    first command's.
+    """
+    outs, times = _split(res.stdout, res.stdout_path, nonce, buffer_bytes)
+    errs, _ = _split(res.stderr, res.stderr_path, nonce, buffer_bytes)
+    for spilled in (res.stdout_path, res.stderr_path):
+        if spilled:
+            Path(spilled).unlink(missing_ok=True)
+    if not outs:
+        return [res.model_copy(update={"command": f"cd {workdir} && {commands[0]}" if commands else res.command})]
+    results: List[CommandResult] = []
+    for i in sorted(outs):
+        out, err = outs[i], errs.get(i) or BoundedBuffer("")
+        start, exit_code, end = times.get(i, (None, None, None))
+        finished = end is not None
+        # Stopped by its own `timeout`: a timeout exit code, after running for the whole limit.
+        hit_limit = bool(
+            finished and timeout_sec and exit_code in TIMEOUT_EXIT_CODES and start is not None and end - start >= timeout_sec
+        )
+        if hit_limit:
+            exit_code = None
+        results.append(
+            CommandResult(
+                command=f"cd {workdir} && {commands[i]}",
+                cwd=res.cwd,
+                env=res.env,
+                exit_code=exit_code if finished else (None if res.timed_out else res.exit_code),
+                stdout=out.text(),
+                stderr=err.text(),
+                stdout_path=str(out.spill_path) if out.spill_path else None,
+                stderr_path=str(err.spill_path) if err.spill_path else None,
+                stdout_bytes=out.total_bytes,
+                stderr_bytes=err.total_bytes,
+                duration_sec=(end - start) if finished and start is not None else 0.0,
+                # Marker timestamps are taken in the container, so this is all in-container time.
+                in_container_sec=(end - start) if finished and start is not None else None,
+                started_at=datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None) if start else res.started_at,
+                timed_out=hit_limit or (res.timed_out and not finished),
+            )
+        )
+    return results
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import re
+import shlex
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sandbox.models import TaskSpec, TestOutcome, TestStatus
+
+# In-container locations: the node id list copied in, and the per-shard ids, JUnit XML and logs.
+CONTAINER_IDS_PATH = "/tmp/ab-tests.txt"
+JUNIT_DIR = "/tmp/ab-junit"
+MESSAGE_LIMIT = 2000
+
+_SHARD_RE = re.compile(r"shard-(\d+)\.xml$")
+_PYTEST_RE = re.compile(r"(^|/)(py\.test|pytest)$")
+_PYTHON_RE = re.compile(r"(^|/)python[\d.]*$")
+_ASSIGN_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+_OPERATOR_RE = re.compile(r"^[;&|<>()]+$")
+# pytest options whose value may be the next token; short ones may also carry it attached (-kfoo).
+_SHORT_VALUE = set("kmpcoWrn")
+_LONG_VALUE = {
+    "--basetemp", "--capture", "--confcutdir", "--deselect", "--durations", "--ignore", "--ignore-glob",
+    "--import-mode", "--junit-prefix", "--junit-xml", "--junitxml", "--log-level", "--maxfail", "--numprocesses",
+    "--override-ini", "--rootdir", "--tb", "--cov", "--cov-report", "--dist", "--timeout",
+}
+# Selection and early-exit options that must not reach a shard.
+_DROPPED = {"--junitxml", "--junit-xml", "--maxfail", "--exitfirst"}
+# Outcomes in order of severity; a test reported twice (call, then teardown) keeps the worst.
+_RANK = {TestStatus.passed: 0, TestStatus.skipped: 1, TestStatus.failed: 2, TestStatus.error: 3}
+
+
+def selected_tests(task: TaskSpec) -> List[str]:
+    """FAIL_TO_PASS then PASS_TO_PASS, each node id once."""
+    return list(dict.fromkeys(task.fail_to_pass + task.pass_to_pass))
+
+
+def _tokens(command: str) -> Optional[List[str]]:
+    # punctuation_chars splits unquoted shell operators into tokens of their own.
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        return list(lexer)
+    except ValueError:
+        return None
+
+
+def _short_cluster(token: str) -> Tuple[str, bool]:
+    """``token`` (a ``-abc`` cluster) without ``-x``; True if its last flag takes the next token as value."""
+    kept = ""
+    for i, flag in enumerate(token[1:], start=1):
+        if flag in _SHORT_VALUE:
+            return "-" + kept + token[i:], i == len(token) - 1
+        if flag != "x":
+            kept += flag
+    return ("-" + kept if kept else ""), False
+
+
+def pytest_prefix(test_command: str, tests: Iterable[str]) -> Optional[str]:
+    """``test_command`` without its test selection, or None if it cannot be sharded.
+
+    Only a plain ``[NAME=value ...] [python -m] pytest [options] [node ids]``
+    command qualifies: shell operators, substitutions, or positional paths
+    (a directory or file would run on top of every shard's chunk) mean the
+    command runs unsharded. Node ids, ``--junitxml`` and the options that
+    stop a run early (``-x``, ``--maxfail``) are dropped; value-taking
+    options keep their value.
+    """
+    tokens = _tokens(test_command)
+    if not tokens or any(_OPERATOR_RE.match(t) or "$(" in t or "`" in t for t in tokens):
+        return None
+    prefix: List[str] = []
+    while tokens and _ASSIGN_RE.match(tokens[0]):
+        name, _, value = tokens.pop(0).partition("=")
+        prefix.append(f"{name}={shlex.quote(value)}")
+    if tokens and _PYTEST_RE.search(tokens[0]):
+        head = 1
+    elif len(tokens) >= 3 and _PYTHON_RE.search(tokens[0]) and tokens[1:3] == ["-m", "pytest"]:
+        head = 3
+    else:
+        return None
+    prefix += [shlex.quote(t) for t in tokens[:head]]
+    selected = set(tests)
+    args = iter(tokens[head:])
+    for token in args:
+        name = token.split("=", 1)[0]
+        if token.startswith("--"):
+            value = next(args, None) if name in _LONG_VALUE and "=" not in token else None
+            if name in _LONG_VALUE and "=" not in token and value is None:
+                return None
+            if name not in _DROPPED:
+                prefix += [shlex.quote(t) for t in (token, value) if t is not None]
+        elif token.startswith("-") and len(token) > 1:
+            cluster, takes_value = _short_cluster(token)
+            value = next(args, None) if takes_value else None
+            if takes_value and value is None:
+                return None
+            prefix += [shlex.quote(t) for t in (cluster, value) if t]
+        elif token not in selected and "::" not in token:
+            return None
+    return " ".join(prefix)
+
+
+def shard_command(prefix: str, repo_dir: str, shards: Optional[int] = None) -> str:
+    """Shell command that runs the ids at ``CONTAINER_IDS_PATH`` as parallel pytest processes.
+
+    The sorted ids are cut into ``shards`` contiguous chunks (default: the
+    container's CPU count), so tests of one file mostly share a shard and
+    its collection. Each shard writes ``shard-<n>.xml`` and ``shard-<n>.log``
+    under ``JUNIT_DIR``; stdout only gets each shard's exit code, plus the
+    log tail of a shard that wrote no XML.
+    """
+    count = str(max(1, shards)) if shards else "$(nproc)"
+    d = JUNIT_DIR
+    run = (
+        f'mapfile -t ids < "$f"; i=${{f##*-}};'
+        f' {{ {prefix} -p no:cacheprovider --junitxml={d}/shard-$i.xml "${{ids[@]}}" > {d}/shard-$i.log 2>&1; echo "shard $i exit $?"; }} &'
+    )
+    return (
+        f"{{ rm -rf {d} && mkdir -p {d} && cd {repo_dir} && split -n l/{count} -d -a 3 {CONTAINER_IDS_PATH} {d}/ids-; }} || exit 1;"
+        f' for f in {d}/ids-*; do [ -s "$f" ] || continue; {run} done; wait;'
+        f' for f in {d}/ids-*; do i=${{f##*-}}; [ -s "$f" ] && [ ! -s {d}/shard-$i.xml ] && {{ echo "shard $i wrote no junit xml:"; tail -n 20 {d}/shard-$i.log; }}; done; true'
+    )
+
+
+def junit_key(nodeid: str) -> Tuple[str, str]:
+    """The (classname, name) pair pytest writes to JUnit XML for ``nodeid``."""
+    # Parametrize ids may contain "::" themselves; only split the part before them.
+    base, bracket, params = nodeid.partition("[")
+    parts = [p for p in base.split("::") if p != "()"]
+    parts[-1] += bracket + params
+    path = parts[0]
+    module = path[:-3] if path.endswith(".py") else path
+    return ".".join([module.replace("/", "."), *parts[1:-1]]), parts[-1] if len(parts) > 1 else ""
+
+
+def _message(case: ET.Element) -> Tuple[TestStatus, Optional[str]]:
+    for tag, status in (("error", TestStatus.error), ("failure", TestStatus.failed), ("skipped", TestStatus.skipped)):
+        child = case.find(tag)
+        if child is not None:
+            text = "\n".join(t for t in (child.get("message"), child.text) if t)
+            return status, text[:MESSAGE_LIMIT] or None
+    return TestStatus.passed, None
+
+
+def parse_junit(junit_dir: Path, tests: List[str]) -> List[TestOutcome]:
+    """Per-test outcomes for ``tests`` from the shard XML files in ``junit_dir``.
+
+    Tests no shard reported (collection errors, crashed shards) are
+    ``missing``. Test cases that were not selected are ignored.
+    """
+    wanted: Dict[Tuple[str, str], str] = {junit_key(t): t for t in tests}
+    found: Dict[str, TestOutcome] = {}
+    for path in sorted(junit_dir.glob("shard-*.xml")):
+        match = _SHARD_RE.search(path.name)
+        try:
+            root = ET.parse(path).getroot()
+        except ET.ParseError:
+            continue
+        for case in root.iter("testcase"):
+            nodeid = wanted.get((case.get("classname", ""), case.get("name", "")))
+            if nodeid is None:
+                continue
+            status, message = _message(case)
+            prev = found.get(nodeid)
+            if prev is not None and _RANK[prev.status] >= _RANK[status]:
+                continue
+            found[nodeid] = TestOutcome(
+                nodeid=nodeid,
+                status=status,
+                duration_sec=float(case.get("time") or 0.0) + (prev.duration_sec if prev else 0.0),
+                shard=int(match.group(1)) if match else None,
+                message=message,
+            )
+    return [found.get(t) or TestOutcome(nodeid=t, status=TestStatus.missing) for t in tests]
+
+
+def judge(task: TaskSpec, outcomes: List[TestOutcome]) -> Tuple[bool, Optional[str]]:
+    """Check FAIL_TO_PASS against ``task.expected_fail`` and that PASS_TO_PASS did not fail.
+
+    With ``expected_fail`` (the baseline) no FAIL_TO_PASS test may pass;
+    otherwise all must. PASS_TO_PASS tests must pass or be skipped. A run
+    that reported none of the tests fails either way.
+    """
+    if all(o.status == TestStatus.missing for o in outcomes):
+        return False, "no shard reported any selected test"
+    by_id = {o.nodeid: o for o in outcomes}
+    f2p = [by_id[t] for t in task.fail_to_pass if t in by_id]
+    if task.expected_fail:
+        wrong_f2p = [o.nodeid for o in f2p if o.status == TestStatus.passed]
+    else:
+        wrong_f2p = [o.nodeid for o in f2p if o.status != TestStatus.passed]
+    broken_p2p = [
+        by_id[t].nodeid for t in task.pass_to_pass if t in by_id and by_id[t].status not in (TestStatus.passed, TestStatus.skipped)
+    ]
+    problems = []
+    if wrong_f2p:
+        problems.append(f"FAIL_TO_PASS {'passed' if task.expected_fail else 'did not pass'}: {_names(wrong_f2p)}")
+    if broken_p2p:
+        problems.append(f"PASS_TO_PASS did not pass: {_names(broken_p2p)}")
+    return not problems, "; ".join(problems) or None
+
+
+def _names(ids: List[str], limit: int = 5) -> str:
+    more = f" (+{len(ids) - limit} more)" if len(ids) > limit else ""
+    return ", ".join(ids[:limit]) + more
+
+
+def summary(outcomes: List[TestOutcome]) -> Dict[str, int]:
+    counts = {status.value: 0 for status in TestStatus}
+    for o in outcomes:
+        counts[o.status.value] += 1
+    return counts
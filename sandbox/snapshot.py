@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sandbox.backend import DockerBackend
+from sandbox.git_cache import normalize_url
+from sandbox.keep import cleared_keep_labels
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult, RepoSpec, TaskSpec
+
+SNAPSHOT_REPO = "agentbench-snapshot"
+SNAPSHOT_LABEL = "agentbench.snapshot"
+
+
+def snapshot_key(base_image_id: str, repo: RepoSpec, task: TaskSpec, workdir: str, single_pass_deps: bool = False) -> str:
+    """Content hash of everything that determines the post-setup container state."""
+    payload = {
+        "image": base_image_id,
+        "repo_url": normalize_url(repo.repo_url),
+        "environment_setup_commit": repo.environment_setup_commit or repo.commit,
+        "compat": {
+            "apply_compat": repo.apply_compat,
+            "setuptools_cap": repo.setuptools_cap,
+            "pytest_cap": repo.pytest_cap,
+        },
+        "setup_commands": list(task.setup_commands),
+        "env": dict(sorted(task.env.items())),
+        "workdir": workdir,
+    }
+    if single_pass_deps:
+        # Setup also applies the repo_compat pins and the constraints file.
+        payload["single_pass_deps"] = True
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    """Post-setup images tagged ``agentbench-snapshot:<key>`` with LRU eviction.
+
+    ``index.json`` under ``root`` tracks the size and last use of every snapshot;
+    it is only read or written under ``index.lock``. Saving takes a per-key lock
+    so two workers that miss on the same key commit it once.
+    """
+
+    def __init__(self, client: DockerBackend, root: Path, budget_bytes: int, logger: Optional[EventLogger] = None):
+        self.client = client
+        self.root = root.expanduser()
+        self.budget_bytes = budget_bytes
+        self.logger = logger
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.json"
+
+    def tag(self, key: str) -> str:
+        return f"{SNAPSHOT_REPO}:{key[:24]}"
+
+    @contextmanager
+    def _flock(self, name: str) -> Iterator[None]:
+        with (self.root / name).open("a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _index(self) -> Iterator[Dict[str, dict]]:
+        with self._flock("index.lock"):
+            try:
+                index = json.loads(self.index_path.read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                index = {}
+            yield index
+            tmp = self.index_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(index, indent=2, sort_keys=True))
+            tmp.replace(self.index_path)
+
+    def _image_size(self, image: str) -> int:
+        res = self.client.inspect_image(image, fmt="{{.Size}}")
+        try:
+            return int(res.stdout.strip())
+        except ValueError:
+            return 0
+
+    def base_image_id(self, image: str) -> Tuple[Optional[str], CommandResult]:
+        res = self.client.inspect_image(image)
+        return (res.stdout.strip() or None) if res.exit_code == 0 else None, res
+
+    def lookup(self, key: str) -> Tuple[Optional[str], CommandResult]:
+        tag = self.tag(key)
+        res = self.client.inspect_image(tag)
+        with self._index() as index:
+            if res.exit_code != 0:
+                index.pop(tag, None)
+                return None, res
+            entry = index.setdefault(tag, {"size": 0, "created": time.time()})
+            entry["last_used"] = time.time()
+        return tag, res
+
+    def save(self, container: str, key: str, base_image: str) -> CommandResult:
+        tag = self.tag(key)
+        with self._flock(f"{key[:24]}.lock"):
+            existing = self.client.inspect_image(tag)
+            if existing.exit_code == 0:
+                # Another worker committed the same environment while we were setting up.
+                existing.stdout = f"exists {tag}\n"
+                return existing
+            # The container may be a kept one; its keep labels must not carry over to the image.
+            res = self.client.commit(container, tag, labels={SNAPSHOT_LABEL: key, **cleared_keep_labels()})
+        if res.exit_code == 0:
+            # Shared base layers are not ours to count against the budget.
+            size = max(self._image_size(tag) - self._image_size(base_image), 0)
+            now = time.time()
+            with self._index() as index:
+                index[tag] = {"size": size, "created": now, "last_used": now}
+            evicted = self.evict(protect=tag)
+            if self.logger:
+                self.logger.info("snapshot saved", stage="snapshot", data={"tag": tag, "size": size, "evicted": evicted})
+        return res
+
+    def evict(self, protect: Optional[str] = None) -> List[str]:
+        evicted: List[str] = []
+        with self._index() as index:
+            total = sum(e.get("size", 0) for e in index.values())
+            for tag, entry in sorted(index.items(), key=lambda kv: kv[1].get("last_used", 0)):
+                if total <= self.budget_bytes:
+                    break
+                if tag == protect:
+                    continue
+                res = self.client.rmi(tag)
+                if res.exit_code != 0 and "No such image" not in res.stderr:
+                    # Still used by a running container; try the next oldest.
+                    continue
+                total -= entry.get("size", 0)
+                index.pop(tag, None)
+                evicted.append(tag)
+        return evicted
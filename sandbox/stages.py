@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict, Generator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Shell:
+    """Run ``command`` with ``bash -lc`` in ``container``.
+
+    ``plain`` asks for a docker exec even when a command channel is open
+    (for output that must be spilled in full).
+    """
+
+    def __init__(
+        self,
+        container: str,
+        command: str,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[int] = None,
+        plain: bool = False,
+    ):
+        self.container = container
+        self.command = command
+        self.env = env
+        self.timeout = timeout
+        self.plain = plain
+
+
+class Copy:
+    """``docker cp src dest``; one side is ``<container>:<path>``."""
+
+    def __init__(self, src: str, dest: str):
+        self.src = src
+        self.dest = dest
+
+
+class Host:
+    """Blocking host-side work (files, git, snapshot bookkeeping); async drivers run it in a thread."""
+
+    def __init__(self, fn: Callable[..., Any], *args: Any):
+        self.fn = fn
+        self.args = args
+
+
+Request = Any
+# A stage written once for both runners: it yields Shell/Copy/Host requests,
+# is sent each request's result, and returns the stage outcome.
+Steps = Generator[Request, Any, T]
+
+
+def drive(steps: Steps[T], perform: Callable[[Request], Any]) -> T:
+    """Run ``steps`` to completion, performing each request with ``perform``."""
+    try:
+        result: Any = None
+        while True:
+            result = perform(steps.send(result))
+    except StopIteration as done:
+        return done.value
+    finally:
+        steps.close()
+
+
+async def drive_async(steps: Steps[T], perform: Callable[[Request], Awaitable[Any]]) -> T:
+    """``drive`` for a coroutine ``perform``; cancellation closes ``steps`` so their cleanup runs."""
+    try:
+        result: Any = None
+        while True:
+            result = await perform(steps.send(result))
+    except StopIteration as done:
+        return done.value
+    finally:
+        steps.close()
+
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import re
+import shlex
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from sandbox.backend import DockerBackend
+from sandbox.caches import WHEELHOUSE_DIR, cache_mounts
+from sandbox.deps import compat_pins, parse_pip_install
+from sandbox.envlock import FREEZE_COMMAND
+from sandbox.logger import EventLogger
+from sandbox.models import CommandResult, RepoSpec, SandboxConfig, TaskSpec
+
+# Build backends pip fetches for isolated builds; offline installs need them too.
+BUILD_REQUIREMENTS = ("setuptools", "wheel")
+
+_SPLIT_RE = re.compile(r"&&|\|\||;|\n")
+_FAILED_RE = re.compile(r"^failed (.+)$", re.MULTILINE)
+_ADDED_RE = re.compile(r"^added (\d+) wheel", re.MULTILINE)
+
+# Wheels land in a private dir inside the wheelhouse first and are renamed in
+# one at a time, so a concurrent install never sees a half-written file.
+_INCOMING = f'd=$(mktemp -d {WHEELHOUSE_DIR}/.incoming-XXXXXX) || exit 1'
+_COLLECT = (
+    f'n=0; for f in "$d"/*.whl; do [ -e "$f" ] || continue; [ -e "{WHEELHOUSE_DIR}/${{f##*/}}" ] && continue;'
+    f' mv "$f" {WHEELHOUSE_DIR}/ && n=$((n+1)); done; rm -rf "$d"; echo "added $n wheel(s)"'
+)
+
+# Pinned packages of the current environment that the wheelhouse does not have yet.
+_MISSING = f"""python -c "$(cat <<'PY'
+import re, sys
+from pathlib import Path
+norm = lambda name: re.sub(r'[-_.]+', '-', name).lower()
+have = set((norm(w.name.split('-')[0]), w.name.split('-')[1]) for w in Path('{WHEELHOUSE_DIR}').glob('*.whl'))
+for line in sys.stdin:
+    name, sep, version = line.strip().partition('==')
+    if sep and (norm(name), version) not in have:
+        print(line.strip())
+PY
+)\""""
+
+
+def _is_local(arg: str) -> bool:
+    return arg.startswith((".", "/", "~", "file:")) or "://" in arg
+
+
+def suite_requirements(specs: Iterable[Tuple[RepoSpec, TaskSpec]]) -> List[str]:
+    """Every requirement a suite names, once, in first-seen order.
+
+    Covers plain ``pip install`` commands in ``setup_commands`` (compound
+    commands are split on ``&&``, ``||`` and ``;``) and the compat pins.
+    ``BUILD_REQUIREMENTS`` always come first. Local paths, editables and
+    ``-r`` files live in the checkout, so they are left to fill the
+    wheelhouse from real runs.
+    """
+    seen = {req: req for req in BUILD_REQUIREMENTS}
+    for repo, task in specs:
+        found = [p.requirement for p in compat_pins(repo)]
+        for command in task.setup_commands:
+            for part in _SPLIT_RE.split(command):
+                parsed = parse_pip_install(part.strip())
+                if parsed is None:
+                    continue
+                args = iter(parsed[1])
+                for arg in args:
+                    if arg.startswith("-"):
+                        # -r/-e/-c: the value is a path in the checkout.
+                        next(args, None)
+                    elif not _is_local(arg):
+                        found.append(arg)
+        for req in found:
+            seen.setdefault(re.sub(r"\s+", "", req).lower(), req)
+    return list(seen.values())
+
+
+def fill_command() -> str:
+    """Shell command that adds wheels for the environment's missing pins to the wheelhouse."""
+    return (
+        f"{_INCOMING}; {FREEZE_COMMAND} | {_MISSING}"
+        ' | while read -r req; do pip wheel -q --no-deps -w "$d" "$req" || echo "failed $req"; done; '
+        f"{_COLLECT}"
+    )
+
+
+def prefetch_command(requirements: List[str]) -> str:
+    """Shell command that builds wheels for ``requirements`` and their dependencies into the wheelhouse.
+
+    Each requirement resolves on its own, so pins that conflict across
+    instances (pytest==5 here, pytest==7 there) all get their wheels.
+    """
+    reqs = " ".join(shlex.quote(r) for r in requirements)
+    return (
+        f"{_INCOMING}; for req in {reqs}; do"
+        f' pip wheel -q --find-links {WHEELHOUSE_DIR} -w "$d" "$req" || echo "failed $req"; done; '
+        f"{_COLLECT}"
+    )
+
+
+def failed_requirements(results: Iterable[CommandResult]) -> List[str]:
+    return [m for res in results for m in _FAILED_RE.findall(res.stdout)]
+
+
+def added_wheels(results: Iterable[CommandResult]) -> int:
+    return sum(int(m) for res in results for m in _ADDED_RE.findall(res.stdout))
+
+
+def prefetch(
+    client: DockerBackend,
+    config: SandboxConfig,
+    requirements: List[str],
+    workers: int = 4,
+    logger: Optional[EventLogger] = None,
+) -> List[CommandResult]:
+    """Fill ``config.wheelhouse_volume`` with wheels for ``requirements`` from one bridged container.
+
+    Requirements are split across ``workers`` concurrent execs in that
+    container. Returns the start result followed by one result per exec.
+    """
+    if not config.wheelhouse_volume:
+        raise ValueError("prefetch needs config.wheelhouse_volume")
+    if not requirements:
+        return []
+    # Prefetching is the one step that must reach the index.
+    bridged = config.model_copy(update={"network": "bridge"})
+    volumes, env = cache_mounts(bridged)
+    name = f"ab-prefetch-{uuid.uuid4().hex[:8]}"
+    start = client.run_container(image=config.image, name=name, workdir=config.workdir, env=env, network="bridge", detach=True, volumes=volumes)
+    if start.exit_code != 0:
+        return [start]
+    chunks = [c for c in (requirements[i :: max(1, workers)] for i in range(max(1, workers))) if c]
+    try:
+        with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="ab-prefetch") as executor:
+            results = list(
+                executor.map(
+                    lambda chunk: client.exec(
+                        name, ["bash", "-lc", prefetch_command(chunk)], env=env, timeout=config.tool_timeout_sec * len(chunk)
+                    ),
+                    chunks,
+                )
+            )
+    finally:
+        client.rm(name, force=True)
+    if logger:
+        logger.info(
+            "wheelhouse prefetch",
+            stage="prefetch",
+            data={
+                "image": config.image,
+                "requirements": len(requirements),
+                "added": added_wheels(results),
+                "failed": failed_requirements(results),
+            },
+        )
+    return [start, *results]
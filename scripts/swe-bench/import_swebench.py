@@ -1,21 +1,45 @@
 #!/usr/bin/env python3
 """Import selected SWE-bench tasks into AgentBench task format.
 
-This script pulls SWE-bench Lite from Hugging Face, filters for fast tasks,
-and writes AgentBench-compatible task.yaml files.
+This script streams SWE-bench (Lite or full) from Hugging Face, filters for
+fast tasks, and writes AgentBench-compatible task.yaml files.
+
+The first import caches the dataset as JSONL under
+``<cache-dir>/swe-bench/<dataset>-<split>.jsonl``. A JSON index next to it
+maps each instance_id to its byte offset. Later imports (and ``--offline``
+ones, for air-gapped CI) read the cache instead of the network, and
+``--instance-id`` reads single records through the index without a scan.
 """
 
 from __future__ import annotations
 
 import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator, Optional
 
 import yaml
 
+DATASETS = {
+    "lite": "princeton-nlp/SWE-bench_Lite",
+    "full": "princeton-nlp/SWE-bench",
+}
+DEFAULT_CACHE_DIR = "~/.cache/agentbench"
 
-def load_swebench_lite(split: str = "test") -> list[dict[str, Any]]:
-    """Load SWE-bench Lite instances.
+
+def cache_path(cache_dir: str | Path, dataset: str = "lite", split: str = "test") -> Path:
+    return Path(cache_dir).expanduser() / "swe-bench" / f"{dataset}-{split}.jsonl"
+
+
+def index_path(cache: Path) -> Path:
+    return cache.with_suffix(".idx.json")
+
+
+def _stream_remote(dataset: str, split: str) -> Iterator[dict[str, Any]]:
+    """Stream SWE-bench rows from Hugging Face.
 
     Requires the optional dependency `datasets`.
     """
@@ -24,44 +48,130 @@ def load_swebench_lite(split: str = "test") -> list[dict[str, Any]]:
     except ImportError as exc:  # pragma: no cover - import guard
         raise SystemExit(
             "The `datasets` package is required to load SWE-bench. "
-            "Install with `pip install datasets`."
+            "Install with `pip install datasets`, or use --offline with a populated cache."
         ) from exc
 
-    dataset = load_dataset("princeton-nlp/SWE-bench_Lite", split=split)
-    return list(dataset)
+    yield from load_dataset(DATASETS[dataset], split=split, streaming=True)
 
 
-def filter_fast_tasks(
-    instances: list[dict[str, Any]],
+def _tee_to_cache(rows: Iterable[dict[str, Any]], cache: Path) -> Iterator[dict[str, Any]]:
+    """Yield ``rows`` while writing them and their offset index to ``cache``.
+
+    Both files are written under temporary names and renamed only once the
+    stream is exhausted, so an interrupted download never leaves a partial
+    cache behind. Closing the generator early (a ``--limit``, a scan that
+    found what it needed) first reads the rest of the stream into the cache.
+    """
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache.with_name(f".{cache.name}.{os.getpid()}.tmp")
+    index: dict[str, list[int]] = {}
+    rows = iter(rows)
+    try:
+        with tmp.open("wb") as fh:
+
+            def write(row: dict[str, Any]) -> None:
+                line = json.dumps(row, default=str).encode("utf-8") + b"\n"
+                index[str(row["instance_id"])] = [fh.tell(), len(line)]
+                fh.write(line)
+
+            try:
+                for row in rows:
+                    write(row)
+                    yield row
+            except GeneratorExit:
+                for row in rows:
+                    write(row)
+        idx_tmp = index_path(tmp)
+        idx_tmp.write_text(json.dumps(index))
+        os.replace(idx_tmp, index_path(cache))
+        os.replace(tmp, cache)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _read_cache(cache: Path) -> Iterator[dict[str, Any]]:
+    with cache.open("rb") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_instances(
+    dataset: str = "lite",
+    split: str = "test",
+    cache_dir: str | Path = DEFAULT_CACHE_DIR,
+    offline: bool = False,
+    refresh: bool = False,
+) -> Iterator[dict[str, Any]]:
+    """Stream SWE-bench instances, from the local cache when there is one.
+
+    Without a cache (or with ``refresh``) rows come from Hugging Face and are
+    cached on the way through; closing the stream early still completes the
+    cache, while an error or interrupt mid-download leaves none.
+    """
+    cache = cache_path(cache_dir, dataset, split)
+    if cache.is_file() and not refresh:
+        return _read_cache(cache)
+    if offline:
+        raise SystemExit(f"No cached SWE-bench {dataset}/{split} at {cache}; run once online to populate it.")
+    return _tee_to_cache(_stream_remote(dataset, split), cache)
+
+
+def read_instance(cache: Path, instance_id: str) -> Optional[dict[str, Any]]:
+    """Read one cached instance by id through the offset index (no scan); None if absent."""
+    entry = json.loads(index_path(cache).read_text()).get(instance_id)
+    if entry is None:
+        return None
+    offset, length = entry
+    with cache.open("rb") as fh:
+        fh.seek(offset)
+        return json.loads(fh.read(length))
+
+
+def load_swebench_lite(split: str = "test") -> list[dict[str, Any]]:
+    """Load SWE-bench Lite instances (through the local cache)."""
+    return list(iter_instances("lite", split))
+
+
+def iter_fast_tasks(
+    instances: Iterable[dict[str, Any]],
     max_test_time_sec: int = 60,
     limit: int = 10,
-) -> list[dict[str, Any]]:
-    """Filter SWE-bench instances for quick-running tasks.
+) -> Iterator[dict[str, Any]]:
+    """Lazily filter SWE-bench instances for quick-running tasks.
 
     Heuristics:
     - Must have FAIL_TO_PASS tests listed.
     - If an estimated runtime is available and exceeds `max_test_time_sec`,
       skip the instance.
-    - Stop after `limit` tasks.
+    - Stop after `limit` tasks (0 means no limit), without reading further.
     """
-    selected: list[dict[str, Any]] = []
+    selected = 0
     for inst in instances:
-        if limit and len(selected) >= limit:
-            break
-        fail_to_pass = inst.get("FAIL_TO_PASS") or []
+        if limit and selected >= limit:
+            return
+        fail_to_pass = _normalize_fail_to_pass(inst.get("FAIL_TO_PASS"))
         if not fail_to_pass:
             continue
 
         runtime = (
             inst.get("estimated_runtime")
-            or inst.get("metadata", {}).get("estimated_runtime")
+            or (inst.get("metadata") or {}).get("estimated_runtime")
         )
         if runtime is not None and runtime > max_test_time_sec:
             continue
 
-        selected.append(inst)
+        selected += 1
+        yield inst
 
-    return selected[:limit] if limit else selected
+
+def filter_fast_tasks(
+    instances: Iterable[dict[str, Any]],
+    max_test_time_sec: int = 60,
+    limit: int = 10,
+) -> list[dict[str, Any]]:
+    """List form of `iter_fast_tasks`."""
+    return list(iter_fast_tasks(instances, max_test_time_sec=max_test_time_sec, limit=limit))
 
 
 def _default_setup_commands() -> list[str]:
@@ -148,7 +258,7 @@ def generate_task_yaml(
             "entrypoint": "llm_v0",
             "max_steps": 20,
         },
-        "labels": ["swe-bench-lite"],
+        "labels": [suite],
     }
 
     task_path = output_dir / "task.yaml"
@@ -157,21 +267,66 @@ def generate_task_yaml(
     return task_path
 
 
+def write_tasks(
+    instances: Iterable[dict[str, Any]],
+    output_root: Path,
+    workers: int = 8,
+    **task_kwargs: Any,
+) -> int:
+    """Generate and write task.yaml files on a thread pool as instances stream in.
+
+    At most ``2 * workers`` writes are in flight, so memory stays bounded
+    however large the dataset is.
+    """
+    output_root.mkdir(parents=True, exist_ok=True)
+    written = 0
+    pending: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="swebench-write") as executor:
+        for inst in instances:
+            if len(pending) >= 2 * max(1, workers):
+                pending.popleft().result()
+                written += 1
+            task_dir = output_root / inst["instance_id"]
+            pending.append(executor.submit(generate_task_yaml, inst, task_dir, **task_kwargs))
+        while pending:
+            pending.popleft().result()
+            written += 1
+    return written
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="Import SWE-bench Lite tasks into AgentBench format."
+        description="Import SWE-bench tasks into AgentBench format."
+    )
+    parser.add_argument(
+        "--dataset",
+        choices=sorted(DATASETS),
+        default="lite",
+        help="SWE-bench variant to import.",
+    )
+    parser.add_argument(
+        "--split",
+        type=str,
+        default="test",
+        help="Dataset split.",
     )
     parser.add_argument(
         "--output-dir",
         type=Path,
-        default=Path("tasks") / "swe-bench-lite-10",
-        help="Directory to write tasks into (one subdir per instance).",
+        default=None,
+        help="Directory to write tasks into (one subdir per instance). Default: tasks/<suite>-<limit>.",
     )
     parser.add_argument(
         "--limit",
         type=int,
         default=10,
-        help="Maximum number of tasks to import.",
+        help="Maximum number of tasks to import (0 for all).",
+    )
+    parser.add_argument(
+        "--instance-id",
+        action="append",
+        default=[],
+        help="Import only these instances, read from the cache by id (repeatable).",
     )
     parser.add_argument(
         "--max-test-time-sec",
@@ -194,33 +349,64 @@ def main() -> None:
     parser.add_argument(
         "--suite",
         type=str,
-        default="swe-bench-lite",
-        help="Suite name to embed in generated tasks.",
+        default=None,
+        help="Suite name to embed in generated tasks. Default: swe-bench-<dataset>.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="Cache root; the dataset is cached under <cache-dir>/swe-bench.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Never touch the network; fail if the dataset is not cached.",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Download the dataset again and replace the cache.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Threads generating and writing task files.",
     )
 
     args = parser.parse_args()
-
-    instances = load_swebench_lite()
-    selected = filter_fast_tasks(
+    suite = args.suite or f"swe-bench-{args.dataset}"
+    output_root = args.output_dir or Path("tasks") / f"{suite}-{args.limit or 'all'}"
+
+    cache = cache_path(args.cache_dir, args.dataset, args.split)
+    cold = args.refresh_cache or not cache.is_file()
+    stream = iter_instances(args.dataset, args.split, args.cache_dir, args.offline, args.refresh_cache)
+    if args.instance_id:
+        if cold:
+            # Read the download to the end, which writes the cache and its index (closing an
+            # unstarted generator would not run it at all).
+            deque(stream, maxlen=0)
+        instances = [read_instance(cache, iid) for iid in args.instance_id]
+        missing = [iid for iid, inst in zip(args.instance_id, instances) if inst is None]
+        if missing:
+            raise SystemExit(f"Not in SWE-bench {args.dataset}/{args.split}: {', '.join(missing)}")
+    else:
+        instances = iter_fast_tasks(stream, max_test_time_sec=args.max_test_time_sec, limit=args.limit)
+
+    written = write_tasks(
         instances,
-        max_test_time_sec=args.max_test_time_sec,
-        limit=args.limit,
+        output_root,
+        workers=args.workers,
+        suite=suite,
+        docker_image=args.docker_image,
+        timeout_sec=args.timeout_sec,
     )
-
-    output_root = args.output_dir
-    output_root.mkdir(parents=True, exist_ok=True)
-
-    for inst in selected:
-        task_dir = output_root / inst["instance_id"]
-        generate_task_yaml(
-            inst,
-            task_dir,
-            suite=args.suite,
-            docker_image=args.docker_image,
-            timeout_sec=args.timeout_sec,
-        )
-
-    print(f"Wrote {len(selected)} tasks to {output_root}")
+    if cold:
+        # --limit stops reading early; read the rest of the download so the cache is complete.
+        deque(stream, maxlen=0)
+    stream.close()
+    print(f"Wrote {written} tasks to {output_root}")
 
 
 if __name__ == "__main__":